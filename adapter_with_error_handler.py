@@ -1,8 +1,9 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-import traceback
+from contextvars import ContextVar
 from datetime import datetime
+from typing import Awaitable, Callable, Iterable, List, Optional
 
 from botbuilder.core import (
     BotFrameworkAdapter,
@@ -10,14 +11,55 @@ from botbuilder.core import (
     ConversationState,
     TurnContext,
 )
-from botbuilder.schema import ActivityTypes, Activity
+from botbuilder.core.bot_framework_adapter import USER_AGENT
+from botbuilder.schema import ActivityTypes, Activity, DeliveryModes, ResourceResponse
+from botframework.connector.aio import ConnectorClient
+from botframework.connector.auth import AppCredentials, ClaimsIdentity, MicrosoftAppCredentials
+
+from auth_cache import ValidatedTokenCache
+from connector_clients import ConnectorClientPool, merge_messages
+from metrics import METRICS
+
+REPLY_BUFFER_KEY = "AdapterWithErrorHandler.replies"
+# Where the replies of the running turn go when it came in over a stream instead of the Bot Connector.
+_STREAM_REPLIES: ContextVar[Optional[Callable[[List[Activity]], Awaitable]]] = ContextVar("stream_replies", default=None)
+OUTBOUND_CALLS = "bot_turn_outbound_calls"
+OUTBOUND_CALLS_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16)
+
+
+def _is_outbound_call(activity: Activity) -> bool:
+    # Mirrors BotFrameworkAdapter.send_activities: these never reach the connector.
+    if activity.type in ("delay", "invokeResponse"):
+        return False
+    return activity.type != ActivityTypes.trace or activity.channel_id == "emulator"
 
 
 class AdapterWithErrorHandler(BotFrameworkAdapter):
-    def __init__(self,settings: BotFrameworkAdapterSettings, conversation_state: ConversationState, logs):
+    def __init__(
+        self,
+        settings: BotFrameworkAdapterSettings,
+        conversation_state: ConversationState,
+        logs,
+        token_cache: ValidatedTokenCache = None,
+        connector_pool: ConnectorClientPool = None,
+        coalesce_replies: bool = False,
+        merge_channels: Iterable[str] = (),
+    ):
         super().__init__(settings)
         self._conversation_state = conversation_state
         self._logs = logs
+        self._token_cache = token_cache
+        self._connector_pool = connector_pool
+        # Replies of a turn are held until it ends and delivered in order by one send_activities call, which
+        # still posts them one by one: only worth the wait on channels where they are merged.
+        self._coalesce_replies = coalesce_replies
+        # Channels rendering consecutive text replies as a single message just as well.
+        self._merge_channels = set(merge_channels)
+        self.turns = 0
+        self.replies = 0
+        self.outbound_calls = 0
+        self.merged = 0
+        self.failed_deliveries = 0
         # Catch-all for errors.
         async def on_error(context: TurnContext, error: Exception):
             # This check writes out errors to console log
@@ -41,8 +83,123 @@ class AdapterWithErrorHandler(BotFrameworkAdapter):
 
             # Clear out state
             nonlocal self
-            self._logs.logger.error(f"\n [on_turn_error] unhandled error: {error}")
-            self._logs.logger.error(traceback.print_exc())
+            # The traceback is formatted by the logging thread, not on the turn.
+            self._logs.logger.error(f"\n [on_turn_error] unhandled error: {error}", exc_info=error)
             await self._conversation_state.delete(context)
 
         self.on_turn_error = on_error
+
+    async def authenticate_request(self, activity: Activity, auth_header: str) -> ClaimsIdentity:
+        """Validate the request's auth header on its own, for turns processed after the HTTP response."""
+        return await self._authenticate_request(activity, auth_header or "")
+
+    async def _authenticate_request(self, request: Activity, auth_header: str) -> ClaimsIdentity:
+        with METRICS.time("auth"):
+            if self._token_cache is None or not auth_header:
+                return await super()._authenticate_request(request, auth_header)
+            key = self._token_cache.key(auth_header, request.channel_id, request.service_url)
+            identity = self._token_cache.get(key)
+            if identity is not None:
+                # What a full validation would also do, so replies to this service url stay authenticated.
+                MicrosoftAppCredentials.trust_service_url(request.service_url)
+                return identity
+            identity = await super()._authenticate_request(request, auth_header)
+            self._token_cache.put(key, identity)
+            return identity
+
+    def _get_or_create_connector_client(self, service_url: str, credentials: AppCredentials) -> ConnectorClient:
+        if self._connector_pool is None:
+            return super()._get_or_create_connector_client(service_url, credentials)
+        return self._connector_pool.get(service_url, credentials, USER_AGENT)
+
+    async def run_pipeline(self, context: TurnContext, callback: Callable = None):
+        # Expected replies already go back in the HTTP response, without any outbound call.
+        if (
+            not self._coalesce_replies
+            or context.activity is None
+            or context.activity.channel_id not in self._merge_channels
+            or context.activity.delivery_mode == DeliveryModes.expect_replies
+        ):
+            return await super().run_pipeline(context, callback)
+
+        context.turn_state[REPLY_BUFFER_KEY] = []
+        try:
+            # The error handler's messages are buffered too, after what the turn sent before failing.
+            return await super().run_pipeline(context, callback)
+        finally:
+            await self._deliver_replies(context)
+
+    async def _deliver_replies(self, context: TurnContext) -> None:
+        replies = context.turn_state.pop(REPLY_BUFFER_KEY)
+        merged = merge_messages(replies)
+        self.merged += len(replies) - len(merged)
+        replies = merged
+        # Streamed replies share the inbound socket, they make no call.
+        outbound_calls = 0 if _STREAM_REPLIES.get() is not None else sum(map(_is_outbound_call, replies))
+        self.turns += 1
+        self.replies += len(replies)
+        self.outbound_calls += outbound_calls
+        METRICS.histogram(OUTBOUND_CALLS, "Bot Connector calls made by a turn.", OUTBOUND_CALLS_BUCKETS).observe(
+            outbound_calls)
+        if not replies:
+            return
+        try:
+            await self.send_activities(context, replies)
+        except Exception as error:
+            # The turn and its error handler are over: nothing can answer the user any more, and raising
+            # here would hide the turn's own exception, if it failed.
+            self.failed_deliveries += 1
+            self._logs.logger.error(
+                f"[AdapterWithErrorHandler]: delivering the turn's replies failed, {len(replies)} lost: {error}",
+                exc_info=error)
+
+    async def process_streamed_activity(
+        self,
+        activity: Activity,
+        identity: ClaimsIdentity,
+        logic: Callable,
+        send_replies: Callable[[List[Activity]], Awaitable],
+    ):
+        """Run a turn whose replies are handed to ``send_replies`` rather than posted to the Bot Connector."""
+        # The turn runs in this task, or in tasks created from it, so they all see the variable.
+        token = _STREAM_REPLIES.set(send_replies)
+        try:
+            return await self.process_activity_with_identity(activity, identity, logic)
+        finally:
+            _STREAM_REPLIES.reset(token)
+
+    async def send_activities(self, context: TurnContext, activities: List[Activity]) -> List[ResourceResponse]:
+        replies = context.turn_state.get(REPLY_BUFFER_KEY)
+        if replies is not None:
+            replies.extend(activities)
+            return [ResourceResponse(id=activity.id or "") for activity in activities]
+        send_replies = _STREAM_REPLIES.get()
+        if send_replies is not None:
+            return await self._stream_activities(context, activities, send_replies)
+        with METRICS.time("send_activities"):
+            return await super().send_activities(context, activities)
+
+    async def _stream_activities(
+        self, context: TurnContext, activities: List[Activity], send_replies: Callable[[List[Activity]], Awaitable]
+    ) -> List[ResourceResponse]:
+        streamed = []
+        for activity in activities:
+            if activity.type == "invokeResponse":
+                # Answered with the turn's outcome, like the HTTP response of an inline turn.
+                context.turn_state[self._INVOKE_RESPONSE_KEY] = activity
+            elif _is_outbound_call(activity):
+                streamed.append(activity)
+        if streamed:
+            with METRICS.time("send_activities", delivery="stream"):
+                await send_replies(streamed)
+        return [ResourceResponse(id=activity.id or "") for activity in activities]
+
+    def stats(self) -> dict:
+        return {
+            "turns": self.turns,
+            "replies": self.replies,
+            "outbound_calls": self.outbound_calls,
+            "outbound_calls_per_turn": self.outbound_calls / self.turns if self.turns else 0.0,
+            "merged": self.merged,
+            "failed_deliveries": self.failed_deliveries,
+        }
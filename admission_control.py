@@ -0,0 +1,147 @@
+"""Caps the turns in flight on a worker, queueing a bounded number and rejecting the rest early."""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable
+
+
+class AdmissionRejected(Exception):
+    """Raised when a turn can not start soon enough; ``retry_after`` is in whole seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super(AdmissionRejected, self).__init__(f"[AdmissionController]: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Concurrency limit adjusted with AIMD from turn latency, in front of a bounded FIFO queue.
+
+    Every turn finishing under ``target_latency`` raises the limit by ``1 / limit`` (about one per
+    window of turns), a slower one multiplies it by ``decrease_factor``, once per window: the turns
+    already in flight at a decrease ran under the old limit and do not decrease it again. Waiters
+    that do not get a slot within ``queue_timeout`` and arrivals finding ``max_queue`` waiters are
+    rejected, so the channel can retry elsewhere instead of timing out on us.
+    """
+
+    def __init__(
+        self,
+        max_limit: int = 128,
+        min_limit: int = 4,
+        max_queue: int = 256,
+        queue_timeout: float = 2.0,
+        target_latency: float = 1.5,
+        decrease_factor: float = 0.9,
+        clock: Callable[[], float] = time.perf_counter,
+    ):
+        if not 0 < min_limit <= max_limit:
+            raise ValueError("[AdmissionController]: expected 0 < min_limit <= max_limit")
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+        self._clock = clock
+        self.limit = float(max_limit)
+        self.inflight = 0
+        # Turns admitted before the last decrease and still running.
+        self._before_decrease = 0
+        self._waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.queue_seconds = 0.0
+        self.mean_latency = 0.0
+
+    def retry_after(self) -> int:
+        # Time for the queue ahead to drain at the current limit, rounded up to the second.
+        backlog = (len(self._waiters) + 1) / max(int(self.limit), 1)
+        return max(1, math.ceil(backlog * (self.mean_latency or self.target_latency)))
+
+    async def acquire(self) -> float:
+        """Wait for a slot and return the seconds spent queued, or raise AdmissionRejected."""
+        if self.inflight < int(self.limit) and not self._waiters:
+            self.inflight += 1
+            self.admitted += 1
+            return 0.0
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected("queue full", self.retry_after())
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        start = self._clock()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # wait_for may time out right after release() handed us the slot.
+            if waiter.cancelled():
+                self._forget(waiter)
+                self.rejected += 1
+                self.timeouts += 1
+                raise AdmissionRejected("queue timeout", self.retry_after())
+        except asyncio.CancelledError:
+            self._forget(waiter)
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            raise
+
+        queued = self._clock() - start
+        self.queue_seconds += queued
+        self.admitted += 1
+        return queued
+
+    def release(self, latency: float) -> None:
+        """Give the slot back and adapt the limit to how long the turn took."""
+        self.mean_latency = latency if not self.mean_latency else 0.9 * self.mean_latency + 0.1 * latency
+        before_decrease = self._before_decrease > 0
+        if before_decrease:
+            self._before_decrease -= 1
+        if latency > self.target_latency:
+            if not before_decrease:
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self._before_decrease = self.inflight - 1
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        self.inflight -= 1
+        while self._waiters and self.inflight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.inflight += 1
+            waiter.set_result(None)
+
+    def _forget(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    @asynccontextmanager
+    async def admit(self):
+        """``async with controller.admit() as queue_seconds:`` around a turn."""
+        queued = await self.acquire()
+        start = self._clock()
+        try:
+            yield queued
+        finally:
+            self.release(self._clock() - start)
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "inflight": self.inflight,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "queue_seconds": self.queue_seconds,
+            "mean_latency": self.mean_latency,
+        }
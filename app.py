@@ -1,9 +1,13 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+import asyncio
+import time
+
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from opencensus.ext.azure.trace_exporter import AzureExporter
 from opencensus.ext.azure.log_exporter import AzureLogHandler
-from opencensus.trace.samplers import ProbabilitySampler
+from opencensus.trace import execution_context
+from opencensus.trace.samplers import AlwaysOnSampler
 from opencensus.trace.tracer import Tracer
 from opencensus.trace.span import SpanKind
 from opencensus.trace.attributes_helper import COMMON_ATTRIBUTES
@@ -11,33 +15,137 @@ from opencensus.trace.attributes_helper import COMMON_ATTRIBUTES
 from botbuilder.core import (
     BotFrameworkAdapterSettings,
     ConversationState,
-    MemoryStorage,
     UserState)
-from botbuilder.schema import Activity
+from botbuilder.schema import Activity, ActivityTypes, DeliveryModes
+from botframework.connector.auth import MicrosoftAppCredentials
 
 from config import DefaultConfig
 from dialogs import MainDialog, BookingDialog
 from bots import DialogAndWelcomeBot
 
 from adapter_with_error_handler import AdapterWithErrorHandler
+from admission_control import AdmissionController, AdmissionRejected
+from auth_cache import OpenIdMetadataRefresher, ValidatedTokenCache
+from background_turns import BackgroundTurnQueue
+from booking_analytics import BookingAnalytics, custom_dimensions
+from bounded_memory_storage import BoundedMemoryStorage
+from connector_clients import ConnectorClientPool
 from flight_booking_recognizer import FlightBookingRecognizer
+from helpers.date_parser import DATE_PARSER
+from helpers.datetime_resolver import DATETIME_RESOLVER
+from lean_activity import LeanActivity, lean_activity
 from logger import AzureLogger
+from metrics import METRICS
+from sqlite_storage import SqliteStorage
+from streaming import StreamingEndpoint, stream_credentials
+from tracing import TailSamplingExporter
+from turn_scheduler import TurnScheduler
+from warm_start import WarmStart
 
 CONFIG = DefaultConfig()
 exporter = AzureExporter(connection_string=f"InstrumentationKey={CONFIG.APPINSIGHTS_INSTRUMENTATIONKEY}")
-handler = AzureLogHandler(connection_string=f"InstrumentationKey={CONFIG.APPINSIGHTS_INSTRUMENTATIONKEY}")
-sampler = ProbabilitySampler(1.0)
-LOGS = AzureLogger(handler)
+handler = AzureLogHandler(
+    connection_string=f"InstrumentationKey={CONFIG.APPINSIGHTS_INSTRUMENTATIONKEY}",
+    max_batch_size=CONFIG.LOG_BATCH_SIZE,
+    export_interval=CONFIG.LOG_EXPORT_INTERVAL)
+# Every request is traced, the spans are only exported once its outcome says the trace is worth keeping.
+sampler = AlwaysOnSampler()
+TRACES = TailSamplingExporter(
+    exporter,
+    sample_rate=CONFIG.TRACE_SAMPLE_RATE,
+    slow_threshold=CONFIG.TRACE_SLOW_THRESHOLD,
+    max_queue=CONFIG.TRACE_QUEUE_SIZE,
+    batch_size=CONFIG.TRACE_BATCH_SIZE,
+    export_interval=CONFIG.TRACE_EXPORT_INTERVAL)
+LOGS = AzureLogger(handler, max_queue=CONFIG.LOG_QUEUE_SIZE, batch_size=CONFIG.LOG_BATCH_SIZE)
 
 SETTINGS = BotFrameworkAdapterSettings(CONFIG.APP_ID, CONFIG.APP_PASSWORD)
-MEMORY = MemoryStorage()
+if CONFIG.STATE_STORAGE == "memory":
+    MEMORY = BoundedMemoryStorage(CONFIG.STATE_MEMORY_MAX_BYTES, CONFIG.STATE_IDLE_TTL)
+else:
+    MEMORY = SqliteStorage(
+        CONFIG.STATE_STORAGE_PATH,
+        shards=CONFIG.STATE_STORAGE_SHARDS,
+        flush_interval=CONFIG.STATE_FLUSH_INTERVAL,
+        write_behind=CONFIG.STATE_WRITE_BEHIND)
 USER_STATE = UserState(MEMORY)
 CONVERSATION_STATE = ConversationState(MEMORY)
-ADAPTER = AdapterWithErrorHandler(SETTINGS, CONVERSATION_STATE, LOGS)
+TOKEN_CACHE = ValidatedTokenCache(CONFIG.AUTH_CACHE_SIZE) if CONFIG.AUTH_CACHE_SIZE > 0 else None
+OPEN_ID_METADATA = OpenIdMetadataRefresher(interval=CONFIG.AUTH_METADATA_REFRESH_INTERVAL)
+CONNECTORS = ConnectorClientPool(CONFIG.CONNECTOR_POOL_SIZE, CONFIG.CONNECTOR_POOL_PER_HOST)
+ADAPTER = AdapterWithErrorHandler(
+    SETTINGS,
+    CONVERSATION_STATE,
+    LOGS,
+    token_cache=TOKEN_CACHE,
+    connector_pool=CONNECTORS,
+    coalesce_replies=CONFIG.COALESCE_REPLIES,
+    merge_channels=CONFIG.REPLY_MERGE_CHANNELS)
 RECOGNIZER = FlightBookingRecognizer(CONFIG)
-BOOKING_DIALOG = BookingDialog(LOGS)
+if RECOGNIZER.breaker is not None:
+    RECOGNIZER.breaker.add_listener(lambda old_state, state: LOGS.logger.warning('LUIS circuit breaker', extra={
+        'custom_dimensions': {'from_state': old_state, 'to_state': state, **RECOGNIZER.breaker.transitions}}))
+ANALYTICS = BookingAnalytics(CONFIG.ANALYTICS_TOP_ROUTES)
+BOOKING_DIALOG = BookingDialog(LOGS, analytics=ANALYTICS, log_events=CONFIG.BOOKING_EVENT_LOGS)
 DIALOG = MainDialog(RECOGNIZER, BOOKING_DIALOG)
-BOT = DialogAndWelcomeBot(CONVERSATION_STATE, USER_STATE, DIALOG)
+BOT = DialogAndWelcomeBot(CONVERSATION_STATE, USER_STATE, DIALOG, MEMORY)
+SCHEDULER = TurnScheduler(CONFIG.TURN_CONCURRENCY)
+ADMISSION = AdmissionController(
+    max_limit=CONFIG.ADMISSION_MAX_INFLIGHT,
+    min_limit=CONFIG.ADMISSION_MIN_INFLIGHT,
+    max_queue=CONFIG.ADMISSION_QUEUE_SIZE,
+    queue_timeout=CONFIG.ADMISSION_QUEUE_TIMEOUT,
+    target_latency=CONFIG.ADMISSION_TARGET_LATENCY)
+BACKGROUND_TURNS = BackgroundTurnQueue(
+    lambda activity, identity: SCHEDULER.run(
+        activity.conversation.id if activity.conversation else None,
+        lambda: ADAPTER.process_activity_with_identity(activity, identity, BOT.on_turn)),
+    workers=CONFIG.ASYNC_TURN_WORKERS,
+    max_queue=CONFIG.ASYNC_TURN_QUEUE_SIZE)
+
+
+
+async def run_streamed_turn(activity: Activity, identity, send_replies):
+    conversation_id = activity.conversation.id if activity.conversation else None
+    try:
+        async with ADMISSION.admit():
+            response = await SCHEDULER.run(
+                conversation_id,
+                lambda: ADAPTER.process_streamed_activity(activity, identity, BOT.on_turn, send_replies))
+    except AdmissionRejected as rejection:
+        return 503, {"message": "Service overloaded, retry later", "retry_after": rejection.retry_after}
+    if response:
+        return response.status, response.body
+    return 200, {"message": "OK"}
+
+
+STREAMING = StreamingEndpoint(run_streamed_turn, window=CONFIG.STREAM_WINDOW, max_streams=CONFIG.STREAM_MAX_STREAMS)
+# The OpenID metadata needs no warming, its refresh starts with the worker.
+CHANNEL_CREDENTIALS = MicrosoftAppCredentials(CONFIG.APP_ID, CONFIG.APP_PASSWORD) if CONFIG.APP_ID else None
+WARM_START = WarmStart(
+    BOT,
+    connects={"luis": RECOGNIZER.connect, "connector": lambda: CONNECTORS.connect(CHANNEL_CREDENTIALS)},
+    timeout=CONFIG.WARM_START_TIMEOUT)
+
+METRICS.spans = CONFIG.METRICS_SPANS
+METRICS.register_stats("admission", ADMISSION.stats)
+METRICS.register_stats("scheduler", SCHEDULER.stats)
+METRICS.register_stats("background_turns", BACKGROUND_TURNS.stats)
+METRICS.register_stats("state", BOT.state_persister.stats)
+METRICS.register_stats("storage", MEMORY.stats)
+METRICS.register_stats("recognizer", RECOGNIZER.stats)
+METRICS.register_stats("datetime_resolver", DATETIME_RESOLVER.stats)
+METRICS.register_stats("date_parser", DATE_PARSER.stats)
+METRICS.register_stats("traces", TRACES.stats)
+METRICS.register_stats("logs", LOGS.stats)
+if TOKEN_CACHE is not None:
+    METRICS.register_stats("auth_cache", TOKEN_CACHE.stats)
+METRICS.register_stats("open_id_metadata", OPEN_ID_METADATA.stats)
+METRICS.register_stats("connector", CONNECTORS.stats)
+METRICS.register_stats("replies", ADAPTER.stats)
+METRICS.register_stats("streaming", STREAMING.stats)
+METRICS.register_stats("lean_activities", LeanActivity.stats)
+METRICS.register_stats("warm_start", WARM_START.stats)
 
 app = FastAPI()
 
@@ -47,36 +155,190 @@ HTTP_STATUS_CODE = COMMON_ATTRIBUTES['HTTP_STATUS_CODE']
 
 # fastapi middleware for opencensus
 @app.middleware("http")
-async def middlewareOpencensus(request: Request, call_next):  
-    tracer = Tracer(exporter=exporter, sampler=sampler)       
-    with tracer.span("main") as span:
-        span.span_kind = SpanKind.SERVER
-        response = await call_next(request)
-
-        tracer.add_attribute_to_current_span(
-            attribute_key=HTTP_STATUS_CODE,
-            attribute_value=response.status_code)
-        tracer.add_attribute_to_current_span(
-            attribute_key=HTTP_URL,
-            attribute_value=str(request.url))
+async def middlewareOpencensus(request: Request, call_next):
+    # The tracer holds this request's span stack, only the exporter and sampler behind it are shared.
+    tracer = Tracer(exporter=TRACES, sampler=sampler)
+    trace_id = tracer.span_context.trace_id
+    TRACES.start_trace(trace_id)
+    start = time.perf_counter()
+    error = True
+    try:
+        with tracer.span("main") as span:
+            span.span_kind = SpanKind.SERVER
+            response = await call_next(request)
+            error = response.status_code >= 500
+
+            tracer.add_attribute_to_current_span(
+                attribute_key=HTTP_STATUS_CODE,
+                attribute_value=response.status_code)
+            tracer.add_attribute_to_current_span(
+                attribute_key=HTTP_URL,
+                attribute_value=str(request.url))
+    finally:
+        TRACES.finish_trace(trace_id, error, time.perf_counter() - start)
     return response
 
 
+@app.on_event("startup")
+async def start_background_turns():
+    if CONFIG.ASYNC_TURNS:
+        BACKGROUND_TURNS.start()
+
+
+@app.on_event("startup")
+async def start_open_id_metadata_refresh():
+    # Without an app id requests are not authenticated, there are no tokens to validate.
+    if CONFIG.APP_ID:
+        OPEN_ID_METADATA.start()
+
+
+@app.on_event("startup")
+async def start_warm_start():
+    # The worker serves as soon as it starts, /ready tells when it is warm.
+    if CONFIG.WARM_START:
+        WARM_START.start()
+
+
+@app.on_event("shutdown")
+async def stop_warm_start():
+    await WARM_START.stop()
+
+
+@app.on_event("shutdown")
+async def stop_open_id_metadata_refresh():
+    await OPEN_ID_METADATA.stop()
+
+
+def emit_analytics(aggregates: dict) -> None:
+    LOGS.logger.warning('Booking analytics', extra={'custom_dimensions': custom_dimensions(aggregates)})
+
+
+@app.on_event("startup")
+async def start_analytics():
+    ANALYTICS.start(CONFIG.ANALYTICS_FLUSH_INTERVAL, emit_analytics)
+
+
+@app.on_event("shutdown")
+async def stop_analytics():
+    await ANALYTICS.stop(emit_analytics)
+
+
+@app.on_event("shutdown")
+async def drain_background_turns():
+    if CONFIG.ASYNC_TURNS:
+        await BACKGROUND_TURNS.drain(CONFIG.ASYNC_TURN_DRAIN_TIMEOUT)
+
+
+@app.on_event("shutdown")
+async def close_recognizer():
+    await RECOGNIZER.close()
+
+
+@app.on_event("shutdown")
+async def close_connectors():
+    await CONNECTORS.close()
+
+
+@app.on_event("shutdown")
+async def flush_traces():
+    await asyncio.get_event_loop().run_in_executor(None, TRACES.flush)
+
+
+@app.on_event("shutdown")
+async def flush_logs():
+    await asyncio.get_event_loop().run_in_executor(None, LOGS.flush)
+
+
+@app.on_event("shutdown")
+async def flush_state():
+    if isinstance(MEMORY, SqliteStorage):
+        await MEMORY.close()
+
+
 @app.get("/health_check")
 def check():
     return {'message': 'Flight Bot is running'}
 
 
+@app.get("/ready")
+def ready():
+    # Liveness is /health_check, this one keeps the worker out of rotation until it is warm.
+    if CONFIG.WARM_START and not WARM_START.done:
+        return JSONResponse(status_code=503, content={"message": "Warming up"})
+    return {"message": "Ready", "warm_start": WARM_START.profile}
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/analytics")
+def analytics(request: Request):
+    # Business aggregates stay on the host, App Insights gets them through the periodic flush.
+    if request.client is None or request.client.host not in ("127.0.0.1", "::1"):
+        return JSONResponse(status_code=403, content={"message": "Forbidden"})
+    return ANALYTICS.snapshot()
+
+
+@app.websocket("/api/stream")
+async def stream(websocket: WebSocket):
+    # Authenticated once for the whole connection, with the channel its activities must all come from.
+    channel_id = websocket.query_params.get("channelId", "webchat")
+    auth_header, subprotocol = stream_credentials(websocket)
+    try:
+        identity = await ADAPTER.authenticate_request(Activity(channel_id=channel_id), auth_header)
+    except PermissionError:
+        # Closing before accepting turns the handshake down with a 403.
+        await websocket.close(code=1008)
+        return
+    await STREAMING.serve(websocket, identity, channel_id, subprotocol)
+
+
 @app.post("/api/messages")
 async def messages(req: Request):
     if "application/json" in req.headers["content-type"]:
-        body = await req.json()
+        body = await req.body()
         auth_header = req.headers["authorization"] if "authorization" in req.headers else ""
     else:
         return JSONResponse(status_code=415, content={"message": "Unsupported media type"})
     
-    activity = Activity().deserialize(body)
-    response = await ADAPTER.process_activity(activity, auth_header, BOT.on_turn)
+    with METRICS.time("deserialize"):
+        activity = lean_activity(body)
+    # Invokes and expectReplies deliveries answer in the HTTP response, they always run inline.
+    if (CONFIG.ASYNC_TURNS
+            and activity.type != ActivityTypes.invoke
+            and activity.delivery_mode != DeliveryModes.expect_replies):
+        try:
+            identity = await ADAPTER.authenticate_request(activity, auth_header)
+        except PermissionError:
+            return JSONResponse(status_code=401, content={"message": "Unauthorized"})
+        if not BACKGROUND_TURNS.submit(activity, identity):
+            LOGS.logger.warning('Turn rejected', extra={'custom_dimensions': {
+                'reason': 'background queue full', **BACKGROUND_TURNS.stats()}})
+            return JSONResponse(
+                status_code=503,
+                headers={"Retry-After": "1"},
+                content={"message": "Service overloaded, retry later"})
+        return JSONResponse(status_code=202, content={'message': 'Accepted'})
+
+    # Turns of one conversation run in arrival order so they never interleave their state load and save.
+    conversation_id = activity.conversation.id if activity.conversation else None
+    tracer = execution_context.get_opencensus_tracer()
+    try:
+        async with ADMISSION.admit() as queue_seconds:
+            tracer.add_attribute_to_current_span(attribute_key="admission.queue_ms", attribute_value=queue_seconds * 1000)
+            tracer.add_attribute_to_current_span(attribute_key="admission.limit", attribute_value=int(ADMISSION.limit))
+            response = await SCHEDULER.run(
+                conversation_id, lambda: ADAPTER.process_activity(activity, auth_header, BOT.on_turn))
+    except AdmissionRejected as rejection:
+        tracer.add_attribute_to_current_span(attribute_key="admission.rejected", attribute_value=rejection.reason)
+        LOGS.logger.warning('Turn rejected', extra={'custom_dimensions': {
+            'reason': rejection.reason, 'retry_after': rejection.retry_after, **ADMISSION.stats()}})
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": str(rejection.retry_after)},
+            content={"message": "Service overloaded, retry later"})
     if response:
         return JSONResponse(status_code=response.status, content=response.body)
     return JSONResponse(status_code=200, content={'message': 'OK'})
@@ -0,0 +1,154 @@
+"""Validated Bot Framework token cache and background refresh of the OpenID signing keys."""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+
+import requests
+from botframework.connector.auth import AuthenticationConstants, ClaimsIdentity
+from botframework.connector.auth.jwt_token_extractor import JwtTokenExtractor
+
+LOGGER = logging.getLogger(__name__)
+
+# Signing keys the SDK fetches on its first validations, refreshed here before it would do it on a turn.
+OPEN_ID_METADATA_URLS = (
+    AuthenticationConstants.TO_BOT_FROM_CHANNEL_OPEN_ID_METADATA_URL,
+    AuthenticationConstants.TO_BOT_FROM_EMULATOR_OPEN_ID_METADATA_URL,
+)
+
+
+class ValidatedTokenCache:
+    """Claims of the auth headers already validated, until their token expires.
+
+    Entries are keyed on a hash of the header along with the channel and service url the token was
+    validated for, since both take part in the validation. At most ``max_entries`` tokens are kept,
+    the least recently used ones are evicted first.
+    """
+
+    def __init__(self, max_entries: int = 10000, clock: Callable[[], float] = time.time):
+        if max_entries <= 0:
+            raise ValueError("[ValidatedTokenCache]: max_entries must be positive")
+        self.max_entries = max_entries
+        self._clock = clock
+        # key -> (claims identity, token expiry as a unix timestamp), least recently used first
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(auth_header: str, channel_id: str, service_url: str) -> bytes:
+        return hashlib.blake2b(f"{auth_header}\n{channel_id}\n{service_url}".encode(), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[ClaimsIdentity]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        identity, expires_at = entry
+        if self._clock() >= expires_at:
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return identity
+
+    def put(self, key: bytes, identity: ClaimsIdentity) -> None:
+        """Cache an authenticated identity until the ``exp`` claim of its token, if it has one."""
+        expires_at = identity.claims.get("exp") if identity.claims else None
+        if not identity.is_authenticated or not isinstance(expires_at, (int, float)):
+            return
+        if expires_at <= self._clock():
+            return
+        self._entries[key] = (identity, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+
+def _fetch_signing_keys(url: str, timeout: float) -> list:
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    response_keys = requests.get(response.json()["jwks_uri"], timeout=timeout)
+    response_keys.raise_for_status()
+    return response_keys.json()["keys"]
+
+
+class OpenIdMetadataRefresher:
+    """Refreshes the SDK's OpenID metadata every ``interval`` seconds off the event loop.
+
+    The SDK downloads the signing keys with blocking requests on the turn that finds them older than a
+    day. Refreshing them here well before that keeps the download off the turns; a failed refresh is
+    retried after ``retry_interval`` seconds, the keys in place stay valid meanwhile.
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str] = OPEN_ID_METADATA_URLS,
+        interval: float = 12 * 3600,
+        retry_interval: float = 60.0,
+        timeout: float = 10.0,
+    ):
+        self.urls = list(urls)
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.refreshes = 0
+        self.failures = 0
+        self._task = None
+
+    async def refresh(self) -> bool:
+        """Refresh every known metadata url now, returns whether they all succeeded."""
+        loop = asyncio.get_event_loop()
+        for url in self.urls:
+            JwtTokenExtractor.get_open_id_metadata(url)
+        succeeded = True
+        for url, metadata in list(JwtTokenExtractor.metadataCache.items()):
+            try:
+                keys = await loop.run_in_executor(None, _fetch_signing_keys, metadata.url, self.timeout)
+            except Exception as error:
+                self.failures += 1
+                succeeded = False
+                LOGGER.error(f"[OpenIdMetadataRefresher]: refresh of {url} failed: {error}")
+                continue
+            # Swapped on the event loop, between two validations.
+            metadata.keys = keys
+            metadata.last_updated = datetime.now()
+            self.refreshes += 1
+        return succeeded
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._refresh_every())
+
+    async def _refresh_every(self) -> None:
+        while True:
+            succeeded = await self.refresh()
+            await asyncio.sleep(self.interval if succeeded else self.retry_interval)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"refreshes": self.refreshes, "failures": self.failures}
@@ -0,0 +1,100 @@
+"""Runs turns after /api/messages already answered, replies go out through the Bot Connector."""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from botbuilder.schema import Activity
+from botframework.connector.auth import ClaimsIdentity
+
+LOGGER = logging.getLogger(__name__)
+
+
+class BackgroundTurnQueue:
+    """Bounded queue of authenticated activities consumed by a fixed pool of worker tasks.
+
+    ``process`` runs one turn. Workers take activities in arrival order and hand them on without
+    awaiting in between, so the order of a conversation is kept by whatever ``process`` queues them in.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[Activity, ClaimsIdentity], Awaitable],
+        workers: int = 32,
+        max_queue: int = 1000,
+    ):
+        if workers <= 0:
+            raise ValueError("[BackgroundTurnQueue]: workers must be positive")
+        self._process = process
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue = None
+        self._tasks = []
+        self.accepting = False
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.queue_seconds = 0.0
+
+    def start(self) -> None:
+        """Create the queue and workers on the running loop, e.g. from the application startup event."""
+        self._queue = asyncio.Queue(self.max_queue)
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        self.accepting = True
+
+    def submit(self, activity: Activity, identity: ClaimsIdentity) -> bool:
+        """Queue a turn, ``False`` when the queue is full or draining."""
+        if not self.accepting:
+            self.rejected += 1
+            return False
+        try:
+            self._queue.put_nowait((activity, identity, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.submitted += 1
+        return True
+
+    async def _work(self) -> None:
+        while True:
+            activity, identity, queued_at = await self._queue.get()
+            self.queue_seconds += time.perf_counter() - queued_at
+            try:
+                await self._process(activity, identity)
+                self.completed += 1
+            except Exception as error:
+                # The adapter already ran on_turn_error for bot errors, this is anything around it.
+                self.failed += 1
+                LOGGER.error(f"[BackgroundTurnQueue]: turn for conversation "
+                             f"{getattr(activity.conversation, 'id', None)} failed: {error}")
+            finally:
+                self._queue.task_done()
+
+    async def drain(self, timeout: float = 25.0) -> bool:
+        """Stop accepting turns, finish the queued ones within ``timeout`` and stop the workers."""
+        self.accepting = False
+        if self._queue is None:
+            return True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+            drained = True
+        except asyncio.TimeoutError:
+            LOGGER.error(f"[BackgroundTurnQueue]: {self._queue.qsize()} turns still queued after {timeout}s drain")
+            drained = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        return drained
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "mean_queue_seconds": self.queue_seconds / (self.completed + self.failed or 1),
+        }
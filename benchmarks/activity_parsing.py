@@ -0,0 +1,62 @@
+"""Micro-benchmark of inbound activity parsing: lean_activity against json + msrest's Activity.deserialize.
+
+Run from the repository root: ``python benchmarks/activity_parsing.py``.
+"""
+
+import json
+import os
+import sys
+import timeit
+
+import orjson
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from botbuilder.schema import Activity  # noqa: E402
+from lean_activity import lean_activity  # noqa: E402
+
+ACCOUNTS = {
+    "from": {"id": "29:1a2b3c", "name": "Ada", "aadObjectId": "6b2f2c8e-0000-0000-0000-000000000000"},
+    "recipient": {"id": "28:bot-id", "name": "FlyMe"},
+    "conversation": {"id": "a:1XyZ", "conversationType": "personal", "tenantId": "72f988bf-0000"},
+}
+ACTIVITIES = {
+    "conversationUpdate": dict(
+        ACCOUNTS, type="conversationUpdate", id="f:1", channelId="webchat", serviceUrl="https://webchat.botframework.com/",
+        timestamp="2022-08-12T10:00:00.000Z", membersAdded=[{"id": "29:1a2b3c", "name": "Ada"}], locale="en-US"),
+    "message": dict(
+        ACCOUNTS, type="message", id="f:2", channelId="webchat", serviceUrl="https://webchat.botframework.com/",
+        timestamp="2022-08-12T10:00:01.000Z", localTimestamp="2022-08-12T12:00:01.000+02:00", locale="en-US",
+        text="book a flight from paris to new york on august 12", textFormat="plain",
+        entities=[{"type": "ClientCapabilities", "requiresBotState": True, "supportsListening": True}]),
+    "teams message": dict(
+        ACCOUNTS, type="message", id="f:3", channelId="msteams", serviceUrl="https://smba.trafficmanager.net/emea/",
+        timestamp="2022-08-12T10:00:02.000Z", locale="en-GB", text="<at>FlyMe</at> 1500 euros",
+        entities=[{"type": "mention", "text": "<at>FlyMe</at>", "mentioned": {"id": "28:bot-id", "name": "FlyMe"}}],
+        channelData={"tenant": {"id": "72f988bf-0000"}, "teamsChannelId": "19:abc"}),
+}
+
+
+def legacy_parse(raw: bytes) -> Activity:
+    """The /api/messages handler before lean activities: ``await req.json()`` then msrest."""
+    return Activity().deserialize(json.loads(raw))
+
+
+def main(number: int = 5000):
+    for name, body in ACTIVITIES.items():
+        raw = orjson.dumps(body)
+        assert lean_activity(raw).serialize() == legacy_parse(raw).serialize()
+
+        timings = {
+            "json + Activity.deserialize": timeit.timeit(lambda: legacy_parse(raw), number=number) / number,
+            "lean_activity": timeit.timeit(lambda: lean_activity(raw), number=number) / number,
+            # Reading a field outside HOT_FIELDS deserializes the whole body once.
+            "lean_activity + cold field": timeit.timeit(lambda: lean_activity(raw).timestamp, number=number) / number,
+        }
+        baseline = timings["json + Activity.deserialize"]
+        print(f"{name} ({len(raw)} bytes)")
+        for label, seconds in timings.items():
+            print(f"  {label:<40} {seconds * 1e6:9.1f}us  x{baseline / seconds:.1f}")
+
+
+if __name__ == "__main__":
+    main()
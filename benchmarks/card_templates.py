@@ -0,0 +1,51 @@
+"""Micro-benchmark of the booked flight card: compiled CardTemplate against the former str/re.sub/eval path.
+
+Run from the repository root: ``python benchmarks/card_templates.py``.
+"""
+
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from helpers.card_template import CARDS_DIR, CardTemplate  # noqa: E402
+
+DATA = {
+    "origin": "paris",
+    "destination": "new york",
+    "start_date": "12-08-2022",
+    "end_date": "26-08-2022",
+    "budget": "1500 euros",
+}
+
+
+def legacy_render(data: dict) -> dict:
+    """MainDialog.create_adaptive_card_attachment before the card template engine."""
+    with open(os.path.join(CARDS_DIR, "bookedFlightCard.json")) as card_file:
+        card = json.load(card_file)
+    string_temp = str(card)
+    for key in data:
+        string_temp = re.sub("\\${" + key + "}", str(data[key]), string_temp)
+    return eval(string_temp)
+
+
+def main(number: int = 2000, batch: int = 100):
+    template = CardTemplate.load(os.path.join(CARDS_DIR, "bookedFlightCard.json"))
+    assert template.render(DATA) == legacy_render(DATA)
+
+    rows = [DATA] * batch
+    timings = {
+        "legacy (read + re.sub + eval)": timeit.timeit(lambda: legacy_render(DATA), number=number) / number,
+        "CardTemplate.render": timeit.timeit(lambda: template.render(DATA), number=number) / number,
+        f"CardTemplate.render_many (per card, batch of {batch})":
+            timeit.timeit(lambda: template.render_many(rows), number=number // batch or 1) / (number // batch or 1) / batch,
+    }
+    baseline = timings["legacy (read + re.sub + eval)"]
+    for name, seconds in timings.items():
+        print(f"{name:<55} {seconds * 1e6:9.1f}us  x{baseline / seconds:.1f}")
+
+
+if __name__ == "__main__":
+    main()
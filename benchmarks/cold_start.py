@@ -0,0 +1,151 @@
+"""Cold start profile of a worker: import time of ``app`` and latency of its first conversations.
+
+The import report comes from ``python -X importtime``: the time spent importing the modules of each
+top-level package, their own imports of other packages excluded. Each scenario then runs in a fresh
+process and takes the warm-up conversation of ``warm_start`` through ``BOT.on_turn`` twice, on
+in-memory adapters, timing every turn:
+
+- cold: the worker imports the app and serves at once;
+- preloaded: ``warm_start.preload`` ran before the process forked, as in the gunicorn master;
+- warm: the worker waits for ``WARM_START`` before serving, as /ready makes it.
+
+Recognition uses the offline model and its cache is off, so no network is involved.
+
+Run from the repository root: ``python benchmarks/cold_start.py``.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+APP_ID = "00000000-0000-0000-0000-000000000000"
+# Read by config.py when app is imported.
+ENVIRONMENT = {
+    "SecretsProvider": "env",
+    "LuisAppId": APP_ID,
+    "LuisAPIKey": APP_ID,
+    "LuisAPIHostName": "luis.invalid",
+    "InstrumentationKey": APP_ID,
+    "MicrosoftAppId": "",
+    "MicrosoftAppPassword": "",
+    "RecognizerBackend": "local",
+    "LuisCacheTTL": "0",
+    "StateStorage": "memory",
+}
+SCENARIOS = ("cold", "preloaded", "warm")
+
+
+def import_times(top: int) -> list:
+    """(package, seconds) of the ``top`` packages ``import app`` spends the most time importing."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT, env={**os.environ, **ENVIRONMENT}, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, timeout=300)
+    packages = defaultdict(int)
+    for line in process.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, _, name = line.split("|")
+        own = own.split(":")[1].strip()
+        if own.isdigit():
+            packages[name.strip().split(".")[0]] += int(own)
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [(package, microseconds / 1e6) for package, microseconds in ranked]
+
+
+async def conversation(bot, conversation_id: str) -> list:
+    """Seconds of each turn of the warm-up conversation, on a conversation of its own."""
+    from botbuilder.core.adapters import TestAdapter
+    from botbuilder.schema import Activity, ActivityTypes, ChannelAccount, ConversationAccount
+    from warm_start import CONVERSATION
+
+    adapter = TestAdapter(template_or_conversation=Activity(
+        channel_id="test",
+        service_url="https://test.invalid",
+        from_property=ChannelAccount(id="user", name="user"),
+        recipient=ChannelAccount(id="bot", name="Bot"),
+        conversation=ConversationAccount(id=conversation_id),
+    ))
+    activities = [Activity(type=ActivityTypes.conversation_update, members_added=[ChannelAccount(id="user")])]
+    activities += [Activity(type=ActivityTypes.message, text=text) for text in CONVERSATION]
+    timings = []
+    for activity in activities:
+        start = time.perf_counter()
+        await adapter.process_activity(activity, bot.on_turn)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def serve(scenario: str) -> dict:
+    """What one worker pays before and during its first two conversations."""
+    report = {"preload": 0.0, "warm_up": 0.0}
+    if scenario == "preloaded":
+        from warm_start import preload
+
+        start = time.perf_counter()
+        preload()
+        report["preload"] = time.perf_counter() - start
+        pid = os.fork()
+        if pid:
+            _, status = os.waitpid(pid, 0)
+            os._exit(os.WEXITSTATUS(status))
+
+    start = time.perf_counter()
+    import app
+
+    report["import_app"] = time.perf_counter() - start
+    loop = asyncio.new_event_loop()
+    if scenario == "warm":
+        loop.run_until_complete(app.WARM_START.run())
+        report["warm_up"] = app.WARM_START.profile["total"]
+    report["first"] = loop.run_until_complete(conversation(app.BOT, "first"))
+    report["second"] = loop.run_until_complete(conversation(app.BOT, "second"))
+    return report
+
+
+def run_scenario(scenario: str) -> dict:
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--serve", scenario],
+        cwd=ROOT, env={**os.environ, **ENVIRONMENT}, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        universal_newlines=True, timeout=300, check=True)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--top", type=int, default=15, help="top-level packages in the import report")
+    parser.add_argument("--serve", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        # Telemetry has nowhere to go, keep its retries out of the report.
+        logging.getLogger("opencensus").setLevel(logging.CRITICAL)
+        print(json.dumps(serve(args.serve)), flush=True)
+        # Skip the exporters' exit flush, which would retry against App Insights.
+        os._exit(0)
+
+    print(f"{'import app, per package':<40} {'self':>10}")
+    for package, seconds in import_times(args.top):
+        print(f"{package:<40} {seconds * 1000:8.0f}ms")
+
+    print()
+    print(f"{'scenario':<10} {'preload':>9} {'import':>9} {'warm-up':>9} {'1st turn':>9} {'1st conv':>9} {'2nd conv':>9}")
+    for scenario in SCENARIOS:
+        report = run_scenario(scenario)
+        print(f"{scenario:<10}" + "".join(f" {seconds * 1000:7.0f}ms" for seconds in (
+            report["preload"], report["import_app"], report["warm_up"],
+            report["first"][0], sum(report["first"]), sum(report["second"]))))
+
+
+if __name__ == "__main__":
+    main()
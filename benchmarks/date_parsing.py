@@ -0,0 +1,65 @@
+"""Micro-benchmark of the DateResolverDialog prompt: FastDateParser against recognizers-text alone.
+
+The answers are the date spans the recognizers-text model finds in ``luis_app/testSet.json``, what a
+user types when asked for a date, plus the formats the prompt is answered with in the replay
+benchmark.
+
+Run from the repository root: ``python benchmarks/date_parsing.py``.
+"""
+
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from recognizers_date_time import recognize_datetime  # noqa: E402
+
+from helpers.date_parser import FastDateParser  # noqa: E402
+
+REFERENCE = datetime(2026, 10, 17, 9, 30)
+CULTURE = "en-US"
+REPLAY_ANSWERS = ["august 12 2030", "august 26 2030"]
+
+
+def date_spans() -> list:
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "luis_app", "testSet.json")) as examples:
+        texts = [example["text"] for example in json.load(examples)]
+    return [result.text for text in texts for result in recognize_datetime(text, CULTURE, reference=REFERENCE)]
+
+
+def model_values(text: str):
+    results = recognize_datetime(text, CULTURE, reference=REFERENCE)
+    return results[0].resolution["values"] if results else None
+
+
+def cpu_per_answer(function, answers: list, rounds: int) -> float:
+    started = time.thread_time()
+    for _ in range(rounds):
+        for answer in answers:
+            function(answer)
+    return (time.thread_time() - started) / rounds / len(answers)
+
+
+def main(rounds: int = 5):
+    spans = date_spans()
+    for name, answers in (("testSet.json date spans", spans), ("replay answers", REPLAY_ANSWERS)):
+        parser = FastDateParser(clock=lambda: REFERENCE)
+        agreed = sum(parser.recognize(answer, CULTURE) == model_values(answer) for answer in answers)
+        stats = parser.stats()
+        print(f"{name}: {len(answers)} answers, fast path {stats['hit_rate']:.0%}, "
+              f"{agreed}/{len(answers)} identical to the model")
+
+        model = cpu_per_answer(model_values, answers, rounds)
+        cold = cpu_per_answer(lambda answer: FastDateParser(clock=lambda: REFERENCE).recognize(answer, CULTURE),
+                              answers, rounds)
+        warm = cpu_per_answer(lambda answer: parser.recognize(answer, CULTURE), answers, rounds)
+        for label, seconds in (("recognizers-text", model), ("FastDateParser (cold cache)", cold),
+                               ("FastDateParser (warm cache)", warm)):
+            print(f"  {label:<30} {seconds * 1e3:8.3f}ms per answer  x{model / seconds:.1f}")
+        print(f"  CPU saved per turn: {(model - warm) * 1e3:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Micro-benchmark of LuisHelper.extract_datetimes: DatetimeResolver against the former if/elif tree.
+
+The entities are the ``datetime`` entities LUIS returned for the recorded predictions under
+LuisRecordingPath when there are any, else those the local recognizer's datetime model finds in
+``luis_app/testSet.json`` and ``luis_app/trainSet.json``.
+
+Run from the repository root: ``python benchmarks/datetime_resolution.py``.
+"""
+
+import glob
+import json
+import os
+import sys
+import timeit
+from collections import Counter
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+from datatypes_date_time import Timex  # noqa: E402
+from dateutil.relativedelta import relativedelta  # noqa: E402
+
+from helpers.datetime_resolver import DatetimeResolver  # noqa: E402
+
+NOW = datetime(2026, 10, 17, 9, 30)
+
+
+def recorded_datetimes() -> list:
+    from azure.cognitiveservices.language.luis.runtime.models import LuisResult
+    from botbuilder.ai.luis.luis_util import LuisUtil
+
+    recordings = os.path.join(ROOT, os.environ.get("LuisRecordingPath", "luis_app/recordings"))
+    lists = []
+    for path in glob.glob(os.path.join(recordings, "objects", "*", "*.json")):
+        with open(path) as prediction:
+            result = LuisResult.deserialize(json.load(prediction))
+        entities = LuisUtil.extract_entities_and_metadata(result.entities, result.composite_entities, True)
+        if entities.get("datetime"):
+            lists.append(entities["datetime"])
+    return lists
+
+
+def recognized_datetimes() -> list:
+    from local_recognizer import LocalRecognizer, LocalRecognizerModel
+
+    recognizer = LocalRecognizer(LocalRecognizerModel.load(os.path.join(ROOT, "luis_app", "localModel.json")))
+    lists = []
+    for name in ("testSet.json", "trainSet.json"):
+        with open(os.path.join(ROOT, "luis_app", name)) as examples:
+            for example in json.load(examples):
+                datetimes = recognizer.recognize_text(example["text"]).entities.get("datetime")
+                if datetimes:
+                    lists.append(datetimes)
+    return lists
+
+
+def legacy_extract(datetimes: list, now: datetime = NOW) -> tuple:
+    """LuisHelper.extract_datetimes before the resolver, ``now`` fixed."""
+
+    def to_datetime(timex):
+        return datetime(timex.year or now.year, timex.month or now.month, timex.day_of_month or now.day)
+
+    def delta(timex):
+        return relativedelta(**{field: int(getattr(timex, field) or 0)
+                                for field in ("years", "months", "weeks", "days", "hours", "minutes", "seconds")})
+
+    types = tuple(entity["type"] for entity in datetimes)
+    timexes = [Timex(entity["timex"][0]) for entity in datetimes] if len(datetimes) <= 2 else []
+    if types == ("daterange",):
+        from_date = to_datetime(timexes[0])
+        to_date = from_date + delta(timexes[0])
+    elif types == ("duration",):
+        from_date, to_date = now, now + delta(timexes[0])
+    elif types == ("date", "date"):
+        from_date, to_date = sorted(to_datetime(timex) for timex in timexes)
+    elif types in (("date", "duration"), ("duration", "date")):
+        date, duration = timexes if types[0] == "date" else timexes[::-1]
+        from_date = to_datetime(date)
+        to_date = from_date + delta(duration)
+    else:
+        return "", ""
+    return from_date.strftime("%d-%m-%Y"), to_date.strftime("%d-%m-%Y")
+
+
+def main(number: int = 20):
+    lists = recorded_datetimes()
+    source = "recorded predictions"
+    if not lists:
+        lists, source = recognized_datetimes(), "local recognizer on the test and train sets"
+    print(f"{len(lists)} datetime entity lists, {sum(map(len, lists))} entities ({source})")
+
+    resolver = DatetimeResolver(clock=lambda: NOW)
+    legacy = [legacy_extract(datetimes) for datetimes in lists]
+    resolved = resolver.resolve_many(lists)
+    print(f"resolved: legacy {sum(dates != ('', '') for dates in legacy)}, "
+          f"resolver {sum(dates != ('', '') for dates in resolved)}")
+    print("combinations:", dict(Counter(resolver.combinations).most_common()))
+
+    def cold():
+        DatetimeResolver(clock=lambda: NOW).resolve_many(lists)
+
+    timings = {
+        "legacy if/elif tree": timeit.timeit(lambda: [legacy_extract(datetimes) for datetimes in lists], number=number),
+        "DatetimeResolver.resolve (cold cache)": timeit.timeit(cold, number=number),
+        "DatetimeResolver.resolve (warm cache)":
+            timeit.timeit(lambda: [resolver.resolve(datetimes) for datetimes in lists], number=number),
+        "DatetimeResolver.resolve_many (warm cache)": timeit.timeit(lambda: resolver.resolve_many(lists), number=number),
+    }
+    baseline = timings["legacy if/elif tree"]
+    for name, seconds in timings.items():
+        print(f"{name:<45} {seconds / number / len(lists) * 1e6:9.1f}us per list  x{baseline / seconds:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""Load test replaying scripted booking conversations through the FastAPI app over HTTP.
+
+Every conversation starts with a conversationUpdate, sends a BookFlight utterance of
+``luis_app/testSet.json`` and then answers whatever the BookingDialog waterfall asks (cities,
+dates, budget, confirmation) until the bot says "What else can I do for you?". LUIS and the Bot
+Connector are local stub servers with a configurable latency, so only the bot's own time and the
+stubs' fixed delay are measured. Turns are grouped by the prompt they answer.
+
+Run from the repository root::
+
+    python benchmarks/replay.py                   # report throughput and p50/p95/p99 per turn type
+    python benchmarks/replay.py --save-baseline   # store the run in benchmarks/replay_baseline.json
+    python benchmarks/replay.py --check           # exit 1 when slower than the baseline
+
+Baselines are machine specific: save one on the machine that runs ``--check``.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+
+from aiohttp import ClientSession, web
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "replay_baseline.json")
+APP_ID = "00000000-0000-0000-0000-000000000000"
+# Turn types seen fewer times than this have too noisy a p95 to be checked against the baseline.
+MIN_CHECKED_TURNS = 50
+
+# Prompt prefix -> (turn type of the answer, answer). None ends the conversation.
+ANSWERS = (
+    ("From what city", "from_city", "paris"),
+    ("To what city", "to_city", "london"),
+    ("When do you want to leave", "from_date", "august 12 2030"),
+    ("When do you want to come back", "to_date", "august 26 2030"),
+    ("Please enter your travel date", "date_retry", "august 26 2030"),
+    ("What is your budget", "budget", "500 euros"),
+    ("Please confirm", "confirm", "yes"),
+    ("What else can I do", None, None),
+    ("Where do you want to go", "intent", None),
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def luis_response(example: dict) -> dict:
+    """LUIS v2 prediction for a labelled utterance of the test set."""
+    text = example["text"]
+    intent = {"intent": example["intent"], "score": 0.95}
+    return {
+        "query": text,
+        "topScoringIntent": intent,
+        "intents": [intent],
+        "entities": [
+            {
+                "entity": text[entity["startPos"]:entity["endPos"] + 1],
+                "type": entity["entity"],
+                "startIndex": entity["startPos"],
+                "endIndex": entity["endPos"],
+                "score": 0.9,
+            }
+            for entity in example["entities"]
+        ],
+    }
+
+
+class Stubs:
+    """LUIS prediction endpoint and Bot Connector on one local aiohttp server."""
+
+    def __init__(self, examples: list, luis_latency: float, connector_latency: float):
+        self._predictions = {example["text"]: luis_response(example) for example in examples}
+        self.luis_latency = luis_latency
+        self.connector_latency = connector_latency
+        self.replies = defaultdict(list)
+        self.luis_requests = 0
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._runner = None
+
+    async def predict(self, request: web.Request) -> web.Response:
+        self.luis_requests += 1
+        await asyncio.sleep(self.luis_latency)
+        query = await request.json()
+        none = {"intent": "None", "score": 0.9}
+        return web.json_response(
+            self._predictions.get(query, {"query": query, "topScoringIntent": none, "intents": [none], "entities": []}))
+
+    async def send_activity(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.connector_latency)
+        activity = await request.json()
+        self.replies[request.match_info["conversation_id"]].append(activity.get("text"))
+        return web.json_response({"id": str(uuid.uuid4())})
+
+    async def start(self) -> None:
+        stub = web.Application()
+        stub.router.add_post("/luis/v2.0/apps/{app_id}", self.predict)
+        stub.router.add_post("/v3/conversations/{conversation_id}/activities", self.send_activity)
+        stub.router.add_post("/v3/conversations/{conversation_id}/activities/{activity_id}", self.send_activity)
+        self._runner = web.AppRunner(stub)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+
+def next_turn(replies: list):
+    """Turn type and text answering the last prompt among ``replies``, (None, None) when done."""
+    for reply in reversed(replies):
+        for prefix, turn_type, answer in ANSWERS:
+            if reply and reply.startswith(prefix):
+                return turn_type, answer
+    return None, None
+
+
+async def replay_conversation(session, bot_url, stubs, utterance, timings, errors) -> None:
+    conversation_id = str(uuid.uuid4())
+    activity = {
+        "channelId": "benchmark",
+        "serviceUrl": stubs.url,
+        "conversation": {"id": conversation_id},
+        "from": {"id": "user-" + conversation_id},
+        "recipient": {"id": "bot"},
+        "locale": "en-US",
+    }
+    turn_type, body = "welcome", dict(activity, type="conversationUpdate", membersAdded=[{"id": activity["from"]["id"]}])
+    seen = 0
+    # A stuck conversation must not loop forever, a full booking takes 8 turns.
+    for _ in range(12):
+        body["id"] = str(uuid.uuid4())
+        start = time.perf_counter()
+        async with session.post(bot_url, json=body) as response:
+            await response.read()
+            status = response.status
+        timings[turn_type].append(time.perf_counter() - start)
+        if status != 200:
+            errors[turn_type] += 1
+            return
+
+        replies = stubs.replies[conversation_id][seen:]
+        seen += len(replies)
+        turn_type, answer = next_turn(replies)
+        if turn_type is None:
+            return
+        body = dict(activity, type="message", text=utterance if turn_type == "intent" else answer)
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def summarize(timings: dict, errors: dict, elapsed: float) -> dict:
+    turns = {}
+    for turn_type, values in sorted(timings.items()):
+        values = sorted(values)
+        turns[turn_type] = {
+            "count": len(values),
+            "errors": errors.get(turn_type, 0),
+            "p50": percentile(values, 0.5),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+        }
+    total = sum(len(values) for values in timings.values())
+    return {"turns_per_second": total / elapsed, "turns": turns}
+
+
+async def run(args) -> dict:
+    with open(os.path.join(ROOT, "luis_app", "testSet.json")) as test_set:
+        examples = json.load(test_set)
+    stubs = Stubs(examples, args.luis_latency / 1000, args.connector_latency / 1000)
+    await stubs.start()
+
+    import uvicorn
+    from app import RECOGNIZER, app
+    # The recognizer targets https://LuisAPIHostName, point it at the plain HTTP stub instead.
+    RECOGNIZER._recognizer.client.url = f"{stubs.url}/luis/v2.0/apps/{APP_ID}"
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.ensure_future(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    rng = random.Random(args.seed)
+    utterances = [rng.choice(examples)["text"] for _ in range(args.conversations)]
+    timings, errors = defaultdict(list), defaultdict(int)
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def one(session, utterance):
+        async with limit:
+            await replay_conversation(session, f"http://127.0.0.1:{port}/api/messages", stubs, utterance, timings, errors)
+
+    try:
+        async with ClientSession() as session:
+            # Warm up connections, caches and lazily built objects before measuring.
+            await asyncio.gather(*(one(session, utterance) for utterance in utterances[:args.concurrency]))
+            timings.clear()
+            errors.clear()
+            start = time.perf_counter()
+            await asyncio.gather(*(one(session, utterance) for utterance in utterances))
+            elapsed = time.perf_counter() - start
+    finally:
+        server.should_exit = True
+        await serving
+        await stubs.stop()
+
+    report = summarize(timings, errors, elapsed)
+    report["luis_requests"] = stubs.luis_requests
+    return report
+
+
+def settings_of(args) -> dict:
+    return {name: getattr(args, name) for name in (
+        "conversations", "concurrency", "luis_latency", "connector_latency", "luis_cache", "state_storage", "seed")}
+
+
+def print_report(report: dict) -> None:
+    print(f"{'turn':<12}{'count':>7}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for turn_type, stats in report["turns"].items():
+        print(f"{turn_type:<12}{stats['count']:>7}{stats['errors']:>8}"
+              f"{stats['p50'] * 1000:>9.1f}{stats['p95'] * 1000:>9.1f}{stats['p99'] * 1000:>9.1f}")
+    print(f"throughput: {report['turns_per_second']:.1f} turns/s, LUIS requests: {report['luis_requests']}")
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list:
+    """Throughput below, or a p95 above, the baseline by more than ``tolerance`` (a fraction)."""
+    found = []
+    if report["turns_per_second"] < baseline["turns_per_second"] * (1 - tolerance):
+        found.append(f"throughput {report['turns_per_second']:.1f} < baseline {baseline['turns_per_second']:.1f} turns/s")
+    for turn_type, stats in baseline["turns"].items():
+        current = report["turns"].get(turn_type)
+        if current is None:
+            found.append(f"{turn_type}: no turns")
+        elif current["errors"] > stats["errors"]:
+            found.append(f"{turn_type}: {current['errors']} errors, baseline {stats['errors']}")
+        elif stats["count"] < MIN_CHECKED_TURNS:
+            continue
+        # 1ms of slack keeps sub-millisecond turns from failing on scheduler noise.
+        elif current["p95"] > stats["p95"] * (1 + tolerance) + 0.001:
+            found.append(f"{turn_type}: p95 {current['p95'] * 1000:.1f}ms > baseline {stats['p95'] * 1000:.1f}ms")
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20, help="conversations replayed at once")
+    parser.add_argument("--luis-latency", type=float, default=30, help="LUIS stub latency in ms")
+    parser.add_argument("--connector-latency", type=float, default=5, help="Bot Connector stub latency in ms")
+    parser.add_argument("--luis-cache", action="store_true", help="keep the recognizer's utterance cache enabled")
+    parser.add_argument("--state-storage", choices=("sqlite", "memory"), default="sqlite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="exit 1 on a regression against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    args = parser.parse_args()
+
+    state_directory = tempfile.mkdtemp(prefix="flight-bot-replay-")
+    # Read by config.py when app is imported.
+    os.environ.update({
+        "SecretsProvider": "env",
+        "LuisAppId": APP_ID,
+        "LuisAPIKey": APP_ID,
+        "LuisAPIHostName": "luis.invalid",
+        "InstrumentationKey": APP_ID,
+        "MicrosoftAppId": "",
+        "MicrosoftAppPassword": "",
+        "RecognizerBackend": "luis",
+        "AsyncTurns": "false",
+        "StateStorage": args.state_storage,
+        "StateStoragePath": state_directory,
+    })
+    if not args.luis_cache:
+        os.environ["LuisCacheTTL"] = "0"
+    # Telemetry has nowhere to go, keep its retries out of the report.
+    logging.getLogger("opencensus").setLevel(logging.CRITICAL)
+
+    try:
+        report = asyncio.get_event_loop().run_until_complete(run(args))
+    finally:
+        shutil.rmtree(state_directory, ignore_errors=True)
+    report["settings"] = settings_of(args)
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    if args.check:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["settings"] != report["settings"]:
+            print(f"baseline was recorded with {baseline['settings']}, rerun with the same settings")
+            return 2
+        found = regressions(report, baseline, args.tolerance)
+        for regression in found:
+            print("REGRESSION", regression)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""Constant memory booking aggregates, flushed periodically instead of one log record per booking."""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import re
+import time
+from typing import Callable, Dict, List, Optional
+
+from booking_details import BookingDetails
+from helpers.latency_histogram import LatencyHistogram
+
+LOGGER = logging.getLogger(__name__)
+
+# Upper bounds of the budget buckets, in whatever currency the user gave.
+BUDGET_BUCKETS = (100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000, 20000)
+AMOUNT = re.compile(r"\d[\d,]*(?:\.\d+)?")
+# Set while synthetic turns run, such as a worker's warm-up, which must not count as bookings.
+_UNTRACKED = contextvars.ContextVar("untracked", default=False)
+
+
+def parse_amount(budget: str) -> Optional[float]:
+    """First number of a free text budget, "1,500 euros" -> 1500.0."""
+    match = AMOUNT.search(budget or "")
+    return float(match.group().replace(",", "")) if match else None
+
+
+def _city(name: Optional[str]) -> str:
+    return (name or "").strip().casefold()
+
+
+def custom_dimensions(aggregates: dict) -> dict:
+    """Aggregates as App Insights custom dimensions, whose values are flat."""
+    return {key: json.dumps(value) if isinstance(value, (dict, list)) else value for key, value in aggregates.items()}
+
+
+class SpaceSaving:
+    """Heavy hitters sketch: approximate counts of the most frequent items in ``capacity`` entries.
+
+    A new item evicts the least counted one and inherits its count, so a count overestimates by at
+    most its ``error``. Any item seen more than total / capacity times is guaranteed to be kept.
+    """
+
+    def __init__(self, capacity: int = 100):
+        if capacity <= 0:
+            raise ValueError("[SpaceSaving]: capacity must be positive")
+        self.capacity = capacity
+        # item -> [count, error]
+        self._counts: Dict[str, List[int]] = {}
+
+    def add(self, item: str, count: int = 1) -> None:
+        entry = self._counts.get(item)
+        if entry is not None:
+            entry[0] += count
+        elif len(self._counts) < self.capacity:
+            self._counts[item] = [count, 0]
+        else:
+            evicted = min(self._counts, key=lambda key: self._counts[key][0])
+            floor = self._counts.pop(evicted)[0]
+            self._counts[item] = [floor + count, floor]
+
+    def top(self, k: int) -> List[tuple]:
+        """``(item, count, error)`` of the ``k`` most counted items."""
+        ranked = sorted(self._counts.items(), key=lambda item: item[1][0], reverse=True)[:k]
+        return [(item, count, error) for item, (count, error) in ranked]
+
+
+class _Aggregates:
+    def __init__(self, route_capacity: int):
+        self.started_at = time.time()
+        self.confirmed = 0
+        self.rejected = 0
+        self.routes = SpaceSaving(route_capacity)
+        self.budgets = LatencyHistogram(BUDGET_BUCKETS)
+        self.funnel: Dict[str, int] = {}
+
+    def _budget_percentile(self, fraction: float) -> Optional[float]:
+        # Past the last bucket the bound is inf, which JSON has no value for: None, see "over_last_bucket".
+        bound = self.budgets.percentile(fraction)
+        return None if bound == float("inf") else bound
+
+    def snapshot(self, steps: List[str], top_routes: int) -> dict:
+        finished = self.confirmed + self.rejected
+        entered = [self.funnel.get(step, 0) for step in steps]
+        return {
+            "since": self.started_at,
+            "confirmed": self.confirmed,
+            "rejected": self.rejected,
+            "confirm_rate": self.confirmed / finished if finished else 0.0,
+            "top_routes": [
+                {"route": route, "count": count, "error": error}
+                for route, count, error in self.routes.top(top_routes)
+            ],
+            "budget": {
+                "count": self.budgets.count,
+                "p50": self._budget_percentile(0.5),
+                "p90": self._budget_percentile(0.9),
+                "p99": self._budget_percentile(0.99),
+                "over_last_bucket": self.budgets.counts[-1],
+            },
+            # Bookings that entered a step and did not reach the next one, none drop out of the last step.
+            # Over an interval, more may reach the next step than entered this one: they entered it before.
+            "funnel": {
+                step: {
+                    "entered": count,
+                    "dropped": max(0, count - (entered[index + 1] if index + 1 < len(steps) else count)),
+                }
+                for index, (step, count) in enumerate(zip(steps, entered))
+            },
+        }
+
+
+class BookingAnalytics:
+    """Booking outcomes, top routes, budget quantiles and waterfall funnel, since start and per interval.
+
+    Memory does not grow with traffic: routes are a ``SpaceSaving`` sketch of ``route_capacity`` entries
+    and budgets a fixed bucket histogram. ``start`` emits and resets the interval aggregates every
+    ``interval`` seconds.
+    """
+
+    def __init__(self, top_routes: int = 10, route_capacity: int = 100):
+        self.top_routes = top_routes
+        self.route_capacity = route_capacity
+        self.steps: List[str] = []
+        self.total = _Aggregates(route_capacity)
+        self.interval = _Aggregates(route_capacity)
+        self._task = None
+
+    def track_steps(self, steps: List[Callable]) -> List[Callable]:
+        """Waterfall steps counting the bookings that enter them, in funnel order."""
+
+        def tracked(step):
+            if step.__name__ not in self.steps:
+                self.steps.append(step.__name__)
+
+            @functools.wraps(step)
+            async def run(step_context):
+                if not _UNTRACKED.get():
+                    self.step_entered(step.__name__)
+                return await step(step_context)
+            return run
+
+        return [tracked(step) for step in steps]
+
+    def step_entered(self, step: str) -> None:
+        for aggregates in (self.total, self.interval):
+            aggregates.funnel[step] = aggregates.funnel.get(step, 0) + 1
+
+    def booking_finished(self, booking_details: BookingDetails, confirmed: bool) -> None:
+        if _UNTRACKED.get():
+            return
+        route = f"{_city(booking_details.from_city)}->{_city(booking_details.to_city)}"
+        amount = parse_amount(booking_details.budget)
+        for aggregates in (self.total, self.interval):
+            if confirmed:
+                aggregates.confirmed += 1
+            else:
+                aggregates.rejected += 1
+            aggregates.routes.add(route)
+            if amount is not None:
+                aggregates.budgets.observe(amount)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def untracked():
+        """Bookings made in this block, by this task and the ones it starts, are not counted."""
+        token = _UNTRACKED.set(True)
+        try:
+            yield
+        finally:
+            _UNTRACKED.reset(token)
+
+    def snapshot(self) -> dict:
+        return {
+            "total": self.total.snapshot(self.steps, self.top_routes),
+            "interval": self.interval.snapshot(self.steps, self.top_routes),
+        }
+
+    def flush(self) -> dict:
+        """Aggregates of the interval that just ended, the next one starts empty."""
+        aggregates, self.interval = self.interval, _Aggregates(self.route_capacity)
+        return aggregates.snapshot(self.steps, self.top_routes)
+
+    def start(self, interval: float, emit: Callable[[dict], None]) -> None:
+        """Emit the interval aggregates every ``interval`` seconds from the running loop."""
+        self._task = asyncio.ensure_future(self._flush_every(interval, emit))
+
+    async def _flush_every(self, interval: float, emit: Callable[[dict], None]) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                emit(self.flush())
+            except Exception as error:
+                LOGGER.error(f"[BookingAnalytics]: flush failed: {error}")
+
+    async def stop(self, emit: Callable[[dict], None] = None) -> None:
+        """Stop flushing, emitting what the last interval gathered so far."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if emit is not None:
+            emit(self.flush())
@@ -1,18 +1,17 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-import json
-import os.path
-
 from typing import List
 from botbuilder.dialogs import Dialog
 from botbuilder.core import (
     ConversationState,
     MessageFactory,
+    Storage,
     UserState,
     TurnContext
 )
 from botbuilder.schema import ChannelAccount, Attachment
+from helpers.card_template import load_card_template
 from helpers.dialog_helper import DialogHelper
 from .dialog_bot import DialogBot
 
@@ -20,8 +19,10 @@ from .dialog_bot import DialogBot
 class DialogAndWelcomeBot(DialogBot):
     """Main dialog to welcome users."""
 
-    def __init__(self, conversation_state: ConversationState, user_state: UserState, dialog: Dialog):
-        super(DialogAndWelcomeBot, self).__init__(conversation_state, user_state, dialog)
+    def __init__(self, conversation_state: ConversationState, user_state: UserState, dialog: Dialog,
+                 storage: Storage):
+        super(DialogAndWelcomeBot, self).__init__(conversation_state, user_state, dialog, storage)
+        self._welcome_card = load_card_template("welcomeCard")
 
     async def on_members_added_activity(self, members_added: List[ChannelAccount], turn_context: TurnContext):
         for member in members_added:
@@ -34,14 +35,9 @@ class DialogAndWelcomeBot(DialogBot):
                 await DialogHelper.run_dialog(
                     self.dialog,
                     turn_context,
-                    self.conversation_state.create_property("DialogState")
+                    self.dialog_state
                 )
 
-    # Load attachment from file.
+    # Render attachment from the compiled card template.
     def create_adaptive_card_attachment(self):
-        relative_path = os.path.abspath(os.path.dirname(__file__))
-        path = os.path.join(relative_path, "../cards/welcomeCard.json")
-        with open(path) as in_file:
-            card = json.load(in_file)
-
-        return Attachment(content_type="application/vnd.microsoft.card.adaptive", content=card)
+        return Attachment(content_type="application/vnd.microsoft.card.adaptive", content=self._welcome_card.render())
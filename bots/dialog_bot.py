@@ -5,37 +5,40 @@
 from botbuilder.core import (
     ActivityHandler,
     ConversationState,
+    Storage,
     UserState,
     TurnContext)
 from botbuilder.dialogs import Dialog, DialogExtensions
-
+from metrics import METRICS
+from state_persistence import StatePersister
 
 
 class DialogBot(ActivityHandler):
     """Main activity handler for the bot."""
 
-    def __init__(self, conversation_state: ConversationState, user_state: UserState, dialog: Dialog):
+    def __init__(self, conversation_state: ConversationState, user_state: UserState, dialog: Dialog,
+                 storage: Storage):
         if conversation_state is None:
             raise Exception("[DialogBot]: Missing parameter. conversation_state is required")
         if user_state is None:
             raise Exception("[DialogBot]: Missing parameter. user_state is required")
         if dialog is None:
             raise Exception("[DialogBot]: Missing parameter. dialog is required")
+        if storage is None:
+            raise Exception("[DialogBot]: Missing parameter. storage is required")
 
         self.conversation_state = conversation_state
         self.user_state = user_state
         self.dialog = dialog
+        self.state_persister = StatePersister({conversation_state: storage, user_state: storage})
+        self.dialog_state = self.state_persister.create_property(conversation_state, "DialogState")
 
     async def on_turn(self, turn_context: TurnContext):
         await super().on_turn(turn_context)
-        
-        # Save any state changes that might have occurred during the turn.
-        await self.conversation_state.save_changes(turn_context, False)
-        await self.user_state.save_changes(turn_context, False)
 
-    async def on_message_activity(self, turn_context: TurnContext):
-        await DialogExtensions.run_dialog(self.dialog, turn_context, self.conversation_state.create_property("DialogState"))
+        # Save any state changes that might have occurred during the turn, in one write.
+        with METRICS.time("state_save"):
+            await self.state_persister.save_all_changes(turn_context)
 
-        # Save any state changes that might have occured during the turn.
-        await self.conversation_state.save_changes(turn_context, False)
-        await self.user_state.save_changes(turn_context, False)
+    async def on_message_activity(self, turn_context: TurnContext):
+        await DialogExtensions.run_dialog(self.dialog, turn_context, self.dialog_state)
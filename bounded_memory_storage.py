@@ -0,0 +1,129 @@
+"""In-process bot state storage with a memory cap, an idle TTL and LRU eviction."""
+
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+from botbuilder.core import Storage, StoreItem
+from jsonpickle import decode, encode
+
+# ConversationState keys are "<channel>/conversations/<id>", UserState ones "<channel>/users/<id>".
+CONVERSATION_KEY_PART = "/conversations/"
+
+
+class BoundedMemoryStorage(Storage):
+    """MemoryStorage that forgets idle and least recently used conversations.
+
+    Items are kept encoded so their size is known exactly and reads never alias the stored value.
+    An item not read or written for ``ttl`` seconds expires, and the least recently used items are
+    evicted whenever the encoded total exceeds ``max_bytes``. A conversation that lost its state
+    this way simply has none on its next turn, so its dialog starts over from MainDialog.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600.0, clock: Callable[[], float] = time.monotonic):
+        super(BoundedMemoryStorage, self).__init__()
+        if max_bytes <= 0:
+            raise ValueError("[BoundedMemoryStorage]: max_bytes must be positive")
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        # key -> (encoded item, e_tag, last access), least recently used first
+        self._items = OrderedDict()
+        self._e_tag = 0
+        self.total_bytes = 0
+        self.bytes_written = 0
+        self.conversations = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def size_of(self, key: str) -> int:
+        item = self._items.get(key)
+        return len(item[0]) if item is not None else 0
+
+    def _remove(self, key: str) -> None:
+        encoded, _, _ = self._items.pop(key)
+        self.total_bytes -= len(encoded)
+        self.conversations -= CONVERSATION_KEY_PART in key
+
+    def _expire(self, now: float) -> None:
+        # Items are ordered by last access, so the expired ones are all at the front.
+        while self._items:
+            key = next(iter(self._items))
+            if now - self._items[key][2] < self.ttl:
+                break
+            self._remove(key)
+            self.expirations += 1
+
+    async def delete(self, keys: List[str]):
+        for key in keys:
+            if key in self._items:
+                self._remove(key)
+
+    async def read(self, keys: List[str]):
+        data = {}
+        if not keys:
+            return data
+        now = self._clock()
+        self._expire(now)
+        for key in keys:
+            item = self._items.get(key)
+            if item is None:
+                continue
+            encoded, e_tag, _ = item
+            self._items[key] = (encoded, e_tag, now)
+            self._items.move_to_end(key)
+            value = decode(encoded)
+            if e_tag is not None:
+                if isinstance(value, dict):
+                    value["e_tag"] = e_tag
+                else:
+                    value.e_tag = e_tag
+            data[key] = value
+        return data
+
+    async def write(self, changes: Dict[str, StoreItem]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if not changes:
+            return
+        now = self._clock()
+        self._expire(now)
+        for key, change in changes.items():
+            old_e_tag = self._items[key][1] if key in self._items else None
+            new_e_tag = change.get("e_tag") if isinstance(change, dict) else getattr(change, "e_tag", None)
+            if new_e_tag == "":
+                raise Exception("bounded_memory_storage.write(): etag missing")
+            if old_e_tag is not None and new_e_tag is not None and new_e_tag != "*" and new_e_tag != old_e_tag:
+                raise KeyError("Etag conflict.\nOriginal: %s\r\nCurrent: %s" % (new_e_tag, old_e_tag))
+
+            # Like MemoryStorage, only items that already had an e_tag get a new one.
+            e_tag = None
+            if old_e_tag is not None or new_e_tag not in (None, "*"):
+                e_tag = str(self._e_tag)
+                self._e_tag += 1
+
+            encoded = encode(change)
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (encoded, e_tag, now)
+            self.total_bytes += len(encoded)
+            self.bytes_written += len(encoded)
+            self.conversations += CONVERSATION_KEY_PART in key
+
+        while self.total_bytes > self.max_bytes and len(self._items) > 1:
+            self._remove(next(iter(self._items)))
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "items": len(self._items),
+            "conversations": self.conversations,
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "bytes_written": self.bytes_written,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
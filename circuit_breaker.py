@@ -0,0 +1,117 @@
+"""Circuit breaker tripping on the error rate or slow call rate of a dependency."""
+
+import time
+from collections import deque
+from typing import Callable, List
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open."""
+
+
+class CircuitBreaker:
+    """Closed, open and half-open breaker over a sliding window of the last ``window`` calls.
+
+    The breaker opens when, over at least ``min_calls`` calls, the share of failures reaches
+    ``failure_rate`` or the share of calls slower than ``slow_call_seconds`` reaches ``slow_rate``.
+    After ``open_seconds`` it lets ``half_open_probes`` calls through: all of them succeeding
+    closes it again, any failure or slow call reopens it.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 2.0,
+        slow_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 10,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 3,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._clock = clock
+        # (failed, slow) of the most recent calls while closed
+        self._calls = deque(maxlen=window)
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self._listeners: List[Callable[[str, str], None]] = []
+        self.transitions = {}
+        self.rejected = 0
+
+    def add_listener(self, listener: Callable[[str, str], None]) -> None:
+        """``listener(old_state, new_state)`` is called on every transition."""
+        self._listeners.append(listener)
+
+    def _transition(self, state: str) -> None:
+        old_state, self.state = self.state, state
+        key = f"{old_state}->{state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        if state == OPEN:
+            self._opened_at = self._clock()
+        if state == HALF_OPEN:
+            self._probes_started = self._probes_succeeded = 0
+        if state == CLOSED:
+            self._calls.clear()
+        for listener in self._listeners:
+            listener(old_state, state)
+
+    def allow(self) -> bool:
+        """Whether the next call may go to the dependency. Every allowed call must be recorded."""
+        if self.state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN and self._probes_started < self.half_open_probes:
+            self._probes_started += 1
+            return True
+        if self.state == CLOSED:
+            return True
+        self.rejected += 1
+        return False
+
+    def release(self) -> None:
+        """Give back the probe of an allowed call that ended without an outcome, e.g. cancelled."""
+        if self.state == HALF_OPEN and self._probes_started > self._probes_succeeded:
+            self._probes_started -= 1
+
+    def record(self, succeeded: bool, seconds: float) -> None:
+        failed = not succeeded
+        slow = seconds > self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            if failed or slow:
+                self._transition(OPEN)
+            else:
+                self._probes_succeeded += 1
+                if self._probes_succeeded >= self.half_open_probes:
+                    self._transition(CLOSED)
+            return
+        if self.state != CLOSED:
+            # A call allowed before the breaker opened finished late.
+            return
+
+        self._calls.append((failed, slow))
+        calls = len(self._calls)
+        if calls < self.min_calls:
+            return
+        failures = sum(call[0] for call in self._calls)
+        slow_calls = sum(call[1] for call in self._calls)
+        if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_rate:
+            self._transition(OPEN)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "window_calls": len(self._calls),
+            "rejected": self.rejected,
+            "transitions": dict(self.transitions),
+        }
@@ -1,11 +1,8 @@
 #!/usr/bin/env python3
 
 import os
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
 
-credential = DefaultAzureCredential()
-secret_client = SecretClient(vault_url="https://chatbot-vault.vault.azure.net/", credential=credential)
+from secrets_provider import secret
 
 
 class DefaultConfig:
@@ -13,7 +10,95 @@ class DefaultConfig:
 
     APP_ID = os.environ.get("MicrosoftAppId", "")
     APP_PASSWORD = os.environ.get("MicrosoftAppPassword", "")
-    LUIS_APP_ID = secret_client.get_secret('LuisAppId').value
-    LUIS_API_KEY = secret_client.get_secret('LuisAPIKey').value
-    LUIS_API_HOST_NAME = secret_client.get_secret('LuisAPIHostName').value
-    APPINSIGHTS_INSTRUMENTATIONKEY = secret_client.get_secret('InstrumentationKey').value
+    # Validated auth headers are cached until their token expires, up to AuthCacheSize tokens (0 disables the cache);
+    # the channel signing keys are refreshed in the background every AuthMetadataRefreshInterval seconds.
+    AUTH_CACHE_SIZE = int(os.environ.get("AuthCacheSize", 10000))
+    AUTH_METADATA_REFRESH_INTERVAL = float(os.environ.get("AuthMetadataRefreshInterval", 12 * 3600))
+    # Replies go through one keep-alive pool of ConnectorPoolSize connections, ConnectorPoolPerHost per service url.
+    # With CoalesceReplies, on the channels listed in ReplyMergeChannels (comma separated, e.g. "webchat,directline"),
+    # a turn's replies are held until it ends and consecutive text replies delivered as one message.
+    CONNECTOR_POOL_SIZE = int(os.environ.get("ConnectorPoolSize", 100))
+    CONNECTOR_POOL_PER_HOST = int(os.environ.get("ConnectorPoolPerHost", 20))
+    COALESCE_REPLIES = os.environ.get("CoalesceReplies", "false").lower() == "true"
+    REPLY_MERGE_CHANNELS = [channel for channel in os.environ.get("ReplyMergeChannels", "").split(",") if channel]
+    # /api/stream multiplexes conversations over one WebSocket: each stream may have StreamWindow turns unanswered,
+    # and a connection StreamMaxStreams streams with turns in flight.
+    STREAM_WINDOW = int(os.environ.get("StreamWindow", 8))
+    STREAM_MAX_STREAMS = int(os.environ.get("StreamMaxStreams", 1000))
+    # Secrets are fetched together on first access, from the source chosen by the SecretsProvider variable.
+    LUIS_APP_ID = secret("LuisAppId")
+    LUIS_API_KEY = secret("LuisAPIKey")
+    LUIS_API_HOST_NAME = secret("LuisAPIHostName")
+    LUIS_APP_VERSION = os.environ.get("LuisAppVersion", "0.1")
+    LUIS_CACHE_SIZE = int(os.environ.get("LuisCacheSize", 4096))
+    LUIS_CACHE_TTL = float(os.environ.get("LuisCacheTTL", 3600))
+    LUIS_POOL_SIZE = int(os.environ.get("LuisPoolSize", 100))
+    LUIS_CONNECT_TIMEOUT = float(os.environ.get("LuisConnectTimeout", 1.0))
+    LUIS_READ_TIMEOUT = float(os.environ.get("LuisReadTimeout", 3.0))
+    # Predictions per second allowed by the LUIS key, 0 for no limit.
+    LUIS_TPS = float(os.environ.get("LuisTPS", 0))
+    # Send a second request once one is slower than this latency percentile (e.g. 0.95), 0 disables hedging.
+    LUIS_HEDGE_PERCENTILE = float(os.environ.get("LuisHedgePercentile", 0))
+    # Circuit breaker on LUIS: it opens when LuisBreakerFailureRate of the recent calls failed or LuisBreakerSlowRate
+    # took longer than LuisBreakerSlowCall seconds, then the offline model (or a prompt for every booking detail)
+    # answers until probes after LuisBreakerOpenSeconds succeed again.
+    LUIS_BREAKER = os.environ.get("LuisBreaker", "true").lower() == "true"
+    LUIS_BREAKER_FAILURE_RATE = float(os.environ.get("LuisBreakerFailureRate", 0.5))
+    LUIS_BREAKER_SLOW_CALL = float(os.environ.get("LuisBreakerSlowCall", 2.0))
+    LUIS_BREAKER_SLOW_RATE = float(os.environ.get("LuisBreakerSlowRate", 0.5))
+    LUIS_BREAKER_OPEN_SECONDS = float(os.environ.get("LuisBreakerOpenSeconds", 30))
+    # "record" saves every LUIS prediction under LuisRecordingPath (see luis_app/record_predictions.py), "replay"
+    # answers from those recordings only and never calls LUIS.
+    LUIS_RECORDING = os.environ.get("LuisRecording", "")
+    LUIS_RECORDING_PATH = os.environ.get("LuisRecordingPath", "luis_app/recordings")
+    # "luis" calls the LUIS endpoint, "local" uses the offline model trained by luis_app/train_local_model.py
+    RECOGNIZER_BACKEND = os.environ.get("RecognizerBackend", "luis")
+    LOCAL_MODEL_PATH = os.environ.get("LocalModelPath", "luis_app/localModel.json")
+    # "sqlite" shares conversation and user state between the workers of a node, "memory" keeps it per process
+    # within StateMemoryMaxBytes, forgetting conversations idle for StateIdleTTL seconds.
+    STATE_STORAGE = os.environ.get("StateStorage", "sqlite")
+    STATE_STORAGE_PATH = os.environ.get("StateStoragePath", "state")
+    STATE_STORAGE_SHARDS = int(os.environ.get("StateStorageShards", 4))
+    STATE_FLUSH_INTERVAL = float(os.environ.get("StateFlushInterval", 0.005))
+    STATE_WRITE_BEHIND = os.environ.get("StateWriteBehind", "true").lower() == "true"
+    STATE_MEMORY_MAX_BYTES = int(os.environ.get("StateMemoryMaxBytes", 64 * 1024 * 1024))
+    STATE_IDLE_TTL = float(os.environ.get("StateIdleTTL", 3600))
+    # Turns processed at once per worker, turns of the same conversation always run one at a time.
+    TURN_CONCURRENCY = int(os.environ.get("TurnConcurrency", 64))
+    # Admission control on /api/messages: the in-flight limit adapts between the min and max from turn latency,
+    # turns beyond it wait in a bounded queue and get a 503 with Retry-After when it is full or they waited too long.
+    ADMISSION_MAX_INFLIGHT = int(os.environ.get("AdmissionMaxInflight", 128))
+    ADMISSION_MIN_INFLIGHT = int(os.environ.get("AdmissionMinInflight", 4))
+    ADMISSION_QUEUE_SIZE = int(os.environ.get("AdmissionQueueSize", 256))
+    ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("AdmissionQueueTimeout", 2.0))
+    ADMISSION_TARGET_LATENCY = float(os.environ.get("AdmissionTargetLatency", 1.5))
+    # Answer /api/messages with 202 once the request is authenticated and run the turn in the background,
+    # on AsyncTurnWorkers tasks fed by a queue of AsyncTurnQueueSize activities.
+    ASYNC_TURNS = os.environ.get("AsyncTurns", "false").lower() == "true"
+    ASYNC_TURN_WORKERS = int(os.environ.get("AsyncTurnWorkers", 32))
+    ASYNC_TURN_QUEUE_SIZE = int(os.environ.get("AsyncTurnQueueSize", 1000))
+    ASYNC_TURN_DRAIN_TIMEOUT = float(os.environ.get("AsyncTurnDrainTimeout", 25))
+    # Booking aggregates (outcomes, top routes, budget quantiles, funnel) are logged every AnalyticsFlushInterval
+    # seconds. BookingEventLogs=false stops the per booking "YES answer" / "NO answer" records they replace.
+    ANALYTICS_FLUSH_INTERVAL = float(os.environ.get("AnalyticsFlushInterval", 60))
+    ANALYTICS_TOP_ROUTES = int(os.environ.get("AnalyticsTopRoutes", 10))
+    BOOKING_EVENT_LOGS = os.environ.get("BookingEventLogs", "true").lower() == "true"
+    # Log records wait in a queue of LogQueueSize records, dropped when full, for the logging thread which hands
+    # them to App Insights; the exporter sends them by LogBatchSize at least every LogExportInterval seconds.
+    LOG_QUEUE_SIZE = int(os.environ.get("LogQueueSize", 10000))
+    LOG_BATCH_SIZE = int(os.environ.get("LogBatchSize", 100))
+    LOG_EXPORT_INTERVAL = float(os.environ.get("LogExportInterval", 15.0))
+    # Tail sampling of request traces: failed requests and requests slower than TraceSlowThreshold seconds are
+    # always exported, the others at TraceSampleRate, by batches of TraceBatchSize spans from a bounded queue.
+    TRACE_SAMPLE_RATE = float(os.environ.get("TraceSampleRate", 0.05))
+    TRACE_SLOW_THRESHOLD = float(os.environ.get("TraceSlowThreshold", 1.0))
+    TRACE_QUEUE_SIZE = int(os.environ.get("TraceQueueSize", 10000))
+    TRACE_BATCH_SIZE = int(os.environ.get("TraceBatchSize", 100))
+    TRACE_EXPORT_INTERVAL = float(os.environ.get("TraceExportInterval", 5.0))
+    # Also trace every phase timed for /metrics as a child span of the request.
+    METRICS_SPANS = os.environ.get("MetricsSpans", "false").lower() == "true"
+    # Warm every worker up at startup (imports, recognizer models, pooled connections, a synthetic conversation)
+    # before /ready answers 200, giving up after WarmStartTimeout seconds. gunicorn.conf.py reads WarmStart too.
+    WARM_START = os.environ.get("WarmStart", "true").lower() == "true"
+    WARM_START_TIMEOUT = float(os.environ.get("WarmStartTimeout", 30))
+    APPINSIGHTS_INSTRUMENTATIONKEY = secret("InstrumentationKey")
@@ -0,0 +1,198 @@
+"""Bot Connector clients sharing one aiohttp connection pool, and coalescing of a turn's replies."""
+
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+from botbuilder.schema import Activity, ActivityTypes
+from botframework.connector.aio import ConnectorClient
+from botframework.connector.auth import AppCredentials, MicrosoftAppCredentials
+from msrest.pipeline import AsyncHTTPPolicy, AsyncHTTPSender, Request, Response
+from msrest.pipeline.async_abc import AsyncPipeline
+from msrest.pipeline.universal import RawDeserializer
+from msrest.universal_http.aiohttp import AioHttpClientResponse
+
+from metrics import METRICS
+
+# MSAL hands out cached tokens until five minutes before they expire, reusing one for less than that is safe.
+TOKEN_REUSE_SECONDS = 240
+
+
+class _ChannelToken:
+    """Bearer token of one app id and scope, fetched off the event loop and reused for a while."""
+
+    def __init__(self, credentials: AppCredentials, clock=time.monotonic):
+        self._credentials = credentials
+        self._clock = clock
+        self._token: Optional[str] = None
+        self._fetched_at = 0.0
+        self._fetching: Optional[asyncio.Future] = None
+        self.fetches = 0
+
+    async def get(self) -> str:
+        if self._token is not None and self._clock() - self._fetched_at < TOKEN_REUSE_SECONDS:
+            return self._token
+        if self._fetching is None:
+            # MSAL blocks on AAD when its own cache is empty or stale, keep that off the loop.
+            self._fetching = asyncio.get_event_loop().run_in_executor(None, self._credentials.get_access_token)
+            self._fetching.add_done_callback(self._fetched)
+        return await asyncio.shield(self._fetching)
+
+    def _fetched(self, future: asyncio.Future) -> None:
+        self._fetching = None
+        if not future.cancelled() and future.exception() is None:
+            self._token = future.result()
+            self._fetched_at = self._clock()
+            self.fetches += 1
+
+
+class _BearerTokenPolicy(AsyncHTTPPolicy):
+    def __init__(self, token: Optional[_ChannelToken]):
+        super().__init__()
+        self._token = token
+
+    async def send(self, request: Request, **kwargs) -> Response:
+        if self._token is not None:
+            request.http_request.headers["Authorization"] = f"Bearer {await self._token.get()}"
+        return await self.next.send(request, **kwargs)
+
+
+class _AiohttpSender(AsyncHTTPSender):
+    """Sends msrest requests through the pool's session, keeping connections to each service url alive."""
+
+    def __init__(self, pool: "ConnectorClientPool"):
+        self._pool = pool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_details):
+        pass
+
+    async def send(self, request: Request, **config) -> Response:
+        http_request = request.http_request
+        self._pool.calls += 1
+        with METRICS.time("connector_call"):
+            try:
+                response = await self._pool.session.request(
+                    http_request.method, http_request.url, headers=dict(http_request.headers), data=http_request.data)
+                client_response = AioHttpClientResponse(http_request, response)
+                await client_response.load_body()
+            except Exception:
+                self._pool.errors += 1
+                raise
+        return Response(request, client_response)
+
+
+class ConnectorClientPool:
+    """Connector clients per service url and app credentials, all over one aiohttp connection pool.
+
+    The SDK's clients send each reply with ``requests`` from an executor thread and sign it with a
+    blocking MSAL lookup on the loop. These clients reuse keep-alive connections, at most
+    ``limit_per_host`` per service url, and fetch each channel token once every few minutes.
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 20, timeout: float = 15.0):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._clients: Dict[tuple, ConnectorClient] = {}
+        self._tokens: Dict[tuple, _ChannelToken] = {}
+        self.calls = 0
+        self.errors = 0
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created lazily so it is bound to the loop serving requests, once per worker process.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    def get(self, service_url: str, credentials: Optional[AppCredentials], user_agent: str = None) -> ConnectorClient:
+        credentials = credentials or MicrosoftAppCredentials.empty()
+        key = (service_url, credentials.microsoft_app_id, credentials.oauth_scope)
+        client = self._clients.get(key)
+        if client is None:
+            client = ConnectorClient(credentials, base_url=service_url)
+            if user_agent:
+                client.config.add_user_agent(user_agent)
+            client.config.pipeline = AsyncPipeline(
+                [
+                    client.config.user_agent_policy,
+                    _BearerTokenPolicy(self._token(credentials)),
+                    RawDeserializer(),
+                    client.config.http_logger_policy,
+                ],
+                _AiohttpSender(self),
+            )
+            self._clients[key] = client
+        return client
+
+    def _token(self, credentials: AppCredentials) -> Optional[_ChannelToken]:
+        # Same test as the SDK's signed_session: no app id and password, no Authorization header.
+        if not credentials._should_authorize(None):
+            return None
+        key = (credentials.microsoft_app_id, credentials.oauth_scope)
+        token = self._tokens.get(key)
+        if token is None:
+            token = self._tokens[key] = _ChannelToken(credentials)
+        return token
+
+    async def connect(self, credentials: Optional[AppCredentials] = None) -> None:
+        """Create the session and fetch the channel token of ``credentials`` ahead of the first reply."""
+        self.session
+        token = self._token(credentials or MicrosoftAppCredentials.empty())
+        if token is not None:
+            await token.get()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._clients),
+            "calls": self.calls,
+            "errors": self.errors,
+            "token_fetches": sum(token.fetches for token in self._tokens.values()),
+        }
+
+
+def _plain_text(activity: Activity) -> bool:
+    return (
+        activity.type == ActivityTypes.message
+        and bool(activity.text)
+        and not activity.attachments
+        and not activity.speak
+        and not activity.entities
+        and not activity.channel_data
+    )
+
+
+def merge_messages(activities: List[Activity]) -> List[Activity]:
+    """Consecutive plain text messages as one message, their texts separated by a blank line.
+
+    Only the last message of a run may carry suggested actions, which the merged one keeps.
+    """
+    merged: List[Activity] = []
+    for activity in activities:
+        previous = merged[-1] if merged else None
+        if (
+            previous is not None
+            and _plain_text(previous)
+            and not previous.suggested_actions
+            and _plain_text(activity)
+            and previous.text_format == activity.text_format
+            and previous.reply_to_id == activity.reply_to_id
+        ):
+            previous.text = f"{previous.text}\n\n{activity.text}"
+            previous.input_hint = activity.input_hint
+            previous.suggested_actions = activity.suggested_actions
+            continue
+        merged.append(activity)
+    return merged
@@ -4,6 +4,8 @@
 from botbuilder.dialogs import WaterfallDialog, WaterfallStepContext, DialogTurnResult
 from botbuilder.dialogs.prompts import ConfirmPrompt, TextPrompt, PromptOptions
 from botbuilder.core import MessageFactory
+from booking_analytics import BookingAnalytics
+from metrics import timed_steps
 from .cancel_and_help_dialog import CancelAndHelpDialog
 from .date_resolver_dialog import DateResolverDialog
 
@@ -11,21 +13,21 @@ from .date_resolver_dialog import DateResolverDialog
 class BookingDialog(CancelAndHelpDialog):
     """Flight booking implementation."""
 
-    def __init__(self, logs, dialog_id: str = None):
+    def __init__(self, logs, dialog_id: str = None, analytics: BookingAnalytics = None, log_events: bool = True):
         super(BookingDialog, self).__init__(dialog_id or BookingDialog.__name__)
         text_prompt = TextPrompt(TextPrompt.__name__)
-        waterfall_dialog = WaterfallDialog(
-            WaterfallDialog.__name__,
-            [
-                self.from_city_step,
-                self.to_city_step,
-                self.from_date_step,
-                self.to_date_step,
-                self.budget_step,
-                self.confirm_step,
-                self.final_step,
-            ]
-        )
+        steps = [
+            self.from_city_step,
+            self.to_city_step,
+            self.from_date_step,
+            self.to_date_step,
+            self.budget_step,
+            self.confirm_step,
+            self.final_step,
+        ]
+        if analytics is not None:
+            steps = analytics.track_steps(steps)
+        waterfall_dialog = WaterfallDialog(WaterfallDialog.__name__, timed_steps(BookingDialog.__name__, steps))
         self.add_dialog(text_prompt)
         self.add_dialog(ConfirmPrompt(ConfirmPrompt.__name__))
         self.add_dialog(
@@ -43,6 +45,9 @@ class BookingDialog(CancelAndHelpDialog):
         self.add_dialog(waterfall_dialog)
         self.initial_dialog_id = WaterfallDialog.__name__
         self._logs = logs
+        self._analytics = analytics
+        # One log record per booking, on top of the aggregates flushed by the analytics.
+        self._log_events = log_events
 
     async def from_city_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
         """Prompt for from_city."""
@@ -139,6 +144,11 @@ class BookingDialog(CancelAndHelpDialog):
     async def final_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
         """Complete the interaction and end the dialog."""
         booking_details = step_context.options
+        if self._analytics is not None:
+            self._analytics.booking_finished(booking_details, bool(step_context.result))
+
+        if not self._log_events:
+            return await step_context.end_dialog(booking_details if step_context.result else None)
 
         # TRACK THE DATA INTO Application INSIGHTS
         # more here https://docs.microsoft.com/en-us/azure/azure-monitor/app/api-custom-events-metrics
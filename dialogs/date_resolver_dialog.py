@@ -1,29 +1,52 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-from datatypes_date_time.timex import Timex
+from typing import Dict
 
-from botbuilder.core import MessageFactory
+from botbuilder.core import MessageFactory, TurnContext
 from botbuilder.dialogs import WaterfallDialog, DialogTurnResult, WaterfallStepContext
 from botbuilder.dialogs.prompts import (
     DateTimePrompt,
     PromptValidatorContext,
     PromptOptions,
     DateTimeResolution,
+    PromptRecognizerResult,
 )
+from botbuilder.schema import ActivityTypes
+from helpers.date_parser import DATE_PARSER, is_definite
+from metrics import timed_steps
+
 from .cancel_and_help_dialog import CancelAndHelpDialog
 
 
+class FastDateTimePrompt(DateTimePrompt):
+    """DateTimePrompt reading the common date formats without the recognizers-text model, see DATE_PARSER."""
+
+    async def on_recognize(
+        self, turn_context: TurnContext, state: Dict[str, object], options: PromptOptions
+    ) -> PromptRecognizerResult:
+        activity = turn_context.activity
+        if activity.type != ActivityTypes.message or not activity.text:
+            return await super().on_recognize(turn_context, state, options)
+
+        result = PromptRecognizerResult()
+        values = DATE_PARSER.recognize(activity.text, activity.locale or self.default_locale)
+        if values:
+            result.succeeded = True
+            result.value = [self.read_resolution(value) for value in values]
+        return result
+
+
 class DateResolverDialog(CancelAndHelpDialog):
     """Resolve the date"""
 
     def __init__(self, dialog_id: str = None, prompt_msg: str = "On what date would you like to travel?"):
         super(DateResolverDialog, self).__init__(dialog_id or DateResolverDialog.__name__)
 
-        date_time_prompt = DateTimePrompt(DateTimePrompt.__name__, DateResolverDialog.datetime_prompt_validator)
+        date_time_prompt = FastDateTimePrompt(DateTimePrompt.__name__, DateResolverDialog.datetime_prompt_validator)
 
         waterfall_dialog = WaterfallDialog(
-            WaterfallDialog.__name__ + "2", [self.initial_step, self.final_step]
+            WaterfallDialog.__name__ + "2", timed_steps(DateResolverDialog.__name__, [self.initial_step, self.final_step])
         )
 
         self.add_dialog(date_time_prompt)
@@ -50,7 +73,7 @@ class DateResolverDialog(CancelAndHelpDialog):
             )
 
         # We have a Date we just need to check it is unambiguous.
-        if "definite" in Timex(timex).types:
+        if is_definite(timex):
             # This is essentially a "reprompt" of the data we were given up front.
             return await step_context.prompt(
                 DateTimePrompt.__name__, PromptOptions(prompt=reprompt_msg)
@@ -70,6 +93,6 @@ class DateResolverDialog(CancelAndHelpDialog):
             timex = prompt_context.recognized.value[0].timex.split("T")[0]
 
             # TODO: Needs TimexProperty
-            return "definite" in Timex(timex).types
+            return is_definite(timex)
 
         return False
@@ -1,8 +1,5 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
-import json
-import re
-
 from booking_details import BookingDetails
 from botbuilder.core import MessageFactory
 from botbuilder.dialogs import (DialogTurnResult, WaterfallDialog,
@@ -10,7 +7,9 @@ from botbuilder.dialogs import (DialogTurnResult, WaterfallDialog,
 from botbuilder.dialogs.prompts import PromptOptions, TextPrompt
 from botbuilder.schema import Attachment, InputHints
 from flight_booking_recognizer import FlightBookingRecognizer
+from helpers.card_template import load_card_template
 from helpers.luis_helper import Intent, LuisHelper
+from metrics import timed_steps
 
 from .booking_dialog import BookingDialog, CancelAndHelpDialog
 
@@ -19,10 +18,13 @@ class MainDialog(CancelAndHelpDialog):
     def __init__(self, luis_recognizer: FlightBookingRecognizer, booking_dialog: BookingDialog):
         super(MainDialog, self).__init__(MainDialog.__name__)
         text_prompt = TextPrompt(TextPrompt.__name__)
-        wf_dialog = WaterfallDialog("WFDialog", [self.intro_step, self.act_step, self.final_step])
+        wf_dialog = WaterfallDialog(
+            "WFDialog", timed_steps(MainDialog.__name__, [self.intro_step, self.act_step, self.final_step])
+        )
 
         self._luis_recognizer = luis_recognizer
         self._booking_dialog_id = booking_dialog.id
+        self._booked_flight_card = load_card_template("bookedFlightCard")
 
         self.add_dialog(text_prompt)
         self.add_dialog(booking_dialog)
@@ -96,37 +98,16 @@ class MainDialog(CancelAndHelpDialog):
         return await step_context.replace_dialog(self.id, prompt_message)
 
 
-    # Create internal function
-    def replace(self, templateCard: dict, data: dict):
-        string_temp = str(templateCard)
-        for key in data:
-            pattern = "\${" + key + "}"
-            string_temp = re.sub(pattern, str(data[key]), string_temp)
-        return eval(string_temp)
-
-
-    # Load attachment from file.
+    # Render attachment from the compiled card template.
     def create_adaptive_card_attachment(self, result):
         """Create an adaptive card."""
-        
-        path =  "cards/bookedFlightCard.json"
-        with open(path) as card_file:
-            card = json.load(card_file)
-        
-        origin = result.from_city
-        destination = result.to_city
-        start_date = result.from_date
-        end_date = result.to_date
-        budget = result.budget
-
-        templateCard = {
-            "origin": origin, 
-            "destination": destination,
-            "start_date": start_date,
-            "end_date": end_date,
-            "budget": budget}
-
-        flightCard = self.replace(card, templateCard)
+
+        flightCard = self._booked_flight_card.render({
+            "origin": result.from_city,
+            "destination": result.to_city,
+            "start_date": result.from_date,
+            "end_date": result.to_date,
+            "budget": result.budget})
 
         return Attachment(
             content_type="application/vnd.microsoft.card.adaptive", content=flightCard)
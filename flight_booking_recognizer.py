@@ -1,25 +1,84 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-from botbuilder.ai.luis import LuisApplication, LuisRecognizer
+import contextlib
+import contextvars
+import copy
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+from botbuilder.ai.luis import LuisApplication
 from botbuilder.core import (
+    IntentScore,
     Recognizer,
     RecognizerResult,
     TurnContext
 )
+from botbuilder.schema import ActivityTypes
 
+from circuit_breaker import CLOSED, CircuitBreaker, CircuitOpenError
 from config import DefaultConfig
+from helpers.lru_cache import LruCache
+from local_recognizer import LocalRecognizer, LocalRecognizerModel
+from luis_client import LuisPredictionClient, LuisPredictionRecognizer
+from luis_recording import LuisRecordingStore, RecordingPredictionClient, ReplayPredictionClient
+from metrics import METRICS
+
+LOGGER = logging.getLogger(__name__)
+
+# Set while synthetic turns run, such as a worker's warm-up: the answers to their utterances, which must
+# not reach LUIS.
+_CANNED = contextvars.ContextVar("canned", default=None)
+
+# Entities whose resolution LUIS computes relative to the current date ("next friday", "in 2 weeks").
+DATE_DEPENDENT_ENTITIES = ("datetime",)
+
+
+def normalize_utterance(text: str) -> str:
+    """Case and whitespace insensitive form of an utterance, used as the cache key."""
+    return " ".join(text.casefold().split())
+
+
+def seconds_until_midnight(now: datetime = None) -> float:
+    now = now or datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - now).total_seconds()
+
+
+def degraded_result(text: str) -> RecognizerResult:
+    """BookFlight without entities, so the booking dialog prompts for every detail."""
+    return RecognizerResult(
+        text=text, intents={"BookFlight": IntentScore(score=1.0)}, entities={}, properties={"degraded": True}
+    )
+
+
+def _copy_result(result: RecognizerResult, text: str) -> RecognizerResult:
+    """A cached result for one turn: dialogs may edit what they get, the cache entry stays as LUIS sent it."""
+    return RecognizerResult(
+        text=text,
+        altered_text=result.altered_text,
+        intents=copy.deepcopy(result.intents),
+        entities=copy.deepcopy(result.entities),
+        properties=copy.deepcopy(result.properties),
+    )
 
 
 class FlightBookingRecognizer(Recognizer):
     def __init__(self, configuration: DefaultConfig):
         self._recognizer = None
-        luis_is_configured = (
-            configuration.LUIS_APP_ID
-            and configuration.LUIS_API_KEY
-            and configuration.LUIS_API_HOST_NAME
-        )
-        if luis_is_configured:
+        self._fallback = None
+        self.breaker = None
+        self._cache_namespace = (configuration.LUIS_APP_ID, configuration.LUIS_APP_VERSION)
+        self._cache = LruCache(configuration.LUIS_CACHE_SIZE, configuration.LUIS_CACHE_TTL)
+        if configuration.RECOGNIZER_BACKEND == "local":
+            # Offline model, no network hop and no LUIS dependency.
+            model = LocalRecognizerModel.load(configuration.LOCAL_MODEL_PATH)
+            self._cache_namespace = ("local", model.version)
+            self._recognizer = LocalRecognizer(model)
+        elif configuration.LUIS_APP_ID and configuration.LUIS_API_KEY and configuration.LUIS_API_HOST_NAME:
             # Set the recognizer options depending on which endpoint version you want to use e.g v2 or v3.
             # More details can be found in https://docs.microsoft.com/azure/cognitive-services/luis/luis-migration-api-v3
             luis_application = LuisApplication(
@@ -27,12 +86,144 @@ class FlightBookingRecognizer(Recognizer):
                 configuration.LUIS_API_KEY,
                 "https://" + configuration.LUIS_API_HOST_NAME,
             )
-            self._recognizer = LuisRecognizer(luis_application)
+            # The stock LuisRecognizer blocks the event loop on a synchronous HTTP call for every prediction.
+            client = LuisPredictionClient(
+                luis_application,
+                pool_size=configuration.LUIS_POOL_SIZE,
+                connect_timeout=configuration.LUIS_CONNECT_TIMEOUT,
+                read_timeout=configuration.LUIS_READ_TIMEOUT,
+                tps=configuration.LUIS_TPS,
+                hedge_percentile=configuration.LUIS_HEDGE_PERCENTILE,
+            )
+            if configuration.LUIS_RECORDING:
+                store = LuisRecordingStore(
+                    configuration.LUIS_RECORDING_PATH, configuration.LUIS_APP_ID, configuration.LUIS_APP_VERSION)
+                if configuration.LUIS_RECORDING == "replay":
+                    client = ReplayPredictionClient(store)
+                else:
+                    client = RecordingPredictionClient(client, store)
+            self._recognizer = LuisPredictionRecognizer(luis_application, client)
+            # A replay has no network to protect, and its misses must surface instead of being degraded.
+            if configuration.LUIS_BREAKER and configuration.LUIS_RECORDING != "replay":
+                self.breaker = CircuitBreaker(
+                    failure_rate=configuration.LUIS_BREAKER_FAILURE_RATE,
+                    slow_call_seconds=configuration.LUIS_BREAKER_SLOW_CALL,
+                    slow_rate=configuration.LUIS_BREAKER_SLOW_RATE,
+                    open_seconds=configuration.LUIS_BREAKER_OPEN_SECONDS,
+                )
+                # While LUIS is unavailable the offline model answers, if one was trained.
+                if os.path.exists(configuration.LOCAL_MODEL_PATH):
+                    self._fallback = LocalRecognizer(LocalRecognizerModel.load(configuration.LOCAL_MODEL_PATH))
 
     @property
     def is_configured(self) -> bool:
         # Returns true if luis is configured in the config.py and initialized.
         return self._recognizer is not None
 
+    @property
+    def is_degraded(self) -> bool:
+        return self.breaker is not None and self.breaker.state != CLOSED
+
+    @property
+    def cache(self) -> LruCache:
+        return self._cache
+
+    async def connect(self) -> None:
+        client = getattr(self._recognizer, "client", None)
+        if client is not None:
+            await client.connect()
+
+    async def close(self) -> None:
+        # Only the LUIS client holds connections and recording files.
+        client = getattr(self._recognizer, "client", None)
+        if client is not None:
+            await client.close()
+
+    def stats(self) -> dict:
+        stats = {"cache": self._cache.stats()}
+        client = getattr(self._recognizer, "client", None)
+        if client is not None:
+            stats["client"] = client.stats()
+        for name, recognizer in (("local", self._recognizer), ("fallback", self._fallback)):
+            if isinstance(recognizer, LocalRecognizer):
+                stats[name] = recognizer.stats()
+        if self.breaker is not None:
+            stats["breaker"] = {"open": self.is_degraded, **self.breaker.stats()}
+        return stats
+
+    @staticmethod
+    @contextlib.contextmanager
+    def canned(results: Dict[str, RecognizerResult]):
+        """Utterances of ``results`` are answered from it in this block, by this task and the ones it starts.
+
+        They reach neither LUIS nor the cache, the recording, the breaker or the metrics.
+        """
+        token = _CANNED.set(results)
+        try:
+            yield
+        finally:
+            _CANNED.reset(token)
+
     async def recognize(self, turn_context: TurnContext) -> RecognizerResult:
-        return await self._recognizer.recognize(turn_context)
+        canned = _CANNED.get()
+        activity = turn_context.activity
+        if canned is not None and activity is not None and activity.text in canned:
+            return canned[activity.text]
+        with METRICS.time("recognize"):
+            return await self._recognize_cached(turn_context)
+
+    async def _recognize_cached(self, turn_context: TurnContext) -> RecognizerResult:
+        activity = turn_context.activity
+        if activity is None or activity.type != ActivityTypes.message or not activity.text or activity.text.isspace():
+            return await self._recognizer.recognize(turn_context)
+
+        key = self._cache_namespace + (normalize_utterance(activity.text),)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return _copy_result(cached, activity.text)
+
+        result = await self._recognize_guarded(turn_context)
+        # Degraded answers are not cached, LUIS answers again as soon as the breaker closes.
+        if result is not None and not (result.properties or {}).get("degraded"):
+            self._cache.put(key, result, ttl=self._entry_ttl(result))
+            return _copy_result(result, activity.text)
+        return result
+
+    async def _recognize_guarded(self, turn_context: TurnContext) -> RecognizerResult:
+        if self.breaker is None:
+            return await self._recognizer.recognize(turn_context)
+        if not self.breaker.allow():
+            return await self._degrade(turn_context, CircuitOpenError("[FlightBookingRecognizer]: LUIS circuit is open"))
+
+        start = time.perf_counter()
+        try:
+            result = await self._recognizer.recognize(turn_context)
+        except Exception as error:
+            self.breaker.record(False, time.perf_counter() - start)
+            return await self._degrade(turn_context, error)
+        except BaseException:
+            # A cancelled call says nothing of LUIS, but would hold a half-open probe for good.
+            self.breaker.release()
+            raise
+        self.breaker.record(True, time.perf_counter() - start)
+        return result
+
+    async def _degrade(self, turn_context: TurnContext, error: Exception) -> RecognizerResult:
+        if self._fallback is not None:
+            try:
+                result = await self._fallback.recognize(turn_context)
+            except Exception as fallback_error:
+                LOGGER.error(f"[FlightBookingRecognizer]: local fallback failed: {fallback_error}")
+            else:
+                LOGGER.warning(f"[FlightBookingRecognizer]: recognized by the local model: {error}")
+                result.properties["degraded"] = True
+                return result
+        LOGGER.warning(f"[FlightBookingRecognizer]: degraded recognition: {error}")
+        return degraded_result(turn_context.activity.text)
+
+    def _entry_ttl(self, result: RecognizerResult) -> float:
+        # Relative dates are resolved by LUIS against today, so they must not outlive the day.
+        entities = result.entities or {}
+        if any(entities.get(name) for name in DATE_DEPENDENT_ENTITIES):
+            return seconds_until_midnight()
+        return self._cache.ttl
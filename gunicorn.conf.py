@@ -0,0 +1,18 @@
+# Loaded by gunicorn from the working directory, next to the settings given on its command line.
+#
+# The master imports the bot's heavy dependencies and builds the recognizers-text models once before
+# forking, every worker inherits them copy-on-write instead of paying for them again. The app itself
+# is not preloaded: building it starts the App Insights exporter threads, which do not survive a fork.
+import os
+import time
+
+
+def on_starting(server):
+    if os.environ.get("WarmStart", "true").lower() != "true":
+        return
+    start = time.perf_counter()
+    from warm_start import preload
+
+    profile = {"import warm_start": time.perf_counter() - start, **preload()}
+    server.log.info("Preloaded in %.2fs: %s", sum(profile.values()), ", ".join(
+        f"{step} {seconds * 1000:.0f}ms" for step, seconds in sorted(profile.items(), key=lambda item: -item[1])[:5]))
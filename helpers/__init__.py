@@ -1,6 +1,6 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-from . import activity_helper, luis_helper, dialog_helper
+from . import activity_helper, card_template, date_parser, datetime_resolver, latency_histogram, luis_helper, dialog_helper, lru_cache
 
-__all__ = ["activity_helper", "dialog_helper", "luis_helper"]
+__all__ = ["activity_helper", "card_template", "date_parser", "datetime_resolver", "dialog_helper", "latency_histogram", "luis_helper", "lru_cache"]
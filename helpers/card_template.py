@@ -0,0 +1,89 @@
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Iterable, List, Mapping
+
+CARDS_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..", "cards")
+SLOT_RE = re.compile(r"\$\{(\w+)\}")
+
+
+def _compile_string(text: str) -> Callable[[Mapping], str]:
+    parts = SLOT_RE.split(text)
+    if len(parts) == 1:
+        return lambda data: text
+    # Unknown fields keep their placeholder, as the previous re.sub implementation did.
+    if len(parts) == 3 and not parts[0] and not parts[2]:
+        field = parts[1]
+        return lambda data: str(data[field]) if field in data else text
+    statics, fields = parts[0::2], parts[1::2]
+    placeholders = ["${" + field + "}" for field in fields]
+
+    def render(data: Mapping) -> str:
+        out = [statics[0]]
+        for field, placeholder, static in zip(fields, placeholders, statics[1:]):
+            out.append(str(data[field]) if field in data else placeholder)
+            out.append(static)
+        return "".join(out)
+    return render
+
+
+def _compile(node) -> Callable[[Mapping], object]:
+    if isinstance(node, dict):
+        items = [(key, _compile(value)) for key, value in node.items()]
+        return lambda data: {key: render(data) for key, render in items}
+    if isinstance(node, list):
+        renders = [_compile(value) for value in node]
+        return lambda data: [render(data) for render in renders]
+    if isinstance(node, str):
+        return _compile_string(node)
+    return lambda data: node
+
+
+def _fields(node) -> set:
+    if isinstance(node, dict):
+        return set().union(*map(_fields, node.values())) if node else set()
+    if isinstance(node, list):
+        return set().union(*map(_fields, node)) if node else set()
+    if isinstance(node, str):
+        return set(SLOT_RE.findall(node))
+    return set()
+
+
+class CardTemplate:
+    """Adaptive card compiled once into static nodes and ``${field}`` slots.
+
+    Values are placed into the rendered structure as data and are never parsed again,
+    so quotes, braces or ``${...}`` inside a value come out verbatim.
+    """
+
+    def __init__(self, card: dict):
+        self.fields = frozenset(_fields(card))
+        self._render = _compile(card)
+
+    def render(self, data: Mapping = None) -> dict:
+        """Fresh card with every slot filled from ``data``; static parts are never shared between renders."""
+        return self._render(data or {})
+
+    def render_many(self, rows: Iterable[Mapping]) -> List[dict]:
+        render = self._render
+        return [render(data) for data in rows]
+
+    @classmethod
+    def load(cls, path: str) -> "CardTemplate":
+        with open(path) as card_file:
+            return cls(json.load(card_file))
+
+
+@lru_cache(maxsize=None)
+def load_card_template(name: str) -> CardTemplate:
+    """Compiled template for ``cards/<name>.json``, read from disk only on the first call."""
+    return CardTemplate.load(os.path.join(CARDS_DIR, name + ".json"))
+
+
+def preload_card_templates() -> List[str]:
+    """Compile every card under ``cards/`` so no turn pays for the disk read."""
+    names = sorted(file[:-5] for file in os.listdir(CARDS_DIR) if file.endswith(".json"))
+    for name in names:
+        load_card_template(name)
+    return names
@@ -0,0 +1,228 @@
+"""Departure and return dates of the LUIS ``datetime`` entities of an utterance.
+
+Every entity is parsed once per distinct timex into a date, a date range, a duration or nothing a
+trip can be bounded by (a season, a year alone, a time of day...). The kinds of the first two usable
+entities then pick a resolver in ``RESOLVERS``, which places them against one reference date read
+per call. LUIS's entity type is only a hint: "august 20" often comes back as a one day daterange.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from datatypes_date_time import Timex
+from dateutil.relativedelta import relativedelta
+
+from .lru_cache import LruCache
+
+DATE = "date"
+RANGE = "range"
+DURATION = "duration"
+
+# LUIS entity types that may bound a trip, recurring sets and times of day never do.
+DATE_TYPES = frozenset(("date", "daterange", "datetime", "datetimerange", "duration"))
+# Timex of "now", "today" and alike, Timex parses it to nothing.
+PRESENT_REF = "PRESENT_REF"
+
+
+class ParsedTimex(NamedTuple):
+    """A timex reduced to what bounds a trip. A date without year takes the reference year."""
+
+    kind: Optional[str]
+    year: Optional[int] = None
+    month: Optional[int] = None
+    day: Optional[int] = None
+    # ISO weekday, 1 for monday: the next such day on or after the reference date.
+    day_of_week: Optional[int] = None
+    delta: Union[relativedelta, timedelta, None] = None
+
+
+UNUSABLE = ParsedTimex(None)
+
+
+def duration_delta(timex: Timex) -> Optional[relativedelta]:
+    fields = ("years", "months", "weeks", "days", "hours", "minutes", "seconds")
+    if all(getattr(timex, field) is None for field in fields):
+        return None
+    return relativedelta(**{field: int(getattr(timex, field) or 0) for field in fields})
+
+
+def _fixed_delta(delta: Optional[relativedelta]) -> Union[relativedelta, timedelta, None]:
+    # Adding a timedelta is several times cheaper, and exact unless months or years are involved.
+    if delta is None or delta.years or delta.months:
+        return delta
+    return timedelta(days=delta.days, hours=delta.hours, minutes=delta.minutes, seconds=delta.seconds)
+
+
+def parse_timex(timex: str) -> ParsedTimex:
+    if timex == PRESENT_REF:
+        return ParsedTimex(DATE)
+    try:
+        parsed = Timex(timex)
+    except Exception:
+        return UNUSABLE
+    delta = duration_delta(parsed)
+    if parsed.month is not None and parsed.day_of_month is not None:
+        point = ParsedTimex(DATE, parsed.year, parsed.month, parsed.day_of_month)
+    elif parsed.day_of_week is not None and parsed.week_of_year is None:
+        point = ParsedTimex(DATE, day_of_week=parsed.day_of_week)
+    elif parsed.year is not None and parsed.week_of_year is not None:
+        # "next week": monday to sunday, unless the range says how long.
+        try:
+            monday = datetime.fromisocalendar(parsed.year, parsed.week_of_year, 1)
+        except ValueError:
+            return UNUSABLE
+        point = ParsedTimex(DATE, monday.year, monday.month, monday.day)
+        delta = delta or relativedelta(days=6)
+    elif parsed.month is not None:
+        # A whole month, unless the range says how long from its first day.
+        point = ParsedTimex(DATE, parsed.year, parsed.month, 1)
+        delta = delta or relativedelta(months=1, days=-1)
+    else:
+        point = None
+
+    delta = _fixed_delta(delta)
+    if point is None:
+        return ParsedTimex(DURATION, delta=delta) if delta is not None and timex.startswith("P") else UNUSABLE
+    if delta is not None:
+        return point._replace(kind=RANGE, delta=delta)
+    return point
+
+
+def _date(parsed: ParsedTimex, now: datetime) -> Optional[datetime]:
+    if parsed.day_of_week is not None:
+        return now + timedelta(days=(parsed.day_of_week - 1 - now.weekday()) % 7)
+    if parsed.month is None:
+        return now
+    try:
+        return datetime(parsed.year or now.year, parsed.month, parsed.day)
+    except ValueError:
+        # February 30th and alike.
+        return None
+
+
+def _single_date(now, date):
+    return _date(date, now), None
+
+
+def _single_range(now, date_range):
+    start = _date(date_range, now)
+    return start, start and start + date_range.delta
+
+
+def _single_duration(now, duration):
+    return now, now + duration.delta
+
+
+def _two_dates(now, first, second):
+    first, second = _date(first, now), _date(second, now)
+    if first is None or second is None:
+        return first or second, None
+    return min(first, second), max(first, second)
+
+
+def _date_and_duration(now, date, duration):
+    start = _date(date, now)
+    return start, start and start + duration.delta
+
+
+def _range_and_date(now, date_range, date):
+    start, end = _date(date_range, now), _date(date, now)
+    if start is None or end is None or end < start:
+        return _single_range(now, date_range)
+    return start, end
+
+
+def _date_and_range(now, date, date_range):
+    start, (_, end) = _date(date, now), _single_range(now, date_range)
+    if start is None or end is None or end < start:
+        return _single_range(now, date_range)
+    return start, end
+
+
+def _two_ranges(now, first, second):
+    start, end = _single_range(now, first)[0], _single_range(now, second)[1]
+    if start is None or end is None or end < start:
+        return _single_range(now, first)
+    return start, end
+
+
+# Kinds of the first two usable entities -> (departure, return) of the reference date and their parsed timexes.
+RESOLVERS = {
+    (DATE,): _single_date,
+    (RANGE,): _single_range,
+    (DURATION,): _single_duration,
+    (DATE, DATE): _two_dates,
+    (DATE, DURATION): _date_and_duration,
+    (DURATION, DATE): lambda now, duration, date: _date_and_duration(now, date, duration),
+    (RANGE, DATE): _range_and_date,
+    (DATE, RANGE): _date_and_range,
+    (RANGE, RANGE): _two_ranges,
+    # A range already has both ends, the duration next to it is mostly the same trip length.
+    (RANGE, DURATION): lambda now, date_range, duration: _single_range(now, date_range),
+    (DURATION, RANGE): lambda now, duration, date_range: _single_range(now, date_range),
+}
+_COMBINATIONS = {kinds: "+".join(kinds) for kinds in RESOLVERS}
+
+
+def format_date(day: Optional[datetime]) -> str:
+    """dd-mm-YYYY, what the booking dialog shows and logs, "" when unknown."""
+    return f"{day.day:02d}-{day.month:02d}-{day.year:04d}" if day else ""
+
+
+class DatetimeResolver:
+    """Resolves ``datetime`` entity lists to ``(from_date, to_date)``, ``""`` for a date it cannot place.
+
+    Parsed timexes are memoized, at most ``max_entries`` of them. ``clock`` gives the reference
+    date, read once per ``resolve`` or ``resolve_many`` call.
+    """
+
+    def __init__(self, max_entries: int = 1024, clock: Callable[[], datetime] = datetime.now):
+        self._parsed = LruCache(max_entries, ttl=float("inf"))
+        self._clock = clock
+        self.combinations = Counter()
+        self.unresolved = 0
+
+    def parse(self, timex: str) -> ParsedTimex:
+        parsed = self._parsed.get(timex)
+        if parsed is None:
+            parsed = parse_timex(timex)
+            self._parsed.put(timex, parsed)
+        return parsed
+
+    def resolve(self, datetimes: list, now: datetime = None) -> Tuple[str, str]:
+        return self._resolve(datetimes, now or self._clock())
+
+    def resolve_many(self, datetime_lists: Iterable[list], now: datetime = None) -> List[Tuple[str, str]]:
+        now = now or self._clock()
+        return [self._resolve(datetimes, now) for datetimes in datetime_lists]
+
+    def _resolve(self, datetimes: list, now: datetime) -> Tuple[str, str]:
+        usable = []
+        for entity in datetimes or ():
+            if entity.get("type") in DATE_TYPES and entity.get("timex"):
+                parsed = self.parse(entity["timex"][0])
+                if parsed.kind is not None:
+                    usable.append(parsed)
+                    if len(usable) == 2:
+                        break
+
+        kinds = tuple(parsed.kind for parsed in usable)
+        if kinds not in RESOLVERS:
+            kinds, usable = kinds[:1], usable[:1]
+        if not kinds:
+            self.unresolved += 1
+            return "", ""
+        self.combinations[_COMBINATIONS[kinds]] += 1
+        from_date, to_date = RESOLVERS[kinds](now, *usable)
+        return format_date(from_date), format_date(to_date)
+
+    def stats(self) -> dict:
+        return {
+            "combinations": dict(self.combinations),
+            "unresolved": self.unresolved,
+            "timex_cache": self._parsed.stats(),
+        }
+
+
+DATETIME_RESOLVER = DatetimeResolver()
@@ -5,9 +5,10 @@ from typing import Dict, Tuple
 from booking_details import BookingDetails
 from botbuilder.ai.luis import LuisRecognizer
 from botbuilder.core import IntentScore, TopIntent, TurnContext
-from datatypes_date_time import Timex
 from dateutil.relativedelta import relativedelta
 
+from .datetime_resolver import DATETIME_RESOLVER, duration_delta
+
 
 class Intent(Enum):
     BOOK_FLIGHT = "BookFlight"
@@ -27,11 +28,6 @@ def top_intent(intents: Dict[Intent, dict]) -> TopIntent:
 
     return TopIntent(max_intent, max_value)
 
-def to_datetime(timex, now):
-    return datetime(timex.year if timex.year else now.year,
-                    timex.month if timex.month else now.month,
-                    timex.day_of_month if timex.day_of_month else now.day)
-
 class LuisHelper:
     @staticmethod
     async def execute_luis_query(
@@ -90,71 +86,9 @@ class LuisHelper:
 
     @staticmethod
     def transform_date(timex):
-        return relativedelta(
-                years=int(timex.years) if timex.years else 0,
-                months=int(timex.months) if timex.months else 0,
-                weeks=int(timex.weeks) if timex.weeks else 0,
-                days=int(timex.days) if timex.days else 0,
-                hours=int(timex.hours) if timex.hours else 0,
-                minutes=int(timex.minutes) if timex.minutes else 0,
-                seconds=int(timex.seconds) if timex.seconds else 0)
+        return duration_delta(timex) or relativedelta()
 
     @staticmethod
-    def extract_datetimes(datetimes: list) -> Tuple[str, str]:
-        """"""
-        from_date, to_date = "", ""
-        now = datetime.now()
-        dt_format = "%d-%m-%Y"
-
-        if len(datetimes) == 1:
-            if datetimes[0]["type"] == "daterange":
-                timex = Timex(datetimes[0]["timex"][0])
-                from_date = to_datetime(timex, now)
-                to_date = from_date + LuisHelper.transform_date(timex)
-
-                from_date = from_date.strftime(dt_format)
-                to_date = to_date.strftime(dt_format)
-
-            elif datetimes[0]["type"] == "duration":
-                timex = Timex(datetimes[0]["timex"][0])
-                from_date = now
-                to_date = from_date + LuisHelper.transform_date(timex)
-
-                from_date = from_date.strftime(dt_format)
-                to_date = to_date.strftime(dt_format)
-
-        elif len(datetimes) == 2:
-            if (datetimes[0]["type"] == "date") and (datetimes[1]["type"] == "date"):
-                timex = Timex(datetimes[0]["timex"][0])
-                dt0 = to_datetime(timex, now)
-
-                timex = Timex(datetimes[1]["timex"][0])
-                dt1 = to_datetime(timex, now)
-
-                from_date = min(dt0, dt1)
-                to_date = max(dt0, dt1)
-
-                from_date = from_date.strftime(dt_format)
-                to_date = to_date.strftime(dt_format)
-
-            elif (datetimes[0]["type"] == "date") and (datetimes[1]["type"] == "duration"):
-                timex = Timex(datetimes[0]["timex"][0])
-                from_date = to_datetime(timex, now)
-
-                timex = Timex(datetimes[1]["timex"][0])
-                to_date = from_date + LuisHelper.transform_date(timex)
-
-                from_date = from_date.strftime(dt_format)
-                to_date = to_date.strftime(dt_format)
-
-            elif (datetimes[0]["type"] == "duration") and (datetimes[1]["type"] == "date"):
-                timex = Timex(datetimes[1]["timex"][0])
-                from_date = to_datetime(timex, now)
-
-                timex = Timex(datetimes[0]["timex"][0])
-                to_date = from_date + LuisHelper.transform_date(timex)
-
-                from_date = from_date.strftime(dt_format)
-                to_date = to_date.strftime(dt_format)
-
-        return from_date, to_date
+    def extract_datetimes(datetimes: list, now: datetime = None) -> Tuple[str, str]:
+        """Departure and return dates of the ``datetime`` entities, formatted dd-mm-YYYY, "" when unknown."""
+        return DATETIME_RESOLVER.resolve(datetimes, now)
@@ -0,0 +1,121 @@
+"""Inbound activities built from the fields every turn reads, the rest deserialized on first use."""
+
+from typing import Callable, Optional, Union
+
+import orjson
+from botbuilder.schema import Activity, ChannelAccount, ConversationAccount
+
+# Activity fields read on (nearly) every turn, by the adapter, ActivityHandler and the dialogs, with
+# how to build each from its JSON value.
+_PRIMITIVE = "primitive"
+_ACCOUNT = "account"
+_CONVERSATION = "conversation"
+_ACCOUNTS = "accounts"
+HOT_FIELDS = {
+    "type": _PRIMITIVE,
+    "id": _PRIMITIVE,
+    "service_url": _PRIMITIVE,
+    "channel_id": _PRIMITIVE,
+    "from_property": _ACCOUNT,
+    "conversation": _CONVERSATION,
+    "recipient": _ACCOUNT,
+    "members_added": _ACCOUNTS,
+    "locale": _PRIMITIVE,
+    "text": _PRIMITIVE,
+    "value": _PRIMITIVE,
+    "name": _PRIMITIVE,
+    "delivery_mode": _PRIMITIVE,
+    "channel_data": _PRIMITIVE,
+}
+_HOT_KEYS = tuple((attribute, Activity._attribute_map[attribute]["key"], kind) for attribute, kind in HOT_FIELDS.items())
+_ACCOUNT_KEYS = tuple((attribute, spec["key"]) for attribute, spec in ChannelAccount._attribute_map.items())
+_CONVERSATION_KEYS = tuple((attribute, spec["key"]) for attribute, spec in ConversationAccount._attribute_map.items())
+
+
+class _NotLean(Exception):
+    """The body holds something the lean path does not build the way msrest would."""
+
+
+def _primitive(value):
+    if isinstance(value, (dict, list)):
+        return value
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    raise _NotLean()
+
+
+def _model(cls, keys: tuple, value: Optional[dict]):
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise _NotLean()
+    model = cls.__new__(cls)
+    model.additional_properties = {}
+    for attribute, key in keys:
+        setattr(model, attribute, _primitive(value.get(key)))
+    return model
+
+
+def _accounts(value: Optional[list]):
+    if value is None:
+        return None
+    if not isinstance(value, list):
+        raise _NotLean()
+    return [_model(ChannelAccount, _ACCOUNT_KEYS, item) for item in value]
+
+
+_BUILDERS = {
+    _PRIMITIVE: _primitive,
+    _ACCOUNT: lambda value: _model(ChannelAccount, _ACCOUNT_KEYS, value),
+    _CONVERSATION: lambda value: _model(ConversationAccount, _CONVERSATION_KEYS, value),
+    _ACCOUNTS: _accounts,
+}
+
+
+class LeanActivity(Activity):
+    """An ``Activity`` holding only ``HOT_FIELDS`` until another field is read.
+
+    The first read of any other field deserializes the whole body with msrest, once, without
+    overwriting the hot fields, which may have been changed since. Until then the activity costs a
+    dict lookup per hot field instead of msrest's reflective walk of the full schema.
+    """
+
+    created = 0
+    materialized = 0
+
+    def __init__(self, body: dict):
+        # Activity.__init__ would set every field of the schema, which is what this class avoids.
+        self.additional_properties = {}
+        for attribute, key, kind in _HOT_KEYS:
+            setattr(self, attribute, _BUILDERS[kind](body.get(key)))
+        self._body = body
+        LeanActivity.created += 1
+
+    def __getattr__(self, name: str):
+        # Only called for attributes not set yet, i.e. cold fields until the body is deserialized.
+        body = self.__dict__.get("_body")
+        if body is None or name.startswith("__"):
+            raise AttributeError(name)
+        # A body msrest rejects is kept: the next cold field access raises the same error again.
+        activity = Activity.deserialize(body)
+        self._body = None
+        LeanActivity.materialized += 1
+        for attribute, value in activity.__dict__.items():
+            self.__dict__.setdefault(attribute, value)
+        return object.__getattribute__(self, name)
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {"created": cls.created, "materialized": cls.materialized}
+
+
+def lean_activity(body: Union[dict, bytes], loads: Callable = orjson.loads) -> Activity:
+    """Activity of a JSON body, lean when its hot fields are plain JSON as msrest would keep them."""
+    if isinstance(body, (bytes, str)):
+        body = loads(body)
+    if not isinstance(body, dict):
+        raise TypeError("[lean_activity]: the body must be a JSON object")
+    try:
+        return LeanActivity(body)
+    except _NotLean:
+        return Activity.deserialize(body)
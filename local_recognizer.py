@@ -0,0 +1,310 @@
+"""Offline intent/entity recognizer trained from the LUIS dataset (luis_app/trainSet.json)."""
+
+import hashlib
+import json
+import math
+import random
+import re
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from botbuilder.core import IntentScore, Recognizer, RecognizerResult, TurnContext
+from botbuilder.schema import ActivityTypes
+from recognizers_date_time import recognize_datetime
+from recognizers_text import Culture
+
+from helpers.date_parser import extract_dates
+
+ENTITIES = ("From", "To", "Budget")
+OUTSIDE = "O"
+
+TOKEN_RE = re.compile(r"\w+(?:['.,]\w+)*|[^\w\s]")
+
+
+def tokenize(text: str) -> List[Tuple[str, int, int]]:
+    """Split text into (token, start, end) triples, ``end`` being exclusive."""
+    return [(match.group(), match.start(), match.end()) for match in TOKEN_RE.finditer(text)]
+
+
+def word_shape(word: str) -> str:
+    if word.isdigit():
+        return "d"
+    if word.isupper():
+        return "X"
+    if word[:1].isupper():
+        return "Xx"
+    if word.isalpha():
+        return "x"
+    return "other"
+
+
+class AveragedPerceptron:
+    """Sparse multiclass averaged perceptron shared by the intent classifier and the entity tagger."""
+
+    def __init__(self, classes: Iterable[str], weights: Dict[str, Dict[str, float]] = None):
+        self.classes = list(classes)
+        self.weights = weights or {}
+        self._totals = defaultdict(float)
+        self._timestamps = defaultdict(int)
+        self._instances = 0
+
+    def scores(self, features: Iterable[str]) -> Dict[str, float]:
+        scores = dict.fromkeys(self.classes, 0.0)
+        weights = self.weights
+        for feature in features:
+            feature_weights = weights.get(feature)
+            if feature_weights:
+                for label, weight in feature_weights.items():
+                    scores[label] += weight
+        return scores
+
+    def predict(self, features: Iterable[str]) -> str:
+        scores = self.scores(features)
+        return max(self.classes, key=lambda label: (scores[label], label))
+
+    def update(self, truth: str, guess: str, features: Iterable[str]) -> None:
+        self._instances += 1
+        if truth == guess:
+            return
+        for feature in features:
+            feature_weights = self.weights.setdefault(feature, {})
+            for label, delta in ((truth, 1.0), (guess, -1.0)):
+                key = (feature, label)
+                weight = feature_weights.get(label, 0.0)
+                self._totals[key] += (self._instances - self._timestamps[key]) * weight
+                self._timestamps[key] = self._instances
+                feature_weights[label] = weight + delta
+
+    def average(self) -> None:
+        averaged = {}
+        for feature, feature_weights in self.weights.items():
+            kept = {}
+            for label, weight in feature_weights.items():
+                key = (feature, label)
+                total = self._totals[key] + (self._instances - self._timestamps[key]) * weight
+                value = round(total / self._instances, 4)
+                if value:
+                    kept[label] = value
+            if kept:
+                averaged[feature] = kept
+        self.weights = averaged
+
+    def to_dict(self) -> dict:
+        return {"classes": self.classes, "weights": self.weights}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AveragedPerceptron":
+        return cls(data["classes"], data["weights"])
+
+
+def intent_features(tokens: List[Tuple[str, int, int]]) -> List[str]:
+    words = [token.lower() for token, _, _ in tokens]
+    features = ["bias"]
+    features.extend("w=" + word for word in words)
+    features.extend("b=" + first + "|" + second for first, second in zip(words, words[1:]))
+    return features
+
+
+def tag_features(words: List[str], lowered: List[str], i: int, prev_tag: str, prev2_tag: str) -> List[str]:
+    word = words[i]
+    lower = lowered[i]
+    prev_word = lowered[i - 1] if i > 0 else "<s>"
+    prev2_word = lowered[i - 2] if i > 1 else "<s>"
+    next_word = lowered[i + 1] if i + 1 < len(words) else "</s>"
+    next2_word = lowered[i + 2] if i + 2 < len(words) else "</s>"
+    return [
+        "bias",
+        "w=" + lower,
+        "suf=" + lower[-3:],
+        "pre=" + lower[:3],
+        "shape=" + word_shape(word),
+        "pw=" + prev_word,
+        "ppw=" + prev2_word,
+        "nw=" + next_word,
+        "nnw=" + next2_word,
+        "pw|w=" + prev_word + "|" + lower,
+        "ppw|pw=" + prev2_word + "|" + prev_word,
+        "pt=" + prev_tag,
+        "pt|ppt=" + prev_tag + "|" + prev2_tag,
+        "pt|w=" + prev_tag + "|" + lower,
+        "pt|pw=" + prev_tag + "|" + prev_word,
+    ]
+
+
+def bio_tags(tokens: List[Tuple[str, int, int]], spans: List[Tuple[str, int, int]]) -> List[str]:
+    """BIO tags for tokens given (entity, start, end) character spans, ``end`` being exclusive."""
+    tags = [OUTSIDE] * len(tokens)
+    for entity, start, end in spans:
+        inside = False
+        for i, (_, token_start, token_end) in enumerate(tokens):
+            if token_start >= start and token_end <= end and tags[i] == OUTSIDE:
+                tags[i] = ("I-" if inside else "B-") + entity
+                inside = True
+    return tags
+
+
+class LocalRecognizerModel:
+    """Intent classifier plus BIO entity tagger."""
+
+    def __init__(self, intent_model: AveragedPerceptron, tagger: AveragedPerceptron, version: str = ""):
+        self.intent_model = intent_model
+        self.tagger = tagger
+        self.version = version
+
+    @staticmethod
+    def train(utterances: List[dict], iterations: int = 10, seed: int = 42) -> "LocalRecognizerModel":
+        """Train from utterances in the LUIS batch format written by luis_app/create_dataset.py."""
+        examples = []
+        for utterance in utterances:
+            tokens = tokenize(utterance["text"])
+            spans = [
+                (label["entityName"], label["startCharIndex"], label["endCharIndex"] + 1)
+                for label in utterance["entityLabels"]
+                if label["entityName"] in ENTITIES
+            ]
+            examples.append((tokens, utterance["intentName"], bio_tags(tokens, spans)))
+
+        intents = sorted({intent for _, intent, _ in examples})
+        tags = [OUTSIDE] + [prefix + entity for entity in ENTITIES for prefix in ("B-", "I-")]
+        intent_model = AveragedPerceptron(intents)
+        tagger = AveragedPerceptron(tags)
+
+        rng = random.Random(seed)
+        for _ in range(iterations):
+            rng.shuffle(examples)
+            for tokens, intent, gold_tags in examples:
+                features = intent_features(tokens)
+                intent_model.update(intent, intent_model.predict(features), features)
+
+                words = [token for token, _, _ in tokens]
+                lowered = [word.lower() for word in words]
+                prev_tag, prev2_tag = "<s>", "<s>"
+                for i, gold in enumerate(gold_tags):
+                    features = tag_features(words, lowered, i, prev_tag, prev2_tag)
+                    tagger.update(gold, tagger.predict(features), features)
+                    prev_tag, prev2_tag = gold, prev_tag
+
+        intent_model.average()
+        tagger.average()
+        model = LocalRecognizerModel(intent_model, tagger)
+        model.version = hashlib.sha1(json.dumps(model.to_dict(), sort_keys=True).encode()).hexdigest()[:12]
+        return model
+
+    def classify(self, tokens: List[Tuple[str, int, int]]) -> Tuple[str, float]:
+        scores = self.intent_model.scores(intent_features(tokens))
+        top = max(scores, key=lambda label: (scores[label], label))
+        # Softmax over the raw perceptron scores gives a LUIS-like confidence.
+        exp_sum = sum(math.exp(score - scores[top]) for score in scores.values())
+        return top, 1.0 / exp_sum
+
+    def tag(self, tokens: List[Tuple[str, int, int]]) -> List[str]:
+        words = [token for token, _, _ in tokens]
+        lowered = [word.lower() for word in words]
+        tags = []
+        prev_tag, prev2_tag = "<s>", "<s>"
+        for i in range(len(words)):
+            tag = self.tagger.predict(tag_features(words, lowered, i, prev_tag, prev2_tag))
+            # An I- tag is only valid right after a tag of the same entity.
+            if tag.startswith("I-") and prev_tag[2:] != tag[2:]:
+                tag = "B-" + tag[2:]
+            tags.append(tag)
+            prev_tag, prev2_tag = tag, prev_tag
+        return tags
+
+    def entity_spans(self, tokens: List[Tuple[str, int, int]]) -> List[Tuple[str, int, int]]:
+        spans = []
+        for (_, start, end), tag in zip(tokens, self.tag(tokens)):
+            if tag.startswith("B-"):
+                spans.append([tag[2:], start, end])
+            elif tag.startswith("I-"):
+                spans[-1][2] = end
+        return [tuple(span) for span in spans]
+
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "intents": self.intent_model.to_dict(),
+            "tagger": self.tagger.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LocalRecognizerModel":
+        return cls(
+            AveragedPerceptron.from_dict(data["intents"]),
+            AveragedPerceptron.from_dict(data["tagger"]),
+            data.get("version", ""),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "LocalRecognizerModel":
+        with open(path) as model_file:
+            return cls.from_dict(json.load(model_file))
+
+
+class LocalRecognizer(Recognizer):
+    """Drop-in replacement for LuisRecognizer returning the same RecognizerResult shape."""
+
+    def __init__(self, model: LocalRecognizerModel, resolve_datetimes: bool = True):
+        self.model = model
+        self.resolve_datetimes = resolve_datetimes
+        self.fast_datetimes = 0
+        self.model_datetimes = 0
+
+    async def recognize(self, turn_context: TurnContext) -> RecognizerResult:
+        activity = turn_context.activity
+        if activity is None or activity.type != ActivityTypes.message:
+            return None
+        return self.recognize_text(activity.text)
+
+    def stats(self) -> dict:
+        return {"fast_datetimes": self.fast_datetimes, "model_datetimes": self.model_datetimes}
+
+    def datetimes(self, text: str) -> List[Tuple[str, List[str], int, int]]:
+        """(type, timexes, start, end) of the datetimes in ``text``, ``end`` being exclusive.
+
+        The recognizers-text model costs about 20ms an utterance, it only reads those ``extract_dates``
+        cannot tell on its own.
+        """
+        found = extract_dates(text)
+        if found is not None:
+            self.fast_datetimes += 1
+            return found
+        self.model_datetimes += 1
+        found = []
+        for model_result in recognize_datetime(text, Culture.English):
+            values = model_result.resolution.get("values") if model_result.resolution else None
+            if values:
+                timexes = list(OrderedDict.fromkeys(value["timex"] for value in values))
+                found.append((values[0]["type"], timexes, model_result.start, model_result.end + 1))
+        return found
+
+    def recognize_text(self, text: str) -> RecognizerResult:
+        if not text or text.isspace():
+            return RecognizerResult(text=text, intents={"": IntentScore(score=1.0)}, entities={})
+
+        tokens = tokenize(text)
+        intent, score = self.model.classify(tokens)
+        entities = {"$instance": {}}
+        for entity, start, end in self.model.entity_spans(tokens):
+            # LUIS v2 reports entity values lowercased.
+            entities.setdefault(entity, []).append(text[start:end].lower())
+            entities["$instance"].setdefault(entity, []).append(
+                {"startIndex": start, "endIndex": end, "text": text[start:end], "type": entity}
+            )
+
+        if self.resolve_datetimes:
+            for kind, timexes, start, end in self.datetimes(text):
+                entities.setdefault("datetime", []).append({"type": kind, "timex": timexes})
+                entities["$instance"].setdefault("datetime", []).append({
+                    "startIndex": start,
+                    "endIndex": end,
+                    "text": text[start:end].lower(),
+                    "type": "builtin.datetimeV2." + kind,
+                })
+
+        return RecognizerResult(
+            text=text,
+            altered_text=None,
+            intents={intent: IntentScore(score=score)},
+            entities=entities,
+        )
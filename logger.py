@@ -1,11 +1,95 @@
+import inspect
 import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler
+
 from opencensus.trace import config_integration
 
 config_integration.trace_integrations(["logging", "requests"])
 
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to a bounded queue as they are, dropping them when it is full."""
+
+    def __init__(self, records: queue.Queue):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting, tracebacks included, happens on the listener thread. Keeping the record whole
+        # also keeps its exc_info and custom_dimensions for the exporter.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
 class AzureLogger:
+    """Logger whose records go through a bounded queue to ``handler`` on a dedicated thread.
+
+    Logging from a turn costs a ``put_nowait``: the handler, App Insights' exporter here, only runs on
+    the listener thread, which takes records by batches of ``batch_size``. When the exporter cannot
+    keep up, records beyond ``max_queue`` are dropped and counted.
+    """
 
-    def __init__(self, handler) -> None:
+    def __init__(self, handler, max_queue: int = 10000, batch_size: int = 100, name: str = __name__) -> None:
         handler.setFormatter(logging.Formatter("%(traceId)s %(spanId)s %(message)s"))
-        self.logger = logging.getLogger(__name__)
-        self.logger.addHandler(handler)
\ No newline at end of file
+        self.handler = handler
+        # App Insights' handler waits for its exporter without a timeout otherwise, e.g. on an unreachable endpoint.
+        self._flush_timeout = "timeout" in inspect.signature(handler.flush).parameters
+        self.batch_size = batch_size
+        self._records = queue.Queue(max_queue)
+        self._queue_handler = DroppingQueueHandler(self._records)
+        self.logger = logging.getLogger(name)
+        self.logger.addHandler(self._queue_handler)
+        self.handled = 0
+        self.handler_errors = 0
+        self._thread = threading.Thread(target=self._listen, name="azure-logger", daemon=True)
+        self._thread.start()
+
+    def _listen(self) -> None:
+        while True:
+            batch = [self._records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._records.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                if isinstance(record, threading.Event):
+                    record.set()
+                    continue
+                try:
+                    self.handler.handle(record)
+                    self.handled += 1
+                except Exception:
+                    self.handler_errors += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until the records logged so far reached the handler, then flush it. Blocks."""
+        deadline = time.monotonic() + timeout
+        done = threading.Event()
+        try:
+            self._records.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        if not done.wait(max(0.0, deadline - time.monotonic())):
+            return False
+        if self._flush_timeout:
+            self.handler.flush(timeout=max(0.0, deadline - time.monotonic()))
+        else:
+            self.handler.flush()
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._records.qsize(),
+            "dropped": self._queue_handler.dropped,
+            "handled": self.handled,
+            "handler_errors": self.handler_errors,
+        }
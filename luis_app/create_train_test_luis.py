@@ -1,22 +1,18 @@
+import os
+import sys
 import time
 
 from azure.cognitiveservices.language.luis.authoring import LUISAuthoringClient
 from azure.cognitiveservices.language.luis.authoring.models import \
     ApplicationCreateObject
 from azure.cognitiveservices.language.luis.runtime import LUISRuntimeClient
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
 from loguru import logger
 from msrest.authentication import CognitiveServicesCredentials
 
 from create_dataset import load_json
 
-credential = DefaultAzureCredential()
-secret_client = SecretClient(vault_url="https://chatbot-vault.vault.azure.net/", credential=credential)
-
-predictionKey = secret_client.get_secret('LuisAPIKey').value
-autoringKey = secret_client.get_secret('LuisAutoringAPIKey').value 
-autoringPredictionEndpoint = 'https://' + secret_client.get_secret('LuisAPIHostName').value
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from secrets_provider import provider_from_environment  # noqa: E402
 
 def chunks(lst, n):
     for i in range(0, len(lst), n):
@@ -27,6 +23,12 @@ versionId = '0.1'
 
 def main():
 
+    ### SECRETS ###
+    secrets = provider_from_environment().get_secrets(['LuisAPIKey', 'LuisAutoringAPIKey', 'LuisAPIHostName'])
+    predictionKey = secrets['LuisAPIKey']
+    autoringKey = secrets['LuisAutoringAPIKey']
+    autoringPredictionEndpoint = 'https://' + secrets['LuisAPIHostName']
+
     ### CONFIG ###
     appName = "BookFlight"
     versionId = "0.1"
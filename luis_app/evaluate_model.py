@@ -1,13 +1,18 @@
 import json
+import os
+import sys
 import time
 
 import pandas as pd
 from loguru import logger
 import requests
 
-from ..config import DefaultConfig
 from create_dataset import load_json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from config import DefaultConfig  # noqa: E402
+
+# Secrets are only fetched when evaluate() first reads them.
 CONFIG = DefaultConfig()
 
 def check_response_ok_or_raise_for_status(response):
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import sys
+import time
+
+from loguru import logger
+
+from create_dataset import load_json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from botbuilder.ai.luis import LuisApplication  # noqa: E402
+from config import DefaultConfig  # noqa: E402
+from luis_client import LuisPredictionClient  # noqa: E402
+from luis_recording import LuisRecordingStore, RecordingPredictionClient  # noqa: E402
+
+CONFIG = DefaultConfig()
+
+
+async def record(utterances: list, concurrency: int = 8) -> dict:
+    """Predict every utterance with the live LUIS app into the LuisRecordingPath store."""
+
+    application = LuisApplication(CONFIG.LUIS_APP_ID, CONFIG.LUIS_API_KEY, "https://" + CONFIG.LUIS_API_HOST_NAME)
+    store = LuisRecordingStore(CONFIG.LUIS_RECORDING_PATH, CONFIG.LUIS_APP_ID, CONFIG.LUIS_APP_VERSION)
+    # log=False keeps the recording run out of the LUIS active learning queue.
+    client = RecordingPredictionClient(
+        LuisPredictionClient(application, tps=CONFIG.LUIS_TPS or 5, log=False), store)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def predict(utterance):
+        if store.get(utterance) is None:
+            async with limit:
+                await client.predict(utterance)
+
+    try:
+        await asyncio.gather(*(predict(utterance) for utterance in utterances))
+    finally:
+        stats = client.stats()
+        await client.close()
+    return stats
+
+
+def main(path_to_data: str = './'):
+    utterances = sorted({utterance["text"] for name in ('trainSet.json', 'testSet.json')
+                         for utterance in load_json(path_to_data + name)})
+
+    start = time.perf_counter()
+    stats = asyncio.get_event_loop().run_until_complete(record(utterances))
+    logger.info(f'Recorded {stats["recording"]["recorded"]} predictions in {time.perf_counter() - start:.1f}s, '
+                f'{stats["recording"]["utterances"]} utterances in {CONFIG.LUIS_RECORDING_PATH}')
+
+    store = LuisRecordingStore(CONFIG.LUIS_RECORDING_PATH, CONFIG.LUIS_APP_ID, CONFIG.LUIS_APP_VERSION)
+    start = time.perf_counter()
+    missing = [utterance for utterance in utterances if store.get(utterance) is None]
+    logger.info(f'Replayed {len(utterances)} utterances in {(time.perf_counter() - start) * 1000:.1f}ms, '
+                f'{len(missing)} missing')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+
+from loguru import logger
+
+from create_dataset import load_json, save_json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from local_recognizer import LocalRecognizer, LocalRecognizerModel, tokenize  # noqa: E402
+
+
+def evaluate(model: LocalRecognizerModel, test_set: list) -> dict:
+    """Intent accuracy and exact-span entity precision/recall on the testSet.json format."""
+
+    correct_intents = 0
+    true_positives, predicted, expected = 0, 0, 0
+    for utterance in test_set:
+        tokens = tokenize(utterance["text"])
+        intent, _ = model.classify(tokens)
+        correct_intents += intent == utterance["intent"]
+
+        gold = {(e["entity"], e["startPos"], e["endPos"] + 1) for e in utterance["entities"]}
+        found = set(model.entity_spans(tokens))
+        true_positives += len(gold & found)
+        predicted += len(found)
+        expected += len(gold)
+
+    precision = true_positives / predicted if predicted else 0.0
+    recall = true_positives / expected if expected else 0.0
+    return {
+        "intent_accuracy": correct_intents / len(test_set),
+        "entity_precision": precision,
+        "entity_recall": recall,
+        "entity_f_score": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+    }
+
+
+def main(path_to_data: str = './', iterations: int = 10):
+    train_set = load_json(path_to_data + 'trainSet.json')
+    test_set = load_json(path_to_data + 'testSet.json')
+
+    start = time.perf_counter()
+    model = LocalRecognizerModel.train(train_set, iterations=iterations)
+    logger.info(f'Trained local model {model.version} in {time.perf_counter() - start:.1f}s')
+    logger.info(f'Test set scores: {evaluate(model, test_set)}')
+
+    # The datetime model is built on first use, workers do it before serving.
+    LocalRecognizer(model).recognize_text('fly on august 12 and back after the 20th')
+    for resolve_datetimes in (False, True):
+        recognizer = LocalRecognizer(model, resolve_datetimes=resolve_datetimes)
+        start = time.perf_counter()
+        for utterance in test_set:
+            recognizer.recognize_text(utterance["text"])
+        latency = (time.perf_counter() - start) / len(test_set)
+        what = 'intent + entity + datetime' if resolve_datetimes else 'intent + entity'
+        logger.info(f'Mean {what} latency: {latency * 1000:.3f}ms per utterance {recognizer.stats()}')
+
+    save_json(path_to_data + 'localModel.json', model.to_dict())
+    logger.info(f'Model saved to {path_to_data}localModel.json')
+
+
+if __name__ == '__main__':
+    main()
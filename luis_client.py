@@ -0,0 +1,215 @@
+"""Async LUIS v2 prediction client: one keep-alive connection pool per worker, coalesced and rate limited calls."""
+
+import asyncio
+import time
+from typing import Callable, Dict, Optional
+
+import aiohttp
+from azure.cognitiveservices.language.luis.runtime.models import LuisResult
+from botbuilder.ai.luis import LuisApplication
+from botbuilder.ai.luis.activity_util import ActivityUtil
+from botbuilder.ai.luis.luis_util import LuisUtil
+from botbuilder.core import IntentScore, Recognizer, RecognizerResult, TurnContext
+
+from helpers.latency_histogram import LatencyHistogram
+
+
+class TokenBucket:
+    """``rate`` tokens per second, up to ``burst`` saved up."""
+
+    def __init__(self, rate: float, burst: float = None, clock: Callable[[], float] = time.monotonic):
+        if rate <= 0:
+            raise ValueError("[TokenBucket]: rate must be positive")
+        self.rate = rate
+        self.burst = burst or rate
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated_at = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> float:
+        """Take a token, sleeping until one is available. Returns the seconds waited."""
+        waited = 0.0
+        while not self.try_acquire():
+            delay = (1 - self._tokens) / self.rate
+            await asyncio.sleep(delay)
+            waited += delay
+        return waited
+
+
+class LuisPredictionClient:
+    """Calls the LUIS v2 prediction endpoint with aiohttp.
+
+    Concurrent calls for the same utterance share one request. With ``hedge_percentile`` set, a
+    request still running after that latency percentile gets a second copy and the first answer wins.
+    """
+
+    def __init__(
+        self,
+        application: LuisApplication,
+        pool_size: int = 100,
+        connect_timeout: float = 1.0,
+        read_timeout: float = 3.0,
+        tps: float = 0,
+        hedge_percentile: float = 0,
+        hedge_min_samples: int = 50,
+        verbose: bool = False,
+        log: bool = True,
+    ):
+        self.endpoint = application.endpoint.rstrip("/")
+        self.url = f"{self.endpoint}/luis/v2.0/apps/{application.application_id}"
+        self._headers = {
+            "Ocp-Apim-Subscription-Key": application.endpoint_key,
+            "User-Agent": LuisUtil.get_user_agent(),
+        }
+        self._params = {"verbose": str(verbose).lower(), "log": str(log).lower()}
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.bucket = TokenBucket(tps) if tps else None
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyHistogram()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.requests = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.hedged = 0
+        self.throttled_seconds = 0.0
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created lazily so it is bound to the loop serving requests, once per worker process.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, headers=self._headers)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def connect(self) -> None:
+        """Open a pooled connection to the endpoint, so the first prediction skips the TCP and TLS handshakes."""
+        # A HEAD on the host is not a prediction, it neither counts against the quota nor is logged.
+        async with self.session.head(self.endpoint, allow_redirects=False):
+            pass
+
+    async def predict(self, utterance: str) -> dict:
+        """Raw LUIS JSON for ``utterance``."""
+        shared = self._inflight.get(utterance)
+        if shared is None:
+            shared = asyncio.ensure_future(self._predict(utterance))
+            self._inflight[utterance] = shared
+            shared.add_done_callback(lambda _: self._inflight.pop(utterance, None))
+        else:
+            self.coalesced += 1
+        # One caller giving up must not cancel the request for the others.
+        return await asyncio.shield(shared)
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge_percentile or self.latency.count < self.hedge_min_samples:
+            return None
+        delay = self.latency.percentile(self.hedge_percentile)
+        return None if delay == float("inf") else delay
+
+    async def _predict(self, utterance: str) -> dict:
+        if self.bucket is not None:
+            self.throttled_seconds += await self.bucket.acquire()
+        attempts = {asyncio.ensure_future(self._request(utterance))}
+        try:
+            delay = self._hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                # The hedge only goes out if it fits in the quota right now.
+                if not done and (self.bucket is None or self.bucket.try_acquire()):
+                    self.hedged += 1
+                    attempts.add(asyncio.ensure_future(self._request(utterance)))
+
+            error = None
+            pending = attempts
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        return attempt.result()
+                    error = error or attempt.exception()
+            raise error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    async def _request(self, utterance: str) -> dict:
+        self.requests += 1
+        start = time.perf_counter()
+        try:
+            async with self.session.post(self.url, params=self._params, json=utterance) as response:
+                response.raise_for_status()
+                result = await response.json()
+        except Exception:
+            self.errors += 1
+            raise
+        self.latency.observe(time.perf_counter() - start)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "coalesced": self.coalesced,
+            "hedged": self.hedged,
+            "inflight": len(self._inflight),
+            "throttled_seconds": self.throttled_seconds,
+            "latency": self.latency.snapshot(),
+        }
+
+
+class LuisPredictionRecognizer(Recognizer):
+    """Same RecognizerResult as LuisRecognizer with default v2 options, without its blocking HTTP call."""
+
+    luis_trace_type = "https://www.luis.ai/schemas/trace"
+    luis_trace_label = "Luis Trace"
+
+    def __init__(self, application: LuisApplication, client: LuisPredictionClient = None):
+        self._application = application
+        self.client = client or LuisPredictionClient(application)
+
+    async def recognize(self, turn_context: TurnContext) -> RecognizerResult:
+        utterance = turn_context.activity.text if turn_context.activity is not None else None
+        if not utterance or utterance.isspace():
+            return RecognizerResult(text=utterance, intents={"": IntentScore(score=1.0)}, entities={})
+
+        luis_result = LuisResult.deserialize(await self.client.predict(utterance))
+        recognizer_result = RecognizerResult(
+            text=utterance,
+            altered_text=luis_result.altered_query,
+            intents=LuisUtil.get_intents(luis_result),
+            entities=LuisUtil.extract_entities_and_metadata(luis_result.entities, luis_result.composite_entities, True),
+        )
+        LuisUtil.add_properties(luis_result, recognizer_result)
+        recognizer_result.properties["luisResult"] = luis_result
+
+        # The adapter drops trace activities outside the emulator, skip building them elsewhere.
+        if turn_context.activity.channel_id == "emulator":
+            trace_info = {
+                "recognizerResult": LuisUtil.recognizer_result_as_dict(recognizer_result),
+                "luisModel": {"ModelID": self._application.application_id},
+                "luisOptions": {"Staging": None},
+                "luisResult": LuisUtil.luis_result_as_dict(luis_result),
+            }
+            await turn_context.send_activity(ActivityUtil.create_trace(
+                turn_context.activity, "LuisRecognizer", trace_info, self.luis_trace_type, self.luis_trace_label,
+            ))
+        return recognizer_result
@@ -0,0 +1,204 @@
+"""Recorded LUIS predictions, to replay conversations and evaluations without calling LUIS.
+
+A store is a directory holding each distinct prediction once, named after the SHA-256 of its
+content, and ``index.bin``: sorted fixed-size records mapping the digest of (app id, app version,
+utterance) to a content digest. Replay memory-maps the index and binary searches it, so opening a
+store costs the same for ten utterances or the whole training set. Recording appends to
+``index.log`` until ``compact`` merges it into ``index.bin``.
+"""
+
+import bisect
+import hashlib
+import json
+import logging
+import mmap
+import os
+from typing import Dict, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"LUISIDX1"
+KEY_SIZE = 16
+CONTENT_SIZE = 32
+RECORD_SIZE = KEY_SIZE + CONTENT_SIZE
+
+
+class ReplayMiss(LookupError):
+    """The utterance was never recorded for this application version."""
+
+
+class _Index:
+    """Read-only view of ``index.bin`` as a sorted sequence of keys, for ``bisect``."""
+
+    def __init__(self, path: str):
+        self._file = None
+        self._map = None
+        self.count = 0
+        if os.path.exists(path) and os.path.getsize(path) > len(MAGIC):
+            self._file = open(path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._map[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"[LuisRecordingStore]: {path} is not a recording index")
+            self.count = (len(self._map) - len(MAGIC)) // RECORD_SIZE
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, position: int) -> bytes:
+        start = len(MAGIC) + position * RECORD_SIZE
+        return self._map[start:start + KEY_SIZE]
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        position = bisect.bisect_left(self, key)
+        if position < self.count and self[position] == key:
+            start = len(MAGIC) + position * RECORD_SIZE + KEY_SIZE
+            return self._map[start:start + CONTENT_SIZE]
+        return None
+
+    def items(self):
+        for position in range(self.count):
+            start = len(MAGIC) + position * RECORD_SIZE
+            yield self._map[start:start + KEY_SIZE], self._map[start + KEY_SIZE:start + RECORD_SIZE]
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+            self.count = 0
+
+
+class LuisRecordingStore:
+    """Content-addressed predictions of one LUIS application version under ``directory``."""
+
+    def __init__(self, directory: str, app_id: str, app_version: str):
+        self.directory = directory
+        self._namespace = f"{app_id}\0{app_version}\0".encode()
+        self._index_path = os.path.join(directory, "index.bin")
+        self._log_path = os.path.join(directory, "index.log")
+        self._index = _Index(self._index_path)
+        # Recorded since the last compaction, small enough to hold in memory.
+        self._journal: Dict[bytes, bytes] = {}
+        if os.path.exists(self._log_path):
+            with open(self._log_path) as log:
+                for line in log:
+                    key, content = line.split()
+                    self._journal[bytes.fromhex(key)] = bytes.fromhex(content)
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+    def __len__(self) -> int:
+        return len(self._index) + sum(1 for key in self._journal if self._index.get(key) is None)
+
+    def key(self, utterance: str) -> bytes:
+        return hashlib.blake2b(self._namespace + utterance.encode(), digest_size=KEY_SIZE).digest()
+
+    def _object_path(self, content: bytes) -> str:
+        name = content.hex()
+        return os.path.join(self.directory, "objects", name[:2], name + ".json")
+
+    def get(self, utterance: str) -> Optional[dict]:
+        key = self.key(utterance)
+        content = self._journal.get(key) or self._index.get(key)
+        if content is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with open(self._object_path(content), "rb") as prediction:
+            return json.loads(prediction.read())
+
+    def put(self, utterance: str, prediction: dict) -> None:
+        body = json.dumps(prediction, sort_keys=True, separators=(",", ":")).encode()
+        content = hashlib.sha256(body).digest()
+        path = self._object_path(content)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and renamed, a reader never sees half an object.
+            with open(path + ".tmp", "wb") as prediction_file:
+                prediction_file.write(body)
+            os.replace(path + ".tmp", path)
+        key = self.key(utterance)
+        self._journal[key] = content
+        with open(self._log_path, "a") as log:
+            log.write(f"{key.hex()} {content.hex()}\n")
+        self.recorded += 1
+
+    def compact(self) -> int:
+        """Merge the recording log into ``index.bin``, returns the number of indexed utterances."""
+        if not self._journal:
+            return len(self._index)
+        records = dict(self._index.items())
+        records.update(self._journal)
+        temporary = self._index_path + ".tmp"
+        with open(temporary, "wb") as index:
+            index.write(MAGIC)
+            for key in sorted(records):
+                index.write(key + records[key])
+        self._index.close()
+        os.replace(temporary, self._index_path)
+        os.remove(self._log_path)
+        self._journal = {}
+        self._index = _Index(self._index_path)
+        return len(self._index)
+
+    def close(self) -> None:
+        self._index.close()
+
+    def stats(self) -> dict:
+        return {
+            "utterances": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "recorded": self.recorded,
+        }
+
+
+class RecordingPredictionClient:
+    """Forwards to a live prediction client and records every response it gets."""
+
+    def __init__(self, client, store: LuisRecordingStore):
+        self.client = client
+        self.store = store
+
+    async def predict(self, utterance: str) -> dict:
+        prediction = await self.client.predict(utterance)
+        self.store.put(utterance, prediction)
+        return prediction
+
+    async def connect(self) -> None:
+        await self.client.connect()
+
+    async def close(self) -> None:
+        await self.client.close()
+        self.store.compact()
+        self.store.close()
+
+    def stats(self) -> dict:
+        return {**self.client.stats(), "recording": self.store.stats()}
+
+
+class ReplayPredictionClient:
+    """Serves recorded responses only, raising ``ReplayMiss`` for anything else."""
+
+    def __init__(self, store: LuisRecordingStore):
+        self.store = store
+        self.missed = set()
+
+    async def predict(self, utterance: str) -> dict:
+        prediction = self.store.get(utterance)
+        if prediction is None:
+            if utterance not in self.missed:
+                self.missed.add(utterance)
+                LOGGER.warning(f"[ReplayPredictionClient]: no recorded prediction for {utterance!r}")
+            raise ReplayMiss(utterance)
+        return prediction
+
+    async def connect(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        self.store.close()
+
+    def stats(self) -> dict:
+        return {"replay": self.store.stats(), "missed_utterances": len(self.missed)}
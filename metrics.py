@@ -0,0 +1,125 @@
+"""In-process turn phase histograms and component stats, rendered in the Prometheus text format."""
+
+import functools
+import re
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from opencensus.trace import execution_context
+
+from helpers.latency_histogram import DEFAULT_BUCKETS, LatencyHistogram
+
+TURN_PHASE = "bot_turn_phase_seconds"
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]+", "_", name).strip("_")
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...], le: str = None) -> str:
+    pairs = [f'{name}="{value}"' for name, value in labels]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _flatten(prefix: str, stats: dict):
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (bool, int, float)):
+            yield _metric_name(name), float(value)
+
+
+class _Timer:
+    """Observes the time spent in a ``with`` block, optionally as a child span of the request too."""
+
+    __slots__ = ("_histogram", "_span_name", "_tracer", "_start")
+
+    def __init__(self, histogram: LatencyHistogram, span_name: str = None):
+        self._histogram = histogram
+        self._span_name = span_name
+        self._tracer = None
+
+    def __enter__(self):
+        if self._span_name is not None:
+            self._tracer = execution_context.get_opencensus_tracer()
+            self._tracer.start_span(name=self._span_name)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._start)
+        if self._tracer is not None:
+            self._tracer.end_span()
+        return False
+
+
+class MetricsRegistry:
+    """Latency histograms keyed by name and labels, plus gauges read from ``stats()`` methods on scrape.
+
+    Observing costs two ``perf_counter`` calls and a bisect, so timers stay on in production. With
+    ``spans`` set every timed block is also a child span of the current opencensus trace.
+    """
+
+    def __init__(self, spans: bool = False):
+        self.spans = spans
+        self._histograms: Dict[Tuple[str, tuple], LatencyHistogram] = {}
+        self._help: Dict[str, str] = {TURN_PHASE: "Time spent in each phase of a bot turn."}
+        self._stats: List[Tuple[str, Callable[[], dict]]] = []
+
+    def histogram(self, name: str, help: str = None, buckets: Sequence[float] = DEFAULT_BUCKETS, **labels) -> LatencyHistogram:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = LatencyHistogram(buckets)
+            if help:
+                self._help[name] = help
+        return histogram
+
+    def time(self, phase: str, **labels) -> _Timer:
+        """``with METRICS.time("state_load"):`` records the block in ``bot_turn_phase_seconds``."""
+        span_name = ".".join([phase, *labels.values()]) if self.spans else None
+        return _Timer(self.histogram(TURN_PHASE, phase=phase, **labels), span_name)
+
+    def register_stats(self, prefix: str, stats: Callable[[], dict]) -> None:
+        """Export the numeric entries of ``stats()`` as ``<prefix>_<key>`` gauges."""
+        self._stats.append((prefix, stats))
+
+    def render(self) -> str:
+        lines = []
+        described = set()
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, bound)} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels, '+Inf')} {histogram.count}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for prefix, stats in self._stats:
+            for name, value in _flatten(prefix, stats()):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+
+def timed_steps(dialog: str, steps: List[Callable]) -> List[Callable]:
+    """Waterfall steps recording their time under ``phase="waterfall_step"``."""
+
+    def timed(step):
+        @functools.wraps(step)
+        async def run(step_context):
+            with METRICS.time("waterfall_step", dialog=dialog, step=step.__name__):
+                return await step(step_context)
+        return run
+
+    return [timed(step) for step in steps]
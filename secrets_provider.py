@@ -0,0 +1,206 @@
+"""Secret sources for DefaultConfig, resolved lazily and concurrently on first access."""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable
+
+KEY_VAULT_URL = "https://chatbot-vault.vault.azure.net/"
+
+
+class SecretProvider:
+    """Source of secret values by name."""
+
+    name = "base"
+
+    def get_secrets(self, names: Iterable[str]) -> Dict[str, str]:
+        raise NotImplementedError()
+
+
+class KeyVaultSecretProvider(SecretProvider):
+    """Azure Key Vault, one round-trip per secret but all of them in flight at once."""
+
+    name = "keyvault"
+
+    def __init__(self, vault_url: str = KEY_VAULT_URL, max_workers: int = 8):
+        self.vault_url = vault_url
+        self.max_workers = max_workers
+        self._client = None
+
+    @property
+    def client(self):
+        # The credential chain probes several sources, only pay for it when a secret is actually needed.
+        if self._client is None:
+            from azure.identity import DefaultAzureCredential
+            from azure.keyvault.secrets import SecretClient
+
+            self._client = SecretClient(vault_url=self.vault_url, credential=DefaultAzureCredential())
+        return self._client
+
+    def get_secrets(self, names: Iterable[str]) -> Dict[str, str]:
+        names = list(names)
+        client = self.client
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(names)) or 1) as executor:
+            values = executor.map(lambda name: client.get_secret(name).value, names)
+            return dict(zip(names, values))
+
+
+class EnvSecretProvider(SecretProvider):
+    """Environment variables named after the secrets, for offline runs and CI."""
+
+    name = "env"
+
+    def __init__(self, environ: Dict[str, str] = None):
+        self.environ = os.environ if environ is None else environ
+
+    def get_secrets(self, names: Iterable[str]) -> Dict[str, str]:
+        return {name: self.environ.get(name, "") for name in names}
+
+
+class FileSecretProvider(SecretProvider):
+    """Plain JSON file mapping secret names to values."""
+
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def get_secrets(self, names: Iterable[str]) -> Dict[str, str]:
+        with open(self.path) as secrets_file:
+            secrets = json.load(secrets_file)
+        return {name: secrets.get(name, "") for name in names}
+
+
+class EncryptedCacheSecretProvider(SecretProvider):
+    """Keeps the secrets of another provider in a Fernet encrypted file until ``ttl`` seconds old.
+
+    Worker restarts and forks on the same node then read one local file instead of the vault.
+    """
+
+    def __init__(self, provider: SecretProvider, path: str, key: str, ttl: float = 3600.0):
+        from cryptography.fernet import Fernet
+
+        self.provider = provider
+        self.path = path
+        self.ttl = ttl
+        self._fernet = Fernet(key)
+        self.hit = False
+
+    @property
+    def name(self) -> str:
+        return ("cache+" if self.hit else "") + self.provider.name
+
+    def _read(self) -> Dict[str, str]:
+        from cryptography.fernet import InvalidToken
+
+        try:
+            with open(self.path, "rb") as cache_file:
+                return json.loads(self._fernet.decrypt(cache_file.read(), ttl=int(self.ttl)))
+        except (OSError, ValueError, InvalidToken):
+            # Missing, expired or written with another key: fall back to the wrapped provider.
+            return {}
+
+    def _write(self, secrets: Dict[str, str]) -> None:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as cache_file:
+            cache_file.write(self._fernet.encrypt(json.dumps(secrets).encode()))
+        os.replace(tmp_path, self.path)
+
+    def get_secrets(self, names: Iterable[str]) -> Dict[str, str]:
+        names = list(names)
+        cached = self._read()
+        self.hit = all(name in cached for name in names)
+        if self.hit:
+            return {name: cached[name] for name in names}
+        secrets = self.provider.get_secrets(names)
+        self._write({**cached, **secrets})
+        return secrets
+
+
+def provider_from_environment(environ: Dict[str, str] = None) -> SecretProvider:
+    """Provider picked by ``SecretsProvider`` (keyvault, env or file), optionally behind the encrypted cache."""
+    environ = os.environ if environ is None else environ
+    kind = environ.get("SecretsProvider", "keyvault")
+    if kind == "env":
+        return EnvSecretProvider(environ)
+    if kind == "file":
+        return FileSecretProvider(environ.get("SecretsFile", "secrets.json"))
+    if kind != "keyvault":
+        raise ValueError(f"[secrets_provider]: unknown SecretsProvider {kind!r}")
+
+    provider = KeyVaultSecretProvider(environ.get("KeyVaultUrl", KEY_VAULT_URL))
+    if environ.get("SecretsCacheKey"):
+        provider = EncryptedCacheSecretProvider(
+            provider,
+            environ.get("SecretsCachePath", os.path.join(os.path.expanduser("~"), ".flight-bot-secrets")),
+            environ["SecretsCacheKey"],
+            float(environ.get("SecretsCacheTTL", 3600)),
+        )
+    return provider
+
+
+class SecretStore:
+    """Every required secret is fetched in one batch, the first time any of them is read."""
+
+    def __init__(self, provider: SecretProvider = None, names: Iterable[str] = ()):
+        self._provider = provider
+        self._names = list(names)
+        self._values = {}
+        self._lock = threading.Lock()
+        self.load_seconds = 0.0
+        self.loads = 0
+
+    @property
+    def provider(self) -> SecretProvider:
+        if self._provider is None:
+            self._provider = provider_from_environment()
+        return self._provider
+
+    def require(self, name: str) -> None:
+        if name not in self._names:
+            self._names.append(name)
+
+    def get(self, name: str) -> str:
+        if name not in self._values:
+            with self._lock:
+                if name not in self._values:
+                    self.require(name)
+                    self._load([required for required in self._names if required not in self._values])
+        return self._values[name]
+
+    def _load(self, names: list) -> None:
+        start = time.perf_counter()
+        self._values.update(self.provider.get_secrets(names))
+        self.load_seconds += time.perf_counter() - start
+        self.loads += 1
+
+    def stats(self) -> dict:
+        return {
+            "provider": self.provider.name,
+            "loaded": len(self._values),
+            "required": len(self._names),
+            "loads": self.loads,
+            "load_seconds": self.load_seconds,
+        }
+
+
+class secret:
+    """Class attribute resolved through a SecretStore on first read."""
+
+    def __init__(self, name: str, store: SecretStore = None):
+        self.name = name
+        self.store = store
+
+    def __set_name__(self, owner, attr_name: str) -> None:
+        if self.store is None:
+            self.store = SECRETS
+        self.store.require(self.name)
+
+    def __get__(self, instance, owner) -> str:
+        return self.store.get(self.name)
+
+
+SECRETS = SecretStore()
@@ -0,0 +1,331 @@
+"""Bot state storage in SQLite files shared by every worker process on the node."""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from botbuilder.core import Storage, StoreItem
+from jsonpickle import decode, encode
+
+from helpers.lru_cache import LruCache
+
+LOGGER = logging.getLogger(__name__)
+
+SCHEMA = "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, e_tag TEXT NOT NULL, value TEXT NOT NULL) WITHOUT ROWID"
+# Value of a pending delete.
+DELETED = object()
+
+
+def _e_tag_of(item) -> Optional[str]:
+    if isinstance(item, dict):
+        return item.get("e_tag")
+    return getattr(item, "e_tag", None)
+
+
+def _with_e_tag(item, e_tag: str):
+    if isinstance(item, dict):
+        item["e_tag"] = e_tag
+    elif isinstance(item, StoreItem) or hasattr(item, "e_tag"):
+        item.e_tag = e_tag
+    return item
+
+
+class _Shard:
+    """One database file, its writer thread and the changes waiting for the next group commit."""
+
+    def __init__(self, path: str):
+        self.path = path
+        # sqlite3 connections are bound to their thread, so every statement of a shard runs on this one.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-storage")
+        self.connection = None
+        # key -> (encoded value or DELETED, expected e_tag, new e_tag, waiters)
+        self.pending: Dict[str, Tuple[object, Optional[str], str, List[asyncio.Future]]] = {}
+        # The batch being committed, still newer than the cache until the commit returns.
+        self.committing: Dict[str, Tuple[object, Optional[str], str, List[asyncio.Future]]] = {}
+        self.flush_handle = None
+        self.flushing = None
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL only syncs at checkpoints: a commit survives a process crash, not a power loss.
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(SCHEMA)
+            self.connection = connection
+        return self.connection
+
+    def read(self, keys: List[str], cached: Dict[str, str] = None) -> Dict[str, Optional[Tuple[str, str]]]:
+        """Rows of ``keys``, None for a cached row whose e_tag (``cached``) is still the stored one.
+
+        A cached row is checked with its e_tag alone, another worker may have written it since.
+        """
+        connection = self.connect()
+        rows = {}
+        keys = list(keys)
+        if cached:
+            placeholders = ",".join("?" * len(cached))
+            stored = dict(connection.execute(f"SELECT key, e_tag FROM state WHERE key IN ({placeholders})", list(cached)))
+            for key, e_tag in cached.items():
+                if key not in stored:
+                    continue
+                if stored[key] == e_tag:
+                    rows[key] = None
+                else:
+                    keys.append(key)
+        if keys:
+            placeholders = ",".join("?" * len(keys))
+            for key, e_tag, value in connection.execute(
+                    f"SELECT key, e_tag, value FROM state WHERE key IN ({placeholders})", keys):
+                rows[key] = (e_tag, value)
+        return rows
+
+    def commit(self, batch: Dict[str, tuple]) -> Dict[str, Exception]:
+        """Apply a batch in a single transaction, returning the keys rejected on an e_tag conflict."""
+        connection = self.connect()
+        conflicts = {}
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            checked = [key for key, (_, expected, _, _) in batch.items() if expected not in (None, "*")]
+            current = {}
+            if checked:
+                placeholders = ",".join("?" * len(checked))
+                current = dict(connection.execute(f"SELECT key, e_tag FROM state WHERE key IN ({placeholders})", checked))
+            upserts, deletes = [], []
+            for key, (value, expected, e_tag, _) in batch.items():
+                if key in current and current[key] != expected:
+                    conflicts[key] = KeyError("Etag conflict.\nOriginal: %s\r\nCurrent: %s" % (expected, current[key]))
+                elif value is DELETED:
+                    deletes.append((key,))
+                else:
+                    upserts.append((key, e_tag, value))
+            if upserts:
+                connection.executemany("INSERT OR REPLACE INTO state (key, e_tag, value) VALUES (?, ?, ?)", upserts)
+            if deletes:
+                connection.executemany("DELETE FROM state WHERE key = ?", deletes)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return conflicts
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class SqliteStorage(Storage):
+    """Storage over ``shards`` SQLite databases in WAL mode, group committing coalesced writes.
+
+    Writes to the same key before the next commit are merged and every change queued on a shard
+    within ``flush_interval`` seconds is committed in one transaction. With ``write_behind`` the
+    caller does not wait for that commit, which costs at most ``flush_interval`` of state on a crash.
+    Reads are served from pending and committing writes, then a small LRU of recently used rows
+    once their e_tag is checked against the database, since other workers write the same files,
+    then the database.
+    Every value carries the e_tag of its row so a turn that read stale state fails instead of
+    overwriting a newer one. A write-behind change rejected that way fails the next read of its key,
+    so the conversation learns its last turn was not saved.
+    """
+
+    def __init__(
+        self,
+        directory: str = "state",
+        shards: int = 4,
+        flush_interval: float = 0.005,
+        max_batch: int = 256,
+        write_behind: bool = True,
+        cache_size: int = 1024,
+        cache_ttl: float = 5.0,
+    ):
+        super(SqliteStorage, self).__init__()
+        if shards <= 0:
+            raise ValueError("[SqliteStorage]: shards must be positive")
+        os.makedirs(directory, exist_ok=True)
+        self._shards = [_Shard(os.path.join(directory, f"state-{index}.db")) for index in range(shards)]
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.write_behind = write_behind
+        # Cached rows are checked against the stored e_tag before use, the ttl only bounds the memory held.
+        self._cache = LruCache(cache_size, cache_ttl)
+        # key -> why its last write-behind change was rejected, raised by the next read of the key.
+        self._rejected: Dict[str, Exception] = {}
+        self.commits = 0
+        self.conflicts = 0
+        self.bytes_written = 0
+        self.committed_changes = 0
+        self.coalesced_changes = 0
+
+    @property
+    def cache(self) -> LruCache:
+        return self._cache
+
+    def _shard(self, key: str) -> _Shard:
+        return self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+
+    async def read(self, keys: List[str]):
+        data = {}
+        if not keys:
+            return data
+        for key in keys:
+            error = self._rejected.pop(key, None)
+            if error is not None:
+                raise error
+        missing: Dict[_Shard, List[str]] = {}
+        cached: Dict[_Shard, Dict[str, Tuple[str, str]]] = {}
+        for key in keys:
+            shard = self._shard(key)
+            pending = shard.pending.get(key) or shard.committing.get(key)
+            if pending is not None:
+                if pending[0] is not DELETED:
+                    data[key] = _with_e_tag(decode(pending[0]), pending[2])
+                continue
+            row = self._cache.get(key)
+            if row is None:
+                missing.setdefault(shard, []).append(key)
+            else:
+                cached.setdefault(shard, {})[key] = row
+
+        if missing or cached:
+            loop = asyncio.get_event_loop()
+            shards = list(set(missing) | set(cached))
+            results = await asyncio.gather(*(
+                loop.run_in_executor(shard.executor, shard.read, missing.get(shard, []), {
+                    key: row[0] for key, row in cached.get(shard, {}).items()})
+                for shard in shards
+            ))
+            for shard, rows in zip(shards, results):
+                shard_cached = cached.get(shard, {})
+                for key in shard_cached:
+                    if key not in rows:
+                        # Deleted by another worker.
+                        self._cache.pop(key)
+                for key, row in rows.items():
+                    if row is None:
+                        row = shard_cached[key]
+                    elif self._cache.get(key, count=False) in (None, shard_cached.get(key)):
+                        # Unless a commit that finished while this read was in flight cached a newer row.
+                        self._cache.put(key, row)
+                    data[key] = _with_e_tag(decode(row[1]), row[0])
+        return data
+
+    async def write(self, changes: Dict[str, StoreItem]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if not changes:
+            return
+        waiters = []
+        for key, change in changes.items():
+            encoded = encode(change)
+            self.bytes_written += len(encoded)
+            waiters.append(self._enqueue(key, encoded, _e_tag_of(change)))
+        if not self.write_behind:
+            await asyncio.gather(*waiters)
+
+    async def delete(self, keys: List[str]):
+        waiters = [self._enqueue(key, DELETED, None) for key in keys]
+        if not self.write_behind:
+            await asyncio.gather(*waiters)
+
+    def _enqueue(self, key: str, value, expected: Optional[str]) -> asyncio.Future:
+        loop = asyncio.get_event_loop()
+        waiter = loop.create_future()
+        shard = self._shard(key)
+        previous = shard.pending.get(key)
+        if previous is not None:
+            # A later write in the same batch replaces the earlier one. It keeps the e_tag check of the
+            # first write since it was made against the state that one read.
+            self.coalesced_changes += 1
+            if expected is None or expected == previous[2]:
+                expected = previous[1]
+            waiters = previous[3] + [waiter]
+        else:
+            waiters = [waiter]
+        shard.pending[key] = (value, expected, uuid.uuid4().hex, waiters)
+
+        if len(shard.pending) >= self.max_batch:
+            self._schedule_flush(shard, 0)
+        elif shard.flush_handle is None:
+            self._schedule_flush(shard, self.flush_interval)
+        return waiter
+
+    def _schedule_flush(self, shard: _Shard, delay: float) -> None:
+        if shard.flush_handle is not None:
+            shard.flush_handle.cancel()
+        loop = asyncio.get_event_loop()
+        shard.flush_handle = loop.call_later(delay, lambda: loop.create_task(self._flush(shard)))
+
+    async def _flush(self, shard: _Shard) -> None:
+        shard.flush_handle = None
+        # Commits of a shard are serialized so batches are applied in the order they were queued.
+        while shard.flushing is not None:
+            await shard.flushing
+        if not shard.pending:
+            return
+        batch, shard.pending = shard.pending, {}
+        shard.committing = batch
+        loop = asyncio.get_event_loop()
+        shard.flushing = loop.create_future()
+        try:
+            conflicts = await loop.run_in_executor(shard.executor, shard.commit, batch)
+        except Exception as error:
+            LOGGER.error(f"[SqliteStorage]: commit of {len(batch)} changes to {shard.path} failed: {error}")
+            conflicts = dict.fromkeys(batch, error)
+        finally:
+            shard.flushing.set_result(None)
+            shard.flushing = None
+
+        self.commits += 1
+        self.committed_changes += len(batch) - len(conflicts)
+        for key, (value, _, e_tag, waiters) in batch.items():
+            error = conflicts.get(key)
+            if error is not None or value is DELETED:
+                self._cache.pop(key)
+            else:
+                self._cache.put(key, (e_tag, value))
+            if error is not None:
+                self.conflicts += 1
+                if self.write_behind:
+                    LOGGER.error(f"[SqliteStorage]: dropped write-behind change to {key}: {error}")
+                    self._rejected[key] = error
+            for waiter in waiters:
+                if error is None:
+                    waiter.set_result(None)
+                    continue
+                waiter.set_exception(error)
+                if self.write_behind:
+                    # Nobody awaits write-behind waiters, mark their exception as retrieved.
+                    waiter.exception()
+        shard.committing = {}
+
+    async def flush(self) -> None:
+        """Commit everything queued so far, e.g. before the process exits."""
+        for shard in self._shards:
+            if shard.flush_handle is not None:
+                shard.flush_handle.cancel()
+            await self._flush(shard)
+
+    async def close(self) -> None:
+        await self.flush()
+        loop = asyncio.get_event_loop()
+        for shard in self._shards:
+            await loop.run_in_executor(shard.executor, shard.close)
+            shard.executor.shutdown()
+
+    def stats(self) -> dict:
+        return {
+            "shards": len(self._shards),
+            "pending": sum(len(shard.pending) for shard in self._shards),
+            "commits": self.commits,
+            "committed_changes": self.committed_changes,
+            "coalesced_changes": self.coalesced_changes,
+            "conflicts": self.conflicts,
+            "bytes_written": self.bytes_written,
+            "cache": self._cache.stats(),
+        }
@@ -0,0 +1,117 @@
+"""Saves the bot states touched during a turn, once, in a single write per storage."""
+
+import time
+from typing import Callable, Dict, Union
+
+from botbuilder.core import BotState, StatePropertyAccessor, Storage, TurnContext
+from jsonpickle.pickler import Pickler
+
+from metrics import METRICS
+
+TOUCHED_STATES_KEY = "StatePersister.touched"
+TURN_STATS_KEY = "StatePersister.stats"
+# Touched through a property accessor set or delete: changed for sure.
+WRITTEN = "written"
+# Only read: the value may still have been mutated in place, compare hashes.
+READ = "read"
+
+
+class TrackedStatePropertyAccessor(StatePropertyAccessor):
+    """Property accessor recording on the turn which bot states it read or wrote."""
+
+    def __init__(self, bot_state: BotState, name: str):
+        self._bot_state = bot_state
+        self._accessor = bot_state.create_property(name)
+
+    @property
+    def name(self) -> str:
+        return self._accessor.name
+
+    def _touch(self, turn_context: TurnContext, how: str) -> None:
+        touched = turn_context.turn_state.setdefault(TOUCHED_STATES_KEY, {})
+        if touched.get(self._bot_state) != WRITTEN:
+            touched[self._bot_state] = how
+
+    async def get(self, turn_context: TurnContext, default_value_or_factory: Union[Callable, object] = None) -> object:
+        self._touch(turn_context, READ)
+        if self._bot_state.get_cached_state(turn_context) is None:
+            with METRICS.time("state_load"):
+                await self._bot_state.load(turn_context)
+        return await self._accessor.get(turn_context, default_value_or_factory)
+
+    async def delete(self, turn_context: TurnContext) -> None:
+        self._touch(turn_context, WRITTEN)
+        await self._accessor.delete(turn_context)
+
+    async def set(self, turn_context: TurnContext, value) -> None:
+        self._touch(turn_context, WRITTEN)
+        await self._accessor.set(turn_context, value)
+
+
+class StatePersister:
+    """End of turn save for a set of bot states.
+
+    ``bot_states`` maps each bot state to the storage it was created with. Only states reached through
+    accessors created by ``create_property`` are considered. Each one is serialized once and skipped
+    when its hash matches the one loaded, the rest go to storage in one ``write`` per storage instance.
+    The bytes written are counted by the storages themselves, they are the ones encoding the items.
+    """
+
+    def __init__(self, bot_states: Dict[BotState, Storage]):
+        self.bot_states = dict(bot_states)
+        self.turns = 0
+        self.writes = 0
+        self.skipped_writes = 0
+        self.serialize_seconds = 0.0
+
+    def create_property(self, bot_state: BotState, name: str) -> TrackedStatePropertyAccessor:
+        if bot_state not in self.bot_states:
+            raise ValueError(f"[StatePersister]: {type(bot_state).__name__} has no storage registered")
+        return TrackedStatePropertyAccessor(bot_state, name)
+
+    async def save_all_changes(self, turn_context: TurnContext) -> Dict[str, float]:
+        """Flush the dirty states of this turn and return the turn counters."""
+        touched = turn_context.turn_state.pop(TOUCHED_STATES_KEY, {})
+        stats = {"serialize_seconds": 0.0, "writes": 0, "skipped_writes": 0}
+        changes_by_storage = {}
+        saved = []
+
+        for bot_state, storage in self.bot_states.items():
+            cached_state = bot_state.get_cached_state(turn_context)
+            how = touched.get(bot_state)
+            if cached_state is None or how is None:
+                continue
+            start = time.perf_counter()
+            flattened = Pickler().flatten(cached_state.state)
+            # Same representation as CachedBotState.compute_hash, so BotState.save_changes agrees with us.
+            state_hash = str(flattened)
+            if how == READ and state_hash == cached_state.hash:
+                stats["serialize_seconds"] += time.perf_counter() - start
+                stats["skipped_writes"] += 1
+                continue
+            stats["serialize_seconds"] += time.perf_counter() - start
+
+            changes = changes_by_storage.setdefault(id(storage), (storage, {}))[1]
+            changes[bot_state.get_storage_key(turn_context)] = cached_state.state
+            saved.append((cached_state, state_hash))
+
+        for storage, changes in changes_by_storage.values():
+            await storage.write(changes)
+            stats["writes"] += len(changes)
+        for cached_state, state_hash in saved:
+            cached_state.hash = state_hash
+
+        self.turns += 1
+        self.writes += stats["writes"]
+        self.skipped_writes += stats["skipped_writes"]
+        self.serialize_seconds += stats["serialize_seconds"]
+        turn_context.turn_state[TURN_STATS_KEY] = stats
+        return stats
+
+    def stats(self) -> dict:
+        return {
+            "turns": self.turns,
+            "writes": self.writes,
+            "skipped_writes": self.skipped_writes,
+            "serialize_seconds": self.serialize_seconds,
+        }
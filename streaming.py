@@ -0,0 +1,176 @@
+"""Bot Framework activities over one WebSocket, many conversations multiplexed as streams.
+
+Every frame is a JSON text message naming its stream. The client sends ``{"stream", "activity"}``
+frames; the server answers on the same stream with ``{"stream", "activities"}`` for the replies of
+a turn and ``{"stream", "status", "body"}`` once the turn is over. On connect the server sends
+``{"window": n}``: a stream may have at most ``n`` turns without a status frame, each status frame
+gives one back. Frames beyond the window are answered with a 429 status and dropped, binary or
+malformed frames with a 400 status.
+
+The connection is authenticated once, at the handshake. Browsers cannot set the Authorization header
+of a WebSocket: they offer the ``bearer`` subprotocol followed by the token as a second one, e.g.
+``new WebSocket(url, ["bearer", token])``, or, last resort as it ends up in access logs, pass it as a
+``token`` query parameter.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import orjson
+from botbuilder.schema import Activity
+from botframework.connector.auth import ClaimsIdentity
+from starlette.websockets import WebSocket
+
+from lean_activity import lean_activity
+from metrics import METRICS
+
+BEARER_SUBPROTOCOL = "bearer"
+# run_turn(activity, identity, send_replies) -> (status, body)
+TurnRunner = Callable[[Activity, ClaimsIdentity, Callable[[List[Activity]], Awaitable]], Awaitable[Tuple[int, object]]]
+
+
+def stream_credentials(websocket: WebSocket) -> Tuple[str, Optional[str]]:
+    """Authorization header of a connection and the subprotocol to accept it with, if it came as one."""
+    auth_header = websocket.headers.get("authorization")
+    if auth_header:
+        return auth_header, None
+    subprotocols = websocket.scope.get("subprotocols") or []
+    if BEARER_SUBPROTOCOL in subprotocols[:-1]:
+        return "Bearer " + subprotocols[subprotocols.index(BEARER_SUBPROTOCOL) + 1], BEARER_SUBPROTOCOL
+    token = websocket.query_params.get("token")
+    return ("Bearer " + token if token else ""), None
+
+
+class StreamingConnection:
+    """One WebSocket: reads frames, runs each activity as a turn and writes back its replies and status."""
+
+    def __init__(self, endpoint: "StreamingEndpoint", websocket: WebSocket, identity: ClaimsIdentity, channel_id: str):
+        self._endpoint = endpoint
+        self._websocket = websocket
+        self.identity = identity
+        self.channel_id = channel_id
+        # stream -> turns sent without a status frame yet
+        self._inflight: Dict[str, int] = {}
+        self._turns = set()
+        self._send_lock = asyncio.Lock()
+        self.closed = False
+
+    async def serve(self) -> None:
+        await self._send({"window": self._endpoint.window})
+        try:
+            while True:
+                message = await self._websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                await self._receive(message.get("text"))
+        finally:
+            self.closed = True
+            # Turns already running finish and save their state, their replies have nowhere to go.
+            if self._turns:
+                await asyncio.gather(*self._turns, return_exceptions=True)
+
+    async def _receive(self, text: Optional[str]) -> None:
+        # Rejections are sent before reading on: a client flooding bad frames waits for its answers.
+        try:
+            if text is None:
+                raise TypeError("binary frames are not supported")
+            frame = orjson.loads(text)
+            stream = frame["stream"]
+            body = frame["activity"]
+            if not isinstance(stream, str) or not isinstance(body, dict):
+                raise TypeError("stream must be a string and activity an object")
+        except (ValueError, KeyError, TypeError) as error:
+            self._endpoint.rejected += 1
+            await self._send({"status": 400, "body": {"message": f"Malformed frame: {error}"}})
+            return
+
+        inflight = self._inflight.get(stream, 0)
+        if inflight >= self._endpoint.window or (not inflight and len(self._inflight) >= self._endpoint.max_streams):
+            self._endpoint.rejected += 1
+            await self._send({"stream": stream, "status": 429, "body": {"message": "Stream window exceeded"}})
+            return
+        self._inflight[stream] = inflight + 1
+        self._spawn(self._turn(stream, body))
+
+    def _spawn(self, coroutine: Awaitable) -> None:
+        task = asyncio.ensure_future(coroutine)
+        self._turns.add(task)
+        task.add_done_callback(self._turns.discard)
+
+    async def _turn(self, stream: str, body: dict) -> None:
+        try:
+            with METRICS.time("deserialize", delivery="stream"):
+                activity = lean_activity(body)
+            activity.channel_id = activity.channel_id or self.channel_id
+            if activity.channel_id != self.channel_id:
+                status, response = 403, {"message": "Activity channel differs from the connection's"}
+            else:
+                status, response = await self._endpoint.run_turn(
+                    activity, self.identity, lambda replies: self._send_replies(stream, replies))
+            self._endpoint.turns += 1
+        except Exception as error:
+            self._endpoint.errors += 1
+            status, response = 500, {"message": f"{error}"}
+        finally:
+            inflight = self._inflight.pop(stream) - 1
+            if inflight:
+                self._inflight[stream] = inflight
+        await self._send({"stream": stream, "status": status, "body": response})
+
+    async def _send_replies(self, stream: str, replies: List[Activity]) -> None:
+        await self._send({"stream": stream, "activities": [reply.serialize() for reply in replies]})
+
+    async def _send(self, frame: dict) -> None:
+        if self.closed:
+            self._endpoint.dropped_frames += 1
+            return
+        # A client that stops reading holds up this send, and with it the turns writing to the socket.
+        async with self._send_lock:
+            try:
+                await self._websocket.send_text(orjson.dumps(frame).decode())
+            except Exception:
+                self.closed = True
+                self._endpoint.dropped_frames += 1
+
+
+class StreamingEndpoint:
+    """Serves streaming connections, each authenticated once by the caller before ``serve``.
+
+    ``run_turn`` drives the bot's turn pipeline for an activity and hands its replies to the given
+    callable. ``window`` bounds the unanswered turns of a stream and ``max_streams`` the streams
+    with turns in flight on one connection.
+    """
+
+    def __init__(self, run_turn: TurnRunner, window: int = 8, max_streams: int = 1000):
+        if window <= 0:
+            raise ValueError("[StreamingEndpoint]: window must be positive")
+        self.run_turn = run_turn
+        self.window = window
+        self.max_streams = max_streams
+        self.connections = 0
+        self.open_connections = 0
+        self.turns = 0
+        self.errors = 0
+        self.rejected = 0
+        self.dropped_frames = 0
+
+    async def serve(
+        self, websocket: WebSocket, identity: ClaimsIdentity, channel_id: str, subprotocol: str = None
+    ) -> None:
+        await websocket.accept(subprotocol)
+        self.connections += 1
+        self.open_connections += 1
+        try:
+            await StreamingConnection(self, websocket, identity, channel_id).serve()
+        finally:
+            self.open_connections -= 1
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "open_connections": self.open_connections,
+            "turns": self.turns,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "dropped_frames": self.dropped_frames,
+        }
@@ -1,11 +1,55 @@
+import asyncio
+import logging
+import tempfile
+import threading
+import types
+from datetime import datetime
+from unittest import mock
+
 import aiounittest
+import orjson
 import pytest
+from aiohttp import web
+from fastapi import FastAPI, WebSocket
+from fastapi.responses import JSONResponse
+from botbuilder.ai.luis import LuisApplication
+from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, ConversationState, MemoryStorage, TurnContext, UserState
 from botbuilder.core.adapters import TestAdapter
+from botframework.connector.auth import ClaimsIdentity
+from botbuilder.schema import Activity, ActivityTypes, Attachment, ChannelAccount, ConversationAccount
 from fastapi.testclient import TestClient
+from msrest.exceptions import DeserializationError
+from opencensus.trace.span_data import SpanData
 
-from app import BOT, app
+from adapter_with_error_handler import AdapterWithErrorHandler
+from admission_control import AdmissionController, AdmissionRejected
+from auth_cache import ValidatedTokenCache
+from app import ANALYTICS, BOT, DIALOG, app
+from background_turns import BackgroundTurnQueue
+from booking_analytics import BookingAnalytics, SpaceSaving
+from booking_details import BookingDetails
+from bots import DialogAndWelcomeBot
+from bounded_memory_storage import BoundedMemoryStorage
+from circuit_breaker import CLOSED, OPEN, CircuitBreaker
 from config import DefaultConfig
+from connector_clients import ConnectorClientPool
 from flight_booking_recognizer import FlightBookingRecognizer
+from helpers.card_template import CardTemplate, load_card_template
+from helpers.date_parser import FastDateParser
+from helpers.datetime_resolver import DatetimeResolver
+from helpers.lru_cache import LruCache
+from lean_activity import LeanActivity, lean_activity
+from logger import AzureLogger
+from local_recognizer import LocalRecognizer, LocalRecognizerModel
+from luis_client import LuisPredictionClient
+from luis_recording import LuisRecordingStore, RecordingPredictionClient, ReplayMiss, ReplayPredictionClient
+from sqlite_storage import SqliteStorage
+from state_persistence import StatePersister
+from streaming import StreamingEndpoint
+from tracing import TailSamplingExporter
+from turn_scheduler import TurnScheduler
+from warm_start import WarmStart
+from secrets_provider import EnvSecretProvider, SecretStore, secret
 
 client = TestClient(app)
 
@@ -24,4 +68,751 @@ def test_luis_conf():
 def test_health_check():
     response = client.get("/health_check")
     assert response.status_code == 200
-    assert response.json() == {"message": "Flight Bot is running"}
\ No newline at end of file
+    assert response.json() == {"message": "Flight Bot is running"}
+
+
+class MetricsTest(aiounittest.AsyncTestCase):
+    async def test_turn_phases_exported(self):
+        storage = MemoryStorage()
+        bot = DialogAndWelcomeBot(ConversationState(storage), UserState(storage), DIALOG, storage)
+        await TestAdapter(bot.on_turn).test("Hello", "Where do you want to go for holidays?")
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert 'bot_turn_phase_seconds_count{dialog="MainDialog",phase="waterfall_step",step="intro_step"}' in response.text
+        assert 'bot_turn_phase_seconds_bucket{phase="state_save",le="+Inf"}' in response.text
+        assert "recognizer_cache_hits" in response.text
+
+
+class WarmStartTest(aiounittest.AsyncTestCase):
+    async def test_ready_once_the_synthetic_conversation_ran(self):
+        storage = MemoryStorage()
+        bot = DialogAndWelcomeBot(ConversationState(storage), UserState(storage), DIALOG, storage)
+
+        async def unreachable():
+            raise ConnectionError("unreachable")
+
+        warm_start = WarmStart(bot, connects={"luis": unreachable})
+        funnel = ANALYTICS.snapshot()["total"]["funnel"]
+        recognized = mock.AsyncMock()
+        with mock.patch("app.WARM_START", warm_start), \
+                mock.patch.object(FlightBookingRecognizer, "_recognize_cached", recognized):
+            assert client.get("/ready").status_code == 503
+            await warm_start.run()
+            response = client.get("/ready")
+        assert response.status_code == 200
+        assert {"datetime model", "connect luis", "turn 6", "total"} <= set(response.json()["warm_start"])
+        # Welcome card and greeting, then every booking prompt up to the confirmation, then "Exiting...".
+        assert (warm_start.error, warm_start.replies) == (None, 7)
+        # The booking request got the canned answer, LUIS was not asked.
+        recognized.assert_not_called()
+        assert storage.memory == {}
+        assert ANALYTICS.snapshot()["total"]["funnel"] == funnel
+
+
+def test_lru_cache_eviction_and_ttl():
+    now = [0.0]
+    cache = LruCache(max_size=2, ttl=10, clock=lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    now[0] = 11
+    assert cache.get("a") is None
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 2, 1)
+
+
+class RecognizerCacheTest(aiounittest.AsyncTestCase):
+    async def test_hits_do_not_share_the_cached_result(self):
+        recognizer = FlightBookingRecognizer(DefaultConfig())
+        context = TurnContext(TestAdapter(), Activity(type=ActivityTypes.message, text="book a flight to paris"))
+        first = await recognizer.recognize(context)
+        first.entities["To"].append("london")
+        hit = await recognizer.recognize(context)
+        hit.entities["To"].append("rome")
+        hit.intents["BookFlight"].score = 0.0
+        hit.properties["edited"] = True
+
+        again = await recognizer.recognize(context)
+        assert again.entities["To"] == ["paris"] and again.intents["BookFlight"].score > 0.0
+        assert "edited" not in again.properties
+        assert recognizer.stats()["cache"]["hits"] == 2
+
+
+def test_local_recognizer():
+    recognizer = LocalRecognizer(LocalRecognizerModel.load("luis_app/localModel.json"), resolve_datetimes=False)
+    result = recognizer.recognize_text("book a flight from london to paris")
+    assert list(result.intents) == ["BookFlight"]
+    assert result.entities["From"] == ["london"]
+    assert result.entities["To"] == ["paris"]
+
+
+def test_local_recognizer_datetimes_match_the_model():
+    recognizer = LocalRecognizer(LocalRecognizerModel.load("luis_app/localModel.json"))
+    texts = [utterance["text"] for utterance in orjson.loads(open("luis_app/testSet.json", "rb").read())]
+    texts += ["leave asap for 2-weeks", "between aug 9 and 24", "dec 28 to jan 3", "under 1800, not $2000"]
+    found = [recognizer.datetimes(text) for text in texts]
+    # Most utterances do without the model.
+    assert recognizer.stats()["fast_datetimes"] > 3 * recognizer.stats()["model_datetimes"]
+    with mock.patch("local_recognizer.extract_dates", return_value=None):
+        assert [recognizer.datetimes(text) for text in texts] == found
+    result = recognizer.recognize_text("Fly from Paris on August 12th, 2030 for 5 days")
+    assert result.entities["datetime"] == [{"type": "date", "timex": ["2030-08-12"]}, {"type": "duration", "timex": ["P5D"]}]
+    assert result.entities["$instance"]["datetime"][0] == {
+        "startIndex": 18, "endIndex": 35, "text": "august 12th, 2030", "type": "builtin.datetimeV2.date"}
+
+
+def test_card_template_render():
+    template = CardTemplate({"body": [{"text": "${origin}"}, {"text": "From ${origin} to ${destination}"}], "size": 1})
+    card = template.render({"origin": "l'île \"d'Yeu\"", "destination": "${budget}"})
+    assert card == {"body": [{"text": "l'île \"d'Yeu\""}, {"text": "From l'île \"d'Yeu\" to ${budget}"}], "size": 1}
+    assert template.fields == {"origin", "destination"}
+    assert load_card_template("bookedFlightCard") is load_card_template("bookedFlightCard")
+
+
+def test_datetime_resolver_combinations():
+    resolver = DatetimeResolver(max_entries=8, clock=lambda: datetime(2026, 10, 17, 9))
+
+    def entity(kind, timex):
+        return {"type": kind, "timex": [timex]}
+
+    resolved = resolver.resolve_many([
+        [entity("daterange", "(XXXX-08-18,XXXX-08-29,P11D)")],
+        [entity("duration", "P3D")],
+        [entity("date", "XXXX-09-02")],
+        [entity("duration", "P1W"), entity("date", "XXXX-09-02")],
+        [entity("date", "XXXX-09-09"), entity("date", "XXXX-09-01")],
+        [entity("date", "XXXX-09-12"), entity("daterange", "1800")],
+        [entity("daterange", "XXXX-09-20"), entity("duration", "P3D")],
+        [entity("date", "XXXX-WXX-5")],
+        [entity("daterange", "2026-11")],
+        [entity("set", "XXXX-WXX-5TNI"), entity("daterange", "SP")],
+    ])
+    assert resolved == [
+        ("18-08-2026", "29-08-2026"),
+        ("17-10-2026", "20-10-2026"),
+        ("02-09-2026", ""),
+        ("02-09-2026", "09-09-2026"),
+        ("01-09-2026", "09-09-2026"),
+        ("12-09-2026", ""),
+        ("20-09-2026", "23-09-2026"),
+        ("23-10-2026", ""),
+        ("01-11-2026", "30-11-2026"),
+        ("", ""),
+    ]
+    assert resolver.resolve([entity("date", "XXXX-09-02")]) == ("02-09-2026", "")
+    stats = resolver.stats()
+    assert stats["timex_cache"]["hits"] == 2 and stats["unresolved"] == 1 and stats["combinations"]["date"] == 4
+
+
+def test_fast_date_parser_matches_the_model():
+    reference = datetime(2026, 10, 17, 9)
+    parser = FastDateParser(clock=lambda: reference)
+    assert parser.recognize("August 12, 2030", "en-US") == [{"timex": "2030-08-12", "type": "date", "value": "2030-08-12"}]
+    assert parser.recognize("the 2nd of sept") == [
+        {"timex": "XXXX-09-02", "type": "date", "value": "2026-09-02"},
+        {"timex": "XXXX-09-02", "type": "date", "value": "2027-09-02"},
+    ]
+    assert parser.recognize("next fri") == [{"timex": "2026-10-23", "type": "date", "value": "2026-10-23"}]
+    assert parser.recognize("12/08/2024") == [{"timex": "2024-12-08", "type": "date", "value": "2024-12-08"}]
+    assert parser.recognize("august  12,  2030") == parser.recognize("August 12, 2030")
+    assert parser.stats()["hits"] == 6 and parser.stats()["cache_hits"] == 2
+
+    # Not a date, not a format of the fast path or not English: the model decides.
+    assert parser.recognize("feb 30 2030") == [{"timex": "2030-02-30", "type": "date", "value": "not resolved"}]
+    assert parser.recognize("in three days")[0]["timex"] == "2026-10-20"
+    assert parser.recognize("whenever") is None
+    assert parser.recognize("12/08/2024", "fr-fr")[0]["timex"] == "2024-08-12"
+    assert parser.stats()["fallbacks"] == 4
+
+
+def test_secrets_loaded_lazily_in_one_batch():
+    requested = []
+
+    class RecordingProvider(EnvSecretProvider):
+        def get_secrets(self, names):
+            requested.append(list(names))
+            return super().get_secrets(names)
+
+    store = SecretStore(RecordingProvider({"LuisAppId": "app", "LuisAPIKey": "key"}))
+
+    class Config:
+        LUIS_APP_ID = secret("LuisAppId", store)
+        LUIS_API_KEY = secret("LuisAPIKey", store)
+
+    assert requested == []
+    assert Config().LUIS_APP_ID == "app"
+    assert Config.LUIS_API_KEY == "key"
+    assert requested == [["LuisAppId", "LuisAPIKey"]]
+
+
+class SqliteStorageTest(aiounittest.AsyncTestCase):
+    async def test_group_commit_and_etag(self):
+        with tempfile.TemporaryDirectory() as directory:
+            storage = SqliteStorage(directory, shards=2, write_behind=False)
+            await storage.write({"conv": {"DialogState": {"step": 1}}, "user": {"name": "ana"}})
+            state = (await storage.read(["conv"]))["conv"]
+            assert state["DialogState"] == {"step": 1}
+
+            state["DialogState"]["step"] = 2
+            await storage.write({"conv": state})
+            reader = SqliteStorage(directory, shards=2, write_behind=False, cache_ttl=0)
+            assert (await reader.read(["conv", "user", "missing"])).keys() == {"conv", "user"}
+            with self.assertRaises(KeyError):
+                await storage.write({"conv": state})
+
+            await storage.delete(["user"])
+            assert await reader.read(["user"]) == {}
+            await storage.close()
+            await reader.close()
+
+    async def test_write_behind_reads_batch_being_committed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            storage = SqliteStorage(directory, shards=1)
+            await storage.write({"conv": {"step": 1}})
+            await storage.flush()
+            state = (await storage.read(["conv"]))["conv"]
+
+            state["step"] = 2
+            await storage.write({"conv": state})
+            committing = asyncio.ensure_future(storage.flush())
+            await asyncio.sleep(0)
+            # The next turn must see step 2 and its e_tag, not the cached step 1.
+            state = (await storage.read(["conv"]))["conv"]
+            assert state["step"] == 2
+            state["step"] = 3
+            await storage.write({"conv": state})
+            await committing
+            await storage.close()
+            assert storage.committed_changes == 3
+
+    async def test_workers_sharing_a_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            worker_a, worker_b = SqliteStorage(directory, shards=1), SqliteStorage(directory, shards=1)
+            await worker_a.write({"conv": {"step": 2}})
+            await worker_a.flush()
+            stale = (await worker_a.read(["conv"]))["conv"]
+
+            state = (await worker_b.read(["conv"]))["conv"]
+            state["step"] = 3
+            await worker_b.write({"conv": state})
+            await worker_b.flush()
+            # The row worker A cached is stale, it reads worker B's step.
+            assert (await worker_a.read(["conv"]))["conv"]["step"] == 3
+
+            # A write-behind change made against the stale row is rejected, and the next read says so.
+            stale["step"] = 4
+            await worker_a.write({"conv": stale})
+            await worker_a.flush()
+            with self.assertRaises(KeyError):
+                await worker_a.read(["conv"])
+            assert (await worker_a.read(["conv"]))["conv"]["step"] == 3
+            assert worker_a.stats()["conflicts"] == 1
+
+            await worker_b.delete(["conv"])
+            await worker_b.flush()
+            assert await worker_a.read(["conv"]) == {}
+            await worker_a.close()
+            await worker_b.close()
+
+
+class StatePersisterTest(aiounittest.AsyncTestCase):
+    async def test_unchanged_state_is_not_written(self):
+        storage = BoundedMemoryStorage()
+        conversation_state = ConversationState(storage)
+        persister = StatePersister({conversation_state: storage, UserState(storage): storage})
+        counter = persister.create_property(conversation_state, "counter")
+        activity = Activity(
+            type=ActivityTypes.message,
+            channel_id="test",
+            conversation=ConversationAccount(id="conversation"),
+            from_property=ChannelAccount(id="user"),
+        )
+
+        context = TurnContext(TestAdapter(), activity)
+        await counter.set(context, 1)
+        stats = await persister.save_all_changes(context)
+        assert (stats["writes"], stats["skipped_writes"]) == (1, 0)
+        bytes_written = storage.stats()["bytes_written"]
+        assert bytes_written == storage.total_bytes > 0
+
+        context = TurnContext(TestAdapter(), activity)
+        assert await counter.get(context) == 1
+        stats = await persister.save_all_changes(context)
+        assert (stats["writes"], stats["skipped_writes"]) == (0, 1)
+        assert storage.stats()["bytes_written"] == bytes_written
+
+
+class BoundedMemoryStorageTest(aiounittest.AsyncTestCase):
+    async def test_eviction_by_size(self):
+        storage = BoundedMemoryStorage(max_bytes=300)
+        await storage.write({"test/conversations/a": {"text": "a" * 100}, "test/users/a": {"text": "a" * 100}})
+        await storage.read(["test/conversations/a"])
+        await storage.write({"test/conversations/b": {"text": "b" * 100}})
+        assert (await storage.read(["test/users/a"])) == {}
+        assert storage.stats()["conversations"] == 2
+        assert storage.total_bytes == storage.size_of("test/conversations/a") + storage.size_of("test/conversations/b")
+        assert storage.evictions == 1
+
+    async def test_expired_dialog_restarts(self):
+        now = [0.0]
+        storage = BoundedMemoryStorage(ttl=60, clock=lambda: now[0])
+        bot = DialogAndWelcomeBot(ConversationState(storage), UserState(storage), DIALOG, storage)
+        adapter = TestAdapter(bot.on_turn)
+        step = await adapter.test("book a flight", "Where do you want to go for holidays?")
+        step = await step.test("book a flight from paris to london", "When do you want to leave?")
+        now[0] = 61
+        await step.test("tomorrow", "Where do you want to go for holidays?")
+        assert storage.expirations >= 1
+
+
+class TurnSchedulerTest(aiounittest.AsyncTestCase):
+    async def test_turns_ordered_per_conversation(self):
+        scheduler = TurnScheduler(max_concurrency=2)
+        events = []
+
+        def turn(conversation_id, index, delay):
+            async def run():
+                events.append(("start", conversation_id, index))
+                await asyncio.sleep(delay)
+                events.append(("end", conversation_id, index))
+                return index
+            return run
+
+        results = await asyncio.gather(
+            scheduler.run("a", turn("a", 1, 0.02)),
+            scheduler.run("a", turn("a", 2, 0)),
+            scheduler.run("b", turn("b", 1, 0)),
+        )
+        assert results == [1, 2, 1]
+        assert events.index(("end", "a", 1)) < events.index(("start", "a", 2))
+        assert events.index(("end", "b", 1)) < events.index(("end", "a", 1))
+        assert scheduler.stats()["turns"] == 3 and scheduler.stats()["conversations"] == 0
+
+
+class AdmissionControllerTest(aiounittest.AsyncTestCase):
+    async def test_queue_reject_and_aimd(self):
+        controller = AdmissionController(max_limit=2, min_limit=1, max_queue=1, queue_timeout=0.01, target_latency=1.0)
+        await controller.acquire()
+        await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        with self.assertRaises(AdmissionRejected) as rejected:
+            await controller.acquire()
+        assert rejected.exception.retry_after >= 1
+
+        controller.release(latency=0.1)
+        assert await waiter >= 0.0
+        controller.release(latency=5.0)
+        assert controller.limit == 1.8 and controller.inflight == 1
+        with self.assertRaises(AdmissionRejected):
+            await controller.acquire()
+        assert (controller.rejected, controller.timeouts) == (2, 1)
+
+    async def test_one_decrease_per_window(self):
+        controller = AdmissionController(max_limit=10, min_limit=1, target_latency=1.0, decrease_factor=0.5)
+        for _ in range(10):
+            await controller.acquire()
+        for _ in range(10):
+            controller.release(latency=5.0)
+        assert controller.limit == 5.0 and controller.inflight == 0
+
+        await controller.acquire()
+        controller.release(latency=5.0)
+        assert controller.limit == 2.5
+
+
+class BackgroundTurnQueueTest(aiounittest.AsyncTestCase):
+    async def test_bounded_queue_and_drain(self):
+        processed = []
+
+        async def process(activity, identity):
+            await asyncio.sleep(0)
+            processed.append(activity.id)
+
+        turns = BackgroundTurnQueue(process, workers=2, max_queue=3)
+        turns.start()
+        assert all(turns.submit(Activity(id=str(index)), None) for index in range(3))
+        assert not turns.submit(Activity(id="3"), None)
+        assert await turns.drain(timeout=1)
+        assert processed == ["0", "1", "2"]
+        assert not turns.submit(Activity(id="4"), None)
+        assert (turns.completed, turns.rejected) == (3, 2)
+
+
+class LuisPredictionClientTest(aiounittest.AsyncTestCase):
+    async def test_coalescing_and_hedging(self):
+        application = LuisApplication(
+            "00000000-0000-0000-0000-000000000000", "00000000-0000-0000-0000-000000000000", "https://luis.test")
+        client = LuisPredictionClient(application, hedge_percentile=0.5, hedge_min_samples=1)
+        delays = [0.05, 0]
+
+        async def request(utterance):
+            client.requests += 1
+            await asyncio.sleep(delays.pop(0) if delays else 0)
+            return {"query": utterance}
+
+        client._request = request
+        results = await asyncio.gather(client.predict("paris"), client.predict("paris"))
+        assert results == [{"query": "paris"}] * 2
+        assert (client.requests, client.coalesced, client.hedged) == (1, 1, 0)
+
+        client.latency.observe(0.001)
+        delays = [0.05, 0]
+        assert await client.predict("london") == {"query": "london"}
+        assert (client.requests, client.hedged) == (3, 1)
+
+
+class LuisRecordingTest(aiounittest.AsyncTestCase):
+    async def test_record_compact_and_replay(self):
+        class LiveClient:
+            async def predict(self, utterance):
+                return {"query": utterance, "topScoringIntent": {"intent": "BookFlight", "score": 0.9}}
+
+            async def close(self):
+                pass
+
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = RecordingPredictionClient(LiveClient(), LuisRecordingStore(directory, "app", "0.1"))
+            for utterance in ("to paris", "to london", "to paris"):
+                await recorder.predict(utterance)
+            await recorder.close()
+            await RecordingPredictionClient(LiveClient(), LuisRecordingStore(directory, "app", "0.1")).predict("to rome")
+
+            replay = ReplayPredictionClient(LuisRecordingStore(directory, "app", "0.1"))
+            assert len(replay.store) == 3
+            assert (await replay.predict("to london"))["query"] == "to london"
+            assert (await replay.predict("to rome"))["query"] == "to rome"
+            with self.assertRaises(ReplayMiss):
+                await replay.predict("to berlin")
+            with self.assertRaises(ReplayMiss):
+                await ReplayPredictionClient(LuisRecordingStore(directory, "app", "0.2")).predict("to paris")
+            assert replay.stats()["replay"]["misses"] == 1
+            await replay.close()
+
+
+def test_tail_sampling_keeps_errors_and_slow_traces():
+    emitted = []
+
+    class Exporter:
+        def emit(self, span_datas):
+            emitted.extend(span.name for span in span_datas)
+
+    traces = TailSamplingExporter(Exporter(), sample_rate=0, slow_threshold=1.0, export_interval=0.01)
+    for trace_id, error, seconds in (("ok", False, 0.1), ("error", True, 0.1), ("slow", False, 2.0)):
+        traces.start_trace(trace_id)
+        context = types.SimpleNamespace(trace_id=trace_id)
+        traces.export([SpanData(f"{trace_id}-{index}", context, *[None] * 13) for index in range(2)])
+        traces.finish_trace(trace_id, error, seconds)
+    assert traces.flush(timeout=1)
+    assert emitted == ["error-0", "error-1", "slow-0", "slow-1"]
+    assert (traces.exported_spans, traces.dropped_spans) == (4, 2)
+    assert traces.stats()["kept_slow"] == 1
+
+
+def test_logging_never_waits_for_the_handler():
+    unblocked = threading.Event()
+    records = []
+
+    class SlowHandler(logging.Handler):
+        def emit(self, record):
+            unblocked.wait()
+            records.append((record.getMessage(), record.custom_dimensions))
+
+    logs = AzureLogger(SlowHandler(), max_queue=2, name="test_logging_never_waits_for_the_handler")
+    dimensions = {"origin": "paris"}
+    for index in range(4):
+        logs.logger.warning(f"answer {index}", extra={"custom_dimensions": dimensions})
+    assert logs.stats()["dropped"] >= 1
+    unblocked.set()
+    assert logs.flush(timeout=1)
+    assert records[0] == ("answer 0", dimensions) and records[0][1] is dimensions
+    assert logs.stats()["handled"] + logs.stats()["dropped"] == 4
+
+
+class ValidatedTokenCacheTest(aiounittest.AsyncTestCase):
+    async def test_tokens_validated_once_until_expiry(self):
+        now = [1000.0]
+        cache = ValidatedTokenCache(max_entries=2, clock=lambda: now[0])
+        adapter = AdapterWithErrorHandler(
+            BotFrameworkAdapterSettings("app", "password"), ConversationState(MemoryStorage()), None, token_cache=cache)
+        activity = Activity(channel_id="msteams", service_url="https://smba.example.com/")
+        validate = mock.AsyncMock(side_effect=lambda request, header: ClaimsIdentity({"exp": now[0] + 60}, True))
+
+        with mock.patch.object(BotFrameworkAdapter, "_authenticate_request", validate):
+            first = await adapter.authenticate_request(activity, "Bearer a")
+            assert await adapter.authenticate_request(activity, "Bearer a") is first
+            assert validate.await_count == 1
+            # The channel takes part in the validation, the same token on another one is validated again.
+            await adapter.authenticate_request(Activity(channel_id="webchat", service_url=activity.service_url), "Bearer a")
+            assert validate.await_count == 2
+            now[0] = 1060
+            assert await adapter.authenticate_request(activity, "Bearer a") is not first
+            assert validate.await_count == 3
+
+        cache.put(cache.key("Bearer b", None, None), ClaimsIdentity({"exp": 2000}, True))
+        cache.put(cache.key("Bearer c", None, None), ClaimsIdentity({}, True))
+        assert cache.stats() == {
+            "entries": 2, "hits": 1, "misses": 3, "hit_rate": 0.25, "expirations": 1, "evictions": 1}
+
+
+class ConnectorDeliveryTest(aiounittest.AsyncTestCase):
+    async def test_replies_coalesced_over_pooled_connections(self):
+        received = []
+
+        async def reply(request):
+            received.append(await request.json())
+            return web.json_response({"id": str(len(received))})
+
+        stub = web.Application()
+        stub.router.add_post("/v3/conversations/{conversation_id}/activities/{activity_id}", reply)
+        runner = web.AppRunner(stub)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        pool = ConnectorClientPool()
+        adapter = AdapterWithErrorHandler(
+            BotFrameworkAdapterSettings("", ""), ConversationState(MemoryStorage()), None,
+            connector_pool=pool, coalesce_replies=True, merge_channels=["webchat"])
+
+        async def logic(turn_context):
+            delivered = len(received)
+            await turn_context.send_activity("Paris it is.")
+            await turn_context.send_activity("When do you leave?")
+            # Held on the merge channels only, elsewhere waiting would save no call.
+            assert len(received) == delivered + (0 if turn_context.activity.channel_id == "webchat" else 2)
+            await turn_context.send_activity(Activity(type="message", attachments=[Attachment(content_type="card")]))
+
+        posts = []
+        try:
+            for conversation, channel_id in (("first", "webchat"), ("second", "webchat"), ("third", "msteams")):
+                await adapter.process_activity(Activity(
+                    type="message", id="1", text="to Paris", channel_id=channel_id,
+                    service_url=f"http://127.0.0.1:{runner.addresses[0][1]}",
+                    conversation=ConversationAccount(id=conversation),
+                    from_property=ChannelAccount(id="user"), recipient=ChannelAccount(id="bot")), "", logic)
+                posts.append(len(received) - sum(posts))
+        finally:
+            await pool.close()
+            await runner.cleanup()
+
+        assert posts == [2, 2, 3]
+        assert [activity.get("text") for activity in received[:4]] == ["Paris it is.\n\nWhen do you leave?", None] * 2
+        assert adapter.stats()["outbound_calls_per_turn"] == 2 and adapter.stats()["merged"] == 2
+        assert pool.stats()["calls"] == 7 and pool.stats()["clients"] == 1
+
+    async def test_failed_delivery_after_turn_error_is_logged(self):
+        async def rejected(request):
+            return web.json_response({"error": {"code": "BadArgument"}}, status=400)
+
+        stub = web.Application()
+        stub.router.add_post("/v3/conversations/{conversation_id}/activities/{activity_id}", rejected)
+        runner = web.AppRunner(stub)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        logs = mock.Mock()
+        conversation_state = ConversationState(MemoryStorage())
+        adapter = AdapterWithErrorHandler(
+            BotFrameworkAdapterSettings("", ""), conversation_state, logs, coalesce_replies=True,
+            merge_channels=["webchat"])
+
+        async def logic(turn_context):
+            await conversation_state.load(turn_context)
+            await turn_context.send_activity("Paris it is.")
+            raise ValueError("turn failed")
+
+        try:
+            # Neither the turn's error nor the failed delivery escapes, both are logged.
+            await adapter.process_activity(Activity(
+                type="message", id="1", text="to Paris", channel_id="webchat",
+                service_url=f"http://127.0.0.1:{runner.addresses[0][1]}",
+                conversation=ConversationAccount(id="failed"),
+                from_property=ChannelAccount(id="user"), recipient=ChannelAccount(id="bot")), "", logic)
+        finally:
+            await runner.cleanup()
+
+        turn_error, delivery = [call.args[0] for call in logs.logger.error.call_args_list]
+        assert "turn failed" in turn_error and "replies failed, 1 lost" in delivery
+        assert adapter.stats()["failed_deliveries"] == 1
+
+
+def test_streaming_multiplexes_conversations():
+    with client.websocket_connect("/api/stream?channelId=webchat") as websocket:
+        assert websocket.receive_json() == {"window": 8}
+        for stream in ("first", "second"):
+            websocket.send_json({"stream": stream, "activity": {
+                "type": "conversationUpdate", "id": "1", "conversation": {"id": stream},
+                "from": {"id": "user"}, "recipient": {"id": "bot"}, "membersAdded": [{"id": "user"}]}})
+        frames = [websocket.receive_json() for _ in range(4)]
+
+    for stream in ("first", "second"):
+        replies, outcome = [frame for frame in frames if frame["stream"] == stream]
+        assert replies["activities"][0]["attachments"][0]["contentType"] == "application/vnd.microsoft.card.adaptive"
+        assert outcome["status"] == 200
+
+
+def test_streaming_credentials_from_browsers():
+    seen = []
+
+    async def authenticate(activity, auth_header):
+        seen.append(auth_header)
+        return ClaimsIdentity({}, True)
+
+    with mock.patch("app.ADAPTER.authenticate_request", authenticate):
+        with client.websocket_connect("/api/stream", subprotocols=["bearer", "header.payload.signature"]) as websocket:
+            assert websocket.accepted_subprotocol == "bearer"
+            assert websocket.receive_json() == {"window": 8}
+        with client.websocket_connect("/api/stream?token=query-token") as websocket:
+            assert websocket.accepted_subprotocol is None
+            websocket.receive_json()
+        with client.websocket_connect("/api/stream", headers={"Authorization": "Bearer header-token"}) as websocket:
+            websocket.receive_json()
+    assert seen == ["Bearer header.payload.signature", "Bearer query-token", "Bearer header-token"]
+
+
+def test_streaming_window():
+    async def run_turn(activity, identity, send_replies):
+        await asyncio.sleep(0.2)
+        await send_replies([Activity(type="message", text=f"echo {activity.text}")])
+        return 200, None
+
+    streaming = StreamingEndpoint(run_turn, window=1)
+    streaming_app = FastAPI()
+
+    @streaming_app.websocket("/stream")
+    async def stream(websocket: WebSocket):
+        await streaming.serve(websocket, ClaimsIdentity({}, True), "webchat")
+
+    with TestClient(streaming_app).websocket_connect("/stream") as websocket:
+        assert websocket.receive_json() == {"window": 1}
+        for text in ("one", "two"):
+            websocket.send_json({"stream": "a", "activity": {"type": "message", "text": text}})
+        websocket.send_text("not json")
+        websocket.send_bytes(b'{"stream": "a"}')
+        frames = [websocket.receive_json() for _ in range(5)]
+
+    assert frames[0]["status"] == 429 and frames[1]["status"] == 400
+    assert frames[2] == {"status": 400, "body": {"message": "Malformed frame: binary frames are not supported"}}
+    assert frames[3] == {"stream": "a", "activities": [{"type": "message", "text": "echo one"}]}
+    assert frames[4] == {"stream": "a", "status": 200, "body": None}
+    assert streaming.stats()["rejected"] == 3 and streaming.stats()["turns"] == 1
+
+
+class BookingAnalyticsTest(aiounittest.AsyncTestCase):
+    async def test_outcomes_routes_budgets_and_funnel(self):
+        analytics = BookingAnalytics(top_routes=1, route_capacity=2)
+
+        async def from_city_step(step_context):
+            return step_context
+
+        async def to_city_step(step_context):
+            return step_context
+
+        from_city, to_city = analytics.track_steps([from_city_step, to_city_step])
+        for _ in range(3):
+            await from_city(None)
+        await to_city(None)
+        for origin, budget, confirmed in (("Paris", "1,500 euros", True), ("paris ", "300", False), ("Rome", None, True)):
+            analytics.booking_finished(BookingDetails(from_city=origin, to_city="London", budget=budget), confirmed)
+
+        total = analytics.flush()
+        assert (total["confirmed"], total["rejected"]) == (2, 1)
+        assert total["top_routes"] == [{"route": "paris->london", "count": 2, "error": 0}]
+        assert (total["budget"]["count"], total["budget"]["p50"]) == (2, 300)
+        assert total["funnel"] == {"from_city_step": {"entered": 3, "dropped": 2},
+                                   "to_city_step": {"entered": 1, "dropped": 0}}
+        assert analytics.snapshot()["interval"]["confirmed"] == 0
+        await to_city(None)
+        assert analytics.snapshot()["interval"]["funnel"]["from_city_step"] == {"entered": 0, "dropped": 0}
+        assert analytics.snapshot()["total"]["confirmed"] == 2
+        assert client.get("/analytics").status_code == 403
+
+        # Past the last bucket there is no bound to report, and inf has no JSON value.
+        analytics.booking_finished(BookingDetails(from_city="Rome", to_city="Oslo", budget="25,000 dollars"), True)
+        budget = analytics.snapshot()["total"]["budget"]
+        assert (budget["p50"], budget["p99"], budget["over_last_bucket"]) == (1500, None, 1)
+        JSONResponse(analytics.snapshot())
+
+    def test_space_saving_keeps_heavy_hitters(self):
+        sketch = SpaceSaving(capacity=2)
+        for item in "aabacad":
+            sketch.add(item)
+        assert sketch.top(1) == [("a", 4, 0)]
+
+
+class CircuitBreakerTest(aiounittest.AsyncTestCase):
+    async def test_open_degrade_and_recover(self):
+        now = [0.0]
+        breaker = CircuitBreaker(window=4, min_calls=4, open_seconds=10, half_open_probes=1, clock=lambda: now[0])
+        recognizer = FlightBookingRecognizer(DefaultConfig())
+        recognizer.breaker = breaker
+        local = LocalRecognizer(LocalRecognizerModel.load("luis_app/localModel.json"))
+        recognizer._fallback = local
+        calls = []
+
+        class FailingRecognizer:
+            async def recognize(self, turn_context):
+                calls.append(turn_context.activity.text)
+                raise ConnectionError("LUIS unreachable")
+
+        recognizer._recognizer = FailingRecognizer()
+        context = TurnContext(TestAdapter(), Activity(type=ActivityTypes.message, text="book a flight to paris"))
+        with self.assertLogs("flight_booking_recognizer", logging.WARNING) as logs:
+            for _ in range(5):
+                result = await recognizer.recognize(context)
+                assert result.properties["degraded"] and result.entities["To"] == ["paris"]
+        assert breaker.state == OPEN and len(calls) == 4 and recognizer.is_degraded
+        assert "recognized by the local model: LUIS unreachable" in logs.output[0]
+
+        # A probe cancelled while half-open gives its slot back.
+        class HangingRecognizer:
+            async def recognize(self, turn_context):
+                await asyncio.sleep(60)
+
+        recognizer._recognizer = HangingRecognizer()
+        now[0] = 10
+        probe = asyncio.ensure_future(recognizer.recognize(context))
+        await asyncio.sleep(0)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+
+        recognizer._recognizer = local
+        result = await recognizer.recognize(context)
+        assert breaker.state == CLOSED and not result.properties.get("degraded")
+        assert breaker.stats()["transitions"] == {"closed->open": 1, "open->half_open": 1, "half_open->closed": 1}
+
+    async def test_failing_fallback_is_logged(self):
+        recognizer = FlightBookingRecognizer(DefaultConfig())
+        recognizer.breaker = CircuitBreaker(min_calls=1, open_seconds=3600)
+        recognizer.breaker.record(False, 0.0)
+        recognizer._fallback = mock.Mock(recognize=mock.AsyncMock(side_effect=ValueError("no model")))
+        context = TurnContext(TestAdapter(), Activity(type=ActivityTypes.message, text="book a flight to paris"))
+        with self.assertLogs("flight_booking_recognizer", logging.WARNING) as logs:
+            result = await recognizer.recognize(context)
+        assert result.properties["degraded"] and result.entities == {}
+        assert "local fallback failed: no model" in logs.output[0] and "LUIS circuit is open" in logs.output[1]
+
+
+def test_lean_activity_materializes_cold_fields_once():
+    body = {
+        "type": "message", "id": "1", "channelId": "msteams", "serviceUrl": "https://smba.example/",
+        "from": {"id": "u", "aadObjectId": "a"}, "conversation": {"id": "c", "isGroup": True},
+        "recipient": {"id": "bot"}, "text": "hello", "entities": [{"type": "mention", "text": "bot"}],
+    }
+    activity = lean_activity(orjson.dumps(body))
+    assert isinstance(activity, LeanActivity)
+    assert activity.from_property.aad_object_id == "a" and activity.conversation.is_group
+    materialized = LeanActivity.materialized
+    activity.text = "changed"
+    assert activity.entities[0].type == "mention" and activity.timestamp is None
+    assert LeanActivity.materialized == materialized + 1
+    assert activity.text == "changed"
+    assert activity.serialize() == Activity.deserialize(dict(body, text="changed")).serialize()
+
+
+def test_lean_activity_keeps_a_body_that_fails_to_deserialize():
+    activity = lean_activity({"type": "message", "text": "hello", "timestamp": "not a date"})
+    materialized = LeanActivity.materialized
+    for _ in range(2):
+        with pytest.raises(DeserializationError):
+            activity.timestamp
+    assert LeanActivity.materialized == materialized and activity.text == "hello"
@@ -0,0 +1,146 @@
+"""Tail-based trace sampling: spans wait for the end of their request before being kept or dropped."""
+
+import logging
+import queue
+import random
+import threading
+import time
+from typing import Callable, Dict, List
+
+from opencensus.trace.base_exporter import Exporter
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TailSamplingExporter(Exporter):
+    """Buffers the spans of each trace until ``finish_trace`` decides whether the trace is exported.
+
+    Failed traces and traces slower than ``slow_threshold`` seconds are always kept, the others
+    with probability ``sample_rate``. Kept spans go through a queue bounded to ``max_queue`` spans
+    to a background thread, which hands them to ``exporter.emit`` by ``batch_size`` or every
+    ``export_interval`` seconds. A full queue drops spans instead of slowing requests down.
+    """
+
+    def __init__(
+        self,
+        exporter: Exporter,
+        sample_rate: float = 0.05,
+        slow_threshold: float = 1.0,
+        max_queue: int = 10000,
+        batch_size: int = 100,
+        export_interval: float = 5.0,
+        random_fn: Callable[[], float] = random.random,
+    ):
+        self._exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.batch_size = batch_size
+        self.export_interval = export_interval
+        self._random = random_fn
+        self._traces: Dict[str, List] = {}
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.traces = 0
+        self.kept_errors = 0
+        self.kept_slow = 0
+        self.kept_sampled = 0
+        self.exported_spans = 0
+        self.dropped_spans = 0
+        self.orphan_spans = 0
+        self.export_failures = 0
+
+    def start_trace(self, trace_id: str) -> None:
+        self._traces[trace_id] = []
+
+    def export(self, span_datas) -> None:
+        # Called by the tracer as each span ends, the root span of a request ends last.
+        for span_data in span_datas:
+            spans = self._traces.get(span_data.context.trace_id)
+            if spans is None:
+                self.orphan_spans += 1
+            else:
+                spans.append(span_data)
+
+    def emit(self, span_datas) -> None:
+        self._exporter.emit(span_datas)
+
+    def finish_trace(self, trace_id: str, error: bool, seconds: float) -> bool:
+        """Keep or drop the spans of a finished request, returns whether they are exported."""
+        spans = self._traces.pop(trace_id, [])
+        self.traces += 1
+        if error:
+            self.kept_errors += 1
+        elif seconds >= self.slow_threshold:
+            self.kept_slow += 1
+        elif self._random() < self.sample_rate:
+            self.kept_sampled += 1
+        else:
+            self.dropped_spans += len(spans)
+            return False
+
+        self._ensure_thread()
+        for span_data in spans:
+            try:
+                self._queue.put_nowait(span_data)
+            except queue.Full:
+                self.dropped_spans += 1
+        return True
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._work, name="tail-sampling-exporter", daemon=True)
+                    self._thread.start()
+
+    def _work(self) -> None:
+        while True:
+            batch = []
+            flush = None
+            deadline = time.monotonic() + self.export_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    flush = item
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self._exporter.emit(batch)
+                    self.exported_spans += len(batch)
+                except Exception as error:
+                    self.export_failures += 1
+                    self.dropped_spans += len(batch)
+                    LOGGER.error(f"[TailSamplingExporter]: export of {len(batch)} spans failed: {error}")
+            if flush is not None:
+                flush.set()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Export everything queued so far, e.g. on shutdown. Blocks, run it off the event loop."""
+        if self._thread is None:
+            return True
+        # The event wakes the export thread up once everything queued before it is in a batch.
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "traces": self.traces,
+            "open_traces": len(self._traces),
+            "kept_errors": self.kept_errors,
+            "kept_slow": self.kept_slow,
+            "kept_sampled": self.kept_sampled,
+            "queued_spans": self._queue.qsize(),
+            "exported_spans": self.exported_spans,
+            "dropped_spans": self.dropped_spans,
+            "orphan_spans": self.orphan_spans,
+            "export_failures": self.export_failures,
+        }
@@ -0,0 +1,85 @@
+"""Runs the turns of a conversation one after the other and different conversations concurrently."""
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+class TurnScheduler:
+    """Mailbox per conversation drained by its own task, at most ``max_concurrency`` turns running at once.
+
+    A turn only starts when the previous turn of its conversation finished, so the state it loads
+    already holds what that turn saved.
+    """
+
+    def __init__(self, max_concurrency: int = 64):
+        if max_concurrency <= 0:
+            raise ValueError("[TurnScheduler]: max_concurrency must be positive")
+        self.max_concurrency = max_concurrency
+        # Created on first use so it belongs to the loop serving the requests.
+        self._semaphore = None
+        self._mailboxes: Dict[Hashable, deque] = {}
+        self._tasks = set()
+        self.queued = 0
+        self.running = 0
+        self.turns = 0
+        self.max_queue_depth = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    async def run(self, conversation_id: Hashable, turn: Callable[[], Awaitable]):
+        """Queue ``turn`` behind the other turns of the conversation and return its result."""
+        loop = asyncio.get_event_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        future = loop.create_future()
+        mailbox = self._mailboxes.get(conversation_id)
+        if mailbox is None:
+            mailbox = self._mailboxes[conversation_id] = deque()
+            task = loop.create_task(self._drain(conversation_id, mailbox))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        mailbox.append((turn, future, time.perf_counter()))
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, len(mailbox))
+        return await future
+
+    async def _drain(self, conversation_id: Hashable, mailbox: deque) -> None:
+        try:
+            while mailbox:
+                turn, future, queued_at = mailbox.popleft()
+                async with self._semaphore:
+                    self.queued -= 1
+                    if future.done():
+                        # The request went away while waiting, e.g. the client disconnected.
+                        continue
+                    wait = time.perf_counter() - queued_at
+                    self.wait_seconds += wait
+                    self.max_wait_seconds = max(self.max_wait_seconds, wait)
+                    self.running += 1
+                    try:
+                        result = await turn()
+                    except Exception as error:
+                        if not future.done():
+                            future.set_exception(error)
+                    else:
+                        if not future.done():
+                            future.set_result(result)
+                    finally:
+                        self.running -= 1
+                        self.turns += 1
+        finally:
+            # No await since the last emptiness check, so no turn can have been queued in between.
+            del self._mailboxes[conversation_id]
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._mailboxes),
+            "queued": self.queued,
+            "running": self.running,
+            "turns": self.turns,
+            "max_queue_depth": self.max_queue_depth,
+            "mean_wait_seconds": self.wait_seconds / self.turns if self.turns else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
@@ -0,0 +1,168 @@
+"""Worker warm-up: the imports, models and connections the first turns would otherwise pay for.
+
+``preload`` imports and initializes what processes can share: it starts no thread and opens no
+connection, so it can run in the gunicorn master before workers fork (see gunicorn.conf.py), which
+then inherit its pages copy-on-write. ``WarmStart`` runs in each worker: it preloads, a no-op when
+the master already did, opens the pooled connections and takes a synthetic conversation through the
+bot, so every dialog, prompt and state path has run once before the worker reports ready. The
+conversation never reaches LUIS: its one recognized utterance gets a canned answer.
+"""
+
+import asyncio
+import importlib
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict
+
+from botbuilder.core import IntentScore, RecognizerResult, TurnContext
+from botbuilder.core.adapters import TestAdapter
+from botbuilder.schema import Activity, ActivityTypes, ChannelAccount, ConversationAccount
+
+from booking_analytics import BookingAnalytics
+from bots.dialog_bot import DialogBot
+from flight_booking_recognizer import FlightBookingRecognizer
+from helpers.card_template import preload_card_templates
+
+LOGGER = logging.getLogger(__name__)
+
+# Imported by the first turn otherwise: the dialogs and their prompts, the recognizers-text models
+# behind DateTimePrompt and ConfirmPrompt, the timex parser and the App Insights exporters.
+PRELOADED_MODULES = (
+    "botbuilder.dialogs",
+    "botbuilder.dialogs.prompts",
+    "recognizers_text",
+    "recognizers_date_time",
+    "recognizers_choice",
+    "recognizers_number",
+    "datatypes_date_time",
+    "opencensus.ext.azure.trace_exporter",
+    "opencensus.ext.azure.log_exporter",
+)
+
+# The synthetic user's side of the conversation: a booking taken up to its confirmation, then
+# cancelled, so that it is never booked nor logged.
+CONVERSATION = (
+    "book a flight from paris to london",
+    "august 12 2030",
+    "august 20 2030",
+    "500 euros",
+    "cancel",
+)
+# What LUIS would answer the utterance MainDialog recognizes. A real prediction on every worker start
+# would cost quota, show in the LUIS logs and recordings, and count towards the circuit breaker.
+RECOGNIZED = {
+    CONVERSATION[0]: RecognizerResult(
+        text=CONVERSATION[0],
+        intents={"BookFlight": IntentScore(score=1.0)},
+        entities={"From": ["paris"], "To": ["london"]},
+    ),
+}
+
+
+def preload() -> Dict[str, float]:
+    """Seconds each step took, close to nothing for the steps this process, or its parent, already ran."""
+    profile = {}
+
+    def timed(name: str, step: Callable):
+        start = time.perf_counter()
+        result = step()
+        profile[name] = time.perf_counter() - start
+        return result
+
+    modules = {name: timed(f"import {name}", lambda: importlib.import_module(name)) for name in PRELOADED_MODULES}
+    # A culture's models are built on first use and kept by recognizers-text, half a second for datetime.
+    english = modules["recognizers_text"].Culture.English
+    timed("datetime model", lambda: modules["recognizers_date_time"].recognize_datetime("august 12 2030", english))
+    timed("boolean model", lambda: modules["recognizers_choice"].recognize_boolean("yes", english))
+    timed("number model", lambda: modules["recognizers_number"].recognize_number("1", english))
+    timed("timex parser", lambda: modules["datatypes_date_time"].Timex("2030-08-12"))
+    timed("card templates", preload_card_templates)
+    return profile
+
+
+class WarmStart:
+    """Warms a worker up once, from its event loop, and tells whether it is done.
+
+    ``run`` preloads, awaits each of ``connects``, by name, and sends ``CONVERSATION`` through
+    ``bot.on_turn`` on an in-memory adapter, as a conversation of its own whose state is deleted at
+    the end, with the recognizer answering from ``RECOGNIZED``. It never fails the worker: past an error or ``timeout`` the warm-up stops and the worker
+    serves cold.
+    """
+
+    def __init__(self, bot: DialogBot, connects: Dict[str, Callable[[], Awaitable]] = None, timeout: float = 30.0):
+        self.bot = bot
+        self.connects = connects or {}
+        self.timeout = timeout
+        self.profile: Dict[str, float] = {}
+        self.replies = 0
+        self.error = None
+        self.done = False
+        self._task = None
+
+    def start(self) -> None:
+        """Run the warm-up in the background of the running loop."""
+        self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run(self) -> None:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._warm_up(), self.timeout)
+        except Exception as error:
+            self.error = f"{type(error).__name__}: {error}"
+            LOGGER.warning(f"[WarmStart]: warm-up stopped early: {self.error}")
+        finally:
+            self.profile["total"] = time.perf_counter() - start
+            self.done = True
+
+    async def _warm_up(self) -> None:
+        # Blocks the loop for a second or so on a cold worker, which is not in rotation yet.
+        self.profile.update(preload())
+        for name, connect in self.connects.items():
+            start = time.perf_counter()
+            try:
+                await connect()
+            except Exception as error:
+                # An unreachable service is not a reason to stay unready, the first turn will retry.
+                LOGGER.warning(f"[WarmStart]: connecting to {name} failed: {error}")
+            self.profile[f"connect {name}"] = time.perf_counter() - start
+
+        adapter = TestAdapter(template_or_conversation=Activity(
+            channel_id="warm-start",
+            service_url="https://warm-start.invalid",
+            from_property=ChannelAccount(id="warm-start-user", name="user"),
+            recipient=ChannelAccount(id="bot", name="Bot"),
+            conversation=ConversationAccount(id=f"warm-start-{os.getpid()}"),
+        ))
+        activities = [Activity(
+            type=ActivityTypes.conversation_update,
+            members_added=[ChannelAccount(id="warm-start-user", name="user")])]
+        activities += [Activity(type=ActivityTypes.message, text=text) for text in CONVERSATION]
+        with BookingAnalytics.untracked(), FlightBookingRecognizer.canned(RECOGNIZED):
+            for number, activity in enumerate(activities, 1):
+                start = time.perf_counter()
+                last = number == len(activities)
+                await adapter.process_activity(activity, lambda context: self._turn(context, last))
+                self.profile[f"turn {number}"] = time.perf_counter() - start
+        self.replies = len(adapter.activity_buffer)
+
+    async def _turn(self, turn_context: TurnContext, last: bool) -> None:
+        await self.bot.on_turn(turn_context)
+        if last:
+            for state in (self.bot.conversation_state, self.bot.user_state):
+                await state.load(turn_context)
+                await state.delete(turn_context)
+
+    def stats(self) -> dict:
+        return {
+            "done": self.done,
+            "failed": self.error is not None,
+            "seconds": self.profile.get("total", 0.0),
+            "replies": self.replies,
+        }